@@ -0,0 +1,104 @@
+"""Benchmark the streaming decode of a Todoist full sync against `json.loads`
+
+Usage:
+    python benchmarks/bench_json_stream.py [--items 50000] [--chunk-size 65536]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'src'))
+
+from json_stream import iter_array
+
+
+def synthetic_payload(n_items):
+    """Build a full sync response with `n_items` items
+
+    Args:
+        n_items (int): number of items
+
+    Returns:
+        bytes: encoded response
+    """
+
+    items = []
+    for i in range(n_items):
+        items.append({
+            'id': str(6000000000 + i),
+            'v2_id': f'6X{i:014d}',
+            'user_id': '12345678',
+            'project_id': str(2200000000 + i % 40),
+            'section_id': None,
+            'parent_id': None,
+            'content': f'Task number {i} with a reasonably long title to look like a real one',
+            'description': 'Some notes about the task.\n' * (i % 5),
+            'priority': 1 + i % 4,
+            'due': None if i % 3 else {'date': '2023-05-17', 'is_recurring': i % 9 == 0, 'string': 'every day', 'lang': 'en'},
+            'labels': ['work', 'next_action'] if i % 2 else [],
+            'checked': i % 7 == 0,
+            'is_deleted': False,
+            'child_order': i,
+            'collapsed': False,
+            'added_at': '2023-01-01T10:00:00.000000Z',
+            'completed_at': None,
+        })
+
+    projects = [{'id': str(2200000000 + i), 'name': f'Project {i}', 'is_deleted': False} for i in range(40)]
+    data = {'full_sync': True, 'projects': projects, 'labels': [], 'items': items, 'sync_token': 'x' * 80}
+    return json.dumps(data).encode('utf-8')
+
+
+def chunked(payload, chunk_size):
+    for i in range(0, len(payload), chunk_size):
+        yield payload[i:i + chunk_size]
+
+
+def measure(name, decode):
+    """Run a decode function, reporting time to first item, total time and peak memory
+
+    Args:
+        name (str): benchmark name
+        decode (callable): function yielding the items
+    """
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    count = 0
+
+    for _ in decode():
+        if first is None:
+            first = time.perf_counter() - start
+        count += 1
+
+    total = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{name:<10} items: {count:>7}  first item: {first * 1000:9.2f} ms  total: {total:7.2f} s  peak memory: {peak / 2**20:8.2f} MiB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=65536)
+    args = parser.parse_args()
+
+    payload = synthetic_payload(args.items)
+    print(f'Payload: {args.items} items, {len(payload) / 2**20:.2f} MiB')
+
+    # the payload itself isn't counted: both decoders read it from the same chunks
+    def full_decode():
+        data = json.loads(b''.join(chunked(payload, args.chunk_size)))
+        yield from data['items']
+
+    def streamed_decode():
+        yield from iter_array(chunked(payload, args.chunk_size), 'items', {})
+
+    measure('json.loads', full_decode)
+    measure('streamed', streamed_decode)
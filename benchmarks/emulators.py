@@ -0,0 +1,621 @@
+"""Local emulators of the Notion and Todoist APIs used by NotionSync
+
+Only the subset of the APIs used by the project is emulated:
+- Notion: databases.retrieve, databases.query (filters, sorts and pagination), pages.create,
+  pages.update, blocks.retrieve, blocks.children.list, blocks.children.append, blocks.delete
+- Todoist Sync v9: /sync (sync tokens, resource types and commands), /items/get
+
+Both run an HTTP server on localhost in a background thread, with a configurable latency
+and a configurable rate of injected 429 responses, and count the calls per endpoint.
+"""
+
+import datetime
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PLAIN_ANNOTATIONS = {'bold': False, 'italic': False, 'strikethrough': False, 'underline': False, 'code': False, 'color': 'default'}
+
+
+def now_iso():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def parse_date(value):
+    """Parse an ISO date or datetime, naive values are considered UTC"""
+
+    value = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+class Emulator:
+    """Base class of the emulators: HTTP server, latency, 429 and outage injection and call counters
+
+    Attributes:
+        latency (float): seconds added to every request
+        error_rate (float): probability of answering a request with a 429
+        failures (dict): {endpoint: HTTP status} of the endpoints answering with an error, e.g. {"POST /v1/pages": 503}
+        calls (collections.Counter): calls per endpoint
+        errors (collections.Counter): injected 429 per endpoint
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.failures = {}
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.bytes_sent = 0
+        self.server = None
+
+
+    def start(self, port=0):
+        """Start the server in a background thread
+
+        Args:
+            port (int, optional): port, a free one if 0. Defaults to 0.
+
+        Returns:
+            str: base url of the server
+        """
+
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                emulator.handle(self, 'GET')
+
+            def do_POST(self):
+                emulator.handle(self, 'POST')
+
+            def do_PATCH(self):
+                emulator.handle(self, 'PATCH')
+
+            def do_DELETE(self):
+                emulator.handle(self, 'DELETE')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.errors.clear()
+            self.bytes_sent = 0
+
+
+    def handle(self, request, method):
+        """Handle a request: parse it, apply latency and 429 injection, route it and send the response"""
+
+        url = urlparse(request.path)
+        query = parse_qs(url.query)
+        length = int(request.headers.get('Content-Length') or 0)
+        body = json.loads(request.rfile.read(length)) if length else {}
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        endpoint = self.endpoint_name(method, url.path)
+
+        with self.lock:
+            self.calls[endpoint] += 1
+
+            if endpoint in self.failures:
+                status, data = self.failed(self.failures[endpoint])
+            elif self.error_rate > 0 and self.random.random() < self.error_rate:
+                self.errors[endpoint] += 1
+                status, data = self.rate_limited()
+            else:
+                try:
+                    status, data = self.route(method, url.path, query, body)
+                except KeyError as e:
+                    status, data = self.not_found(str(e))
+
+            payload = json.dumps(data).encode('utf-8')
+            self.bytes_sent += len(payload)
+
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            request.send_header('Retry-After', '1')
+        request.end_headers()
+        request.wfile.write(payload)
+
+
+    def endpoint_name(self, method, path):
+        raise NotImplementedError
+
+
+    def route(self, method, path, query, body):
+        raise NotImplementedError
+
+
+    def rate_limited(self):
+        raise NotImplementedError
+
+
+    def failed(self, status):
+        raise NotImplementedError
+
+
+    def not_found(self, message):
+        raise NotImplementedError
+
+
+class NotionEmulator(Emulator):
+    """Emulator of the Notion API
+
+    Databases are created with `add_database`, with a schema {property_name: property_type}.
+    Pages get the default value of every property missing from the create request, and their
+    `last_edited_time` is rounded to the minute like on Notion.
+    """
+
+    page_size = 100
+
+    empty_values = {
+        'title': [],
+        'rich_text': [],
+        'select': None,
+        'multi_select': [],
+        'date': None,
+        'relation': [],
+        'checkbox': False,
+        'number': None,
+    }
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(latency, error_rate, seed)
+        self.databases = {}
+        self.pages = {}
+        self.blocks = {}
+
+
+    def add_database(self, schema, database_id=None):
+        """Create a database
+
+        Args:
+            schema (dict): {property_name: property_type}
+            database_id (str, optional): id of the database. Defaults to a random one.
+
+        Returns:
+            str: database id
+        """
+
+        database_id = database_id or uuid.uuid4().hex
+        self.databases[database_id] = {
+            'object': 'database',
+            'id': database_id,
+            'properties': {name: {'id': f'p{i}', 'name': name, 'type': kind} for i, (name, kind) in enumerate(schema.items())}
+        }
+        return database_id
+
+
+    def create_page(self, database_id, properties, children=None, icon=None):
+        """Create a page in a database, as pages.create does
+
+        Returns:
+            dict: page
+        """
+
+        schema = self.databases[database_id]['properties']
+        edited = self.edit_time()
+
+        page = {
+            'object': 'page',
+            'id': str(uuid.uuid4()),
+            'created_time': edited,
+            'last_edited_time': edited,
+            'archived': False,
+            'icon': icon,
+            'parent': {'type': 'database_id', 'database_id': database_id},
+            'properties': {},
+        }
+
+        for name, definition in schema.items():
+            page['properties'][name] = {'id': definition['id'], 'type': definition['type'], definition['type']: self.empty_values.get(definition['type'])}
+
+        self.set_properties(page, properties)
+        self.pages[page['id']] = page
+        self.blocks[page['id']] = [self.create_block(b) for b in children or []]
+        return page
+
+
+    def update_page(self, page_id, properties=None, archived=None, icon=None):
+        page = self.pages[page_id]
+        self.set_properties(page, properties or {})
+
+        if archived is not None:
+            page['archived'] = archived
+        if icon is not None:
+            page['icon'] = icon
+
+        page['last_edited_time'] = self.edit_time()
+        return page
+
+
+    def set_properties(self, page, properties):
+        for name, value in properties.items():
+            kind = page['properties'][name]['type']
+            value = value[kind]
+
+            # add the plain text like the API does
+            if kind in ('title', 'rich_text'):
+                value = [dict(v, type='text', plain_text=v['text']['content']) for v in value]
+
+            page['properties'][name][kind] = value
+
+
+    def create_block(self, block):
+        block = dict(block, id=str(uuid.uuid4()), has_children=False, archived=False, created_time=now_iso(), last_edited_time=now_iso())
+
+        # add the plain text and the annotations of the rich text like the API does
+        content = block.get(block.get('type'))
+        if isinstance(content, dict) and 'rich_text' in content:
+            content = dict(content, rich_text=[dict(v, type='text', plain_text=v['text']['content'], href=None, annotations=dict(PLAIN_ANNOTATIONS))
+                                               for v in content['rich_text']])
+            block[block['type']] = content
+
+        return block
+
+
+    def edit_time(self):
+        return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:00.000Z')
+
+
+    def endpoint_name(self, method, path):
+        path = re.sub(r'/[0-9a-f-]{32,36}', '/{id}', path)
+        return f'{method} {path}'
+
+
+    def route(self, method, path, query, body):
+        parts = path.strip('/').split('/')[1:]   # drop the "v1" prefix
+
+        if parts[0] == 'databases' and len(parts) == 2 and method == 'GET':
+            return 200, self.databases[parts[1]]
+
+        if parts[0] == 'databases' and len(parts) == 3 and parts[2] == 'query':
+            return 200, self.query(parts[1], body, query.get('filter_properties'))
+
+        if parts[0] == 'pages' and len(parts) == 1 and method == 'POST':
+            page = self.create_page(body['parent']['database_id'], body.get('properties', {}), body.get('children'), body.get('icon'))
+            return 200, page
+
+        if parts[0] == 'pages' and len(parts) == 2 and method == 'PATCH':
+            return 200, self.update_page(parts[1], body.get('properties'), body.get('archived'), body.get('icon'))
+
+        if parts[0] == 'pages' and len(parts) == 2 and method == 'GET':
+            return 200, self.pages[parts[1]]
+
+        if parts[0] == 'blocks' and len(parts) == 3 and parts[2] == 'children' and method == 'PATCH':
+            children = self.blocks.setdefault(parts[1], [])
+            children.extend(self.create_block(b) for b in body.get('children', []))
+            return 200, self.list_page(children, 0, len(children))
+
+        if parts[0] == 'blocks' and len(parts) == 3 and parts[2] == 'children':
+            children = self.blocks.get(parts[1], [])
+            start = int(query.get('start_cursor', ['0'])[0])
+            size = int(query.get('page_size', [str(self.page_size)])[0])
+            return 200, self.list_page(children, start, size)
+
+        if parts[0] == 'blocks' and len(parts) == 2 and method == 'DELETE':
+            # deleting a page block archives the page
+            if parts[1] in self.pages:
+                return 200, self.update_page(parts[1], archived=True)
+
+            for children in self.blocks.values():
+                for block in children:
+                    if block['id'] == parts[1]:
+                        block['archived'] = True
+                        children.remove(block)
+                        return 200, block
+
+            raise KeyError(parts[1])
+
+        if parts[0] == 'blocks' and len(parts) == 2 and method == 'GET':
+            if parts[1] in self.pages:
+                return 200, {'object': 'block', 'id': parts[1], 'type': 'child_page', 'has_children': bool(self.blocks.get(parts[1]))}
+            raise KeyError(parts[1])
+
+        raise KeyError(path)
+
+
+    def query(self, database_id, body, filter_properties=None):
+        self.databases[database_id]
+
+        pages = [p for p in self.pages.values()
+                 if p['parent']['database_id'] == database_id and not p['archived']
+                 and ('filter' not in body or self.matches(p, body['filter']))]
+
+        for sort in reversed(body.get('sorts', [])):
+            pages.sort(key=lambda p: self.sort_key(p, sort), reverse=sort.get('direction') == 'descending')
+
+        if filter_properties is not None:
+            ids = set(filter_properties)
+            pages = [dict(p, properties={k: v for k, v in p['properties'].items() if v['id'] in ids or k in ids}) for p in pages]
+
+        start = int(body.get('start_cursor') or 0)
+        return self.list_page(pages, start, body.get('page_size', self.page_size))
+
+
+    def list_page(self, results, start, size):
+        end = start + size
+        has_more = end < len(results)
+        return {
+            'object': 'list',
+            'results': results[start:end],
+            'has_more': has_more,
+            'next_cursor': str(end) if has_more else None,
+        }
+
+
+    def matches(self, page, condition):
+        """Evaluate a query filter on a page"""
+
+        if 'and' in condition:
+            return all(self.matches(page, c) for c in condition['and'])
+
+        if 'or' in condition:
+            return any(self.matches(page, c) for c in condition['or'])
+
+        if 'timestamp' in condition:
+            value = page[condition['timestamp']]
+            return self.compare_dates(value, condition[condition['timestamp']])
+
+        prop = page['properties'][condition['property']]
+        value = prop[prop['type']]
+
+        if 'rich_text' in condition or 'title' in condition:
+            text = ''.join(v['plain_text'] for v in value)
+            check = condition.get('rich_text') or condition.get('title')
+            if 'equals' in check:
+                return text == check['equals']
+            if 'contains' in check:
+                return check['contains'] in text
+            if 'is_empty' in check:
+                return text == ''
+
+        if 'date' in condition:
+            if value is None:
+                return False
+            return self.compare_dates(value['start'], condition['date'])
+
+        if 'multi_select' in condition:
+            return condition['multi_select']['contains'] in [v['name'] for v in value]
+
+        if 'select' in condition:
+            return value is not None and value['name'] == condition['select']['equals']
+
+        if 'checkbox' in condition:
+            return value == condition['checkbox']['equals']
+
+        if 'relation' in condition:
+            return condition['relation']['contains'] in [v['id'] for v in value]
+
+        raise KeyError(f'Unsupported filter: {condition}')
+
+
+    def compare_dates(self, value, check):
+        value = parse_date(value)
+
+        if 'on_or_after' in check and value < parse_date(check['on_or_after']):
+            return False
+        if 'on_or_before' in check and value > parse_date(check['on_or_before']):
+            return False
+        if 'after' in check and value <= parse_date(check['after']):
+            return False
+        if 'before' in check and value >= parse_date(check['before']):
+            return False
+
+        return True
+
+
+    def sort_key(self, page, sort):
+        if 'timestamp' in sort:
+            return page[sort['timestamp']]
+
+        prop = page['properties'][sort['property']]
+        value = prop[prop['type']]
+
+        if prop['type'] == 'date':
+            return value['start'] if value else ''
+
+        return json.dumps(value, sort_keys=True)
+
+
+    def rate_limited(self):
+        return 429, {'object': 'error', 'status': 429, 'code': 'rate_limited', 'message': 'You have been rate limited. Please try again in a few minutes.'}
+
+
+    def not_found(self, message):
+        return 404, {'object': 'error', 'status': 404, 'code': 'object_not_found', 'message': f'Could not find object with ID: {message}'}
+
+
+    def failed(self, status):
+        code = 'service_unavailable' if status >= 500 else 'validation_error'
+        return status, {'object': 'error', 'status': status, 'code': code, 'message': f'Injected error {status}'}
+
+
+class TodoistEmulator(Emulator):
+    """Emulator of the Todoist Sync API v9
+
+    Every change increments a sequence number: the sync token is the sequence number of the
+    last change returned, so an incremental sync returns the objects changed after it.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        super().__init__(latency, error_rate, seed)
+        self.sequence = 0
+        self.items = {}
+        self.projects = {}
+        self.labels = {}
+        self.next_id = 6000000000
+
+
+    def new_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+
+    def touch(self, obj):
+        self.sequence += 1
+        obj['_sequence'] = self.sequence
+
+
+    def add_project(self, name):
+        project = {'id': self.new_id(), 'name': name, 'is_deleted': False, 'is_archived': False}
+        self.touch(project)
+        self.projects[project['id']] = project
+        return project['id']
+
+
+    def add_label(self, name):
+        label = {'id': self.new_id(), 'name': name, 'is_deleted': False}
+        self.touch(label)
+        self.labels[label['id']] = label
+        return label['id']
+
+
+    def add_item(self, args):
+        item = {
+            'id': self.new_id(),
+            'content': args.get('content', ''),
+            'description': args.get('description', ''),
+            'priority': args.get('priority', 1),
+            'due': None,
+            'project_id': args.get('project_id') or next(iter(self.projects), None),
+            'labels': args.get('labels', []),
+            'checked': args.get('checked', False),
+            'is_deleted': False,
+            'added_at': now_iso(),
+        }
+        self.set_due(item, args.get('due'))
+        self.touch(item)
+        self.items[item['id']] = item
+        return item
+
+
+    def update_item(self, args):
+        item = self.items[args['id']]
+
+        for key in ('content', 'description', 'priority', 'labels', 'checked', 'project_id'):
+            if key in args:
+                item[key] = args[key]
+
+        if 'due' in args:
+            self.set_due(item, args['due'])
+
+        self.touch(item)
+        return item
+
+
+    def delete_item(self, args):
+        item = self.items[args['id']]
+        item['is_deleted'] = True
+        self.touch(item)
+        return item
+
+
+    def set_due(self, item, due):
+        if not due or ('date' not in due and 'string' not in due):
+            item['due'] = None
+            return
+
+        date = due.get('date') or datetime.date.today().isoformat()
+        item['due'] = {'date': date, 'is_recurring': due.get('is_recurring', False), 'string': due.get('string', date), 'lang': 'en'}
+
+
+    def public(self, obj):
+        return {k: v for k, v in obj.items() if not k.startswith('_')}
+
+
+    def endpoint_name(self, method, path):
+        return f'{method} {path}'
+
+
+    def route(self, method, path, query, body):
+        endpoint = path.rsplit('/', 1)[-1]
+
+        if endpoint == 'sync':
+            params = body if method == 'POST' else {k: v[0] for k, v in query.items()}
+            return self.sync(params)
+
+        if endpoint == 'get' and path.endswith('/items/get'):
+            item = self.items.get(query['item_id'][0])
+            if item is None or item['is_deleted']:
+                return 404, {'error': 'Item not found', 'error_code': 22, 'http_code': 404}
+            return 200, {'item': self.public(item), 'project': self.public(self.projects[item['project_id']])}
+
+        raise KeyError(path)
+
+
+    def sync(self, params):
+        response = {}
+
+        commands = params.get('commands', [])
+        if commands:
+            response['sync_status'] = {}
+            response['temp_id_mapping'] = {}
+
+            handlers = {'item_add': self.add_item, 'item_update': self.update_item, 'item_delete': self.delete_item}
+
+            for command in commands:
+                try:
+                    item = handlers[command['type']](command['args'])
+                    response['sync_status'][command['uuid']] = 'ok'
+                    if 'temp_id' in command:
+                        response['temp_id_mapping'][command['temp_id']] = item['id']
+                except KeyError:
+                    response['sync_status'][command['uuid']] = {'error': 'Item not found', 'error_code': 22}
+
+        token = params.get('sync_token', '*')
+        resource_types = params.get('resource_types') or []
+        if isinstance(resource_types, str):
+            resource_types = json.loads(resource_types)
+
+        full_sync = token == '*'
+        since = 0 if full_sync else int(token)
+
+        resources = {'items': self.items, 'projects': self.projects, 'labels': self.labels}
+        for name in resource_types:
+            if name in resources:
+                response[name] = [self.public(o) for o in resources[name].values()
+                                  if o['_sequence'] > since and not (full_sync and o['is_deleted'])]
+
+        response['full_sync'] = full_sync
+        response['sync_token'] = str(self.sequence)
+        return 200, response
+
+
+    def rate_limited(self):
+        return 429, {'error': 'Too many requests', 'error_code': 35, 'http_code': 429}
+
+
+    def failed(self, status):
+        return status, {'error': f'Injected error {status}', 'error_code': 0, 'http_code': status}
+
+
+    def not_found(self, message):
+        return 404, {'error': 'Not found', 'error_code': 404, 'http_code': 404}
@@ -0,0 +1,180 @@
+"""Run full TodoistSync cycles against the local Notion and Todoist emulators
+
+The first cycle is the backfill of the seeded Todoist items, the following ones sync
+a number of items edited on both sides between cycles. For every cycle it reports
+the items/s, the API calls per item and the injected 429s.
+
+Usage:
+    python benchmarks/load_generator.py [--items 1000] [--cycles 3] [--changes 50]
+                                        [--latency 0.02] [--error-rate 0.0]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'src'))
+
+import toml
+from emulators import NotionEmulator, TodoistEmulator
+from config import Config
+from todoist_sync import TodoistSync
+
+KEY = 'secret_emulator'
+
+TASKS_SCHEMA = {
+    'Nome': 'title',
+    'Id': 'rich_text',
+    'Priorità': 'select',
+    'Data': 'date',
+    'Progetto': 'relation',
+    'Ricorrenza': 'rich_text',
+    'Tags': 'multi_select',
+    'Fatto': 'checkbox',
+}
+
+CALENDAR_SCHEMA = {
+    'Nome': 'title',
+    'Id': 'rich_text',
+    'Data': 'date',
+    'Intervallo': 'date',
+    'Tags': 'multi_select',
+    'Ore': 'number',
+    'Progetto': 'relation',
+}
+
+
+def seed(notion, todoist, n_items, n_projects=20):
+    """Create the Notion databases and the Todoist projects, labels and items
+
+    Returns:
+        dict: Notion database ids
+    """
+
+    databases = {
+        'projects_db': notion.add_database({'Nome': 'title'}),
+        'tasks_db': notion.add_database(TASKS_SCHEMA),
+        'calendar_db': notion.add_database(CALENDAR_SCHEMA),
+        'mail_db': notion.add_database({'Nome': 'title'}),
+    }
+
+    project_ids = []
+    for i in range(n_projects):
+        name = f'Project {i}'
+        notion.create_page(databases['projects_db'], {'Nome': {'title': [{'text': {'content': name}}]}})
+        project_ids.append(todoist.add_project(name))
+
+    todoist.add_label('work')
+    todoist.add_label('next_action')
+
+    for i in range(n_items):
+        todoist.add_item({
+            'content': f'Task {i}',
+            'description': 'Some notes' if i % 3 == 0 else '',
+            'priority': 1 + i % 4,
+            'project_id': project_ids[i % n_projects],
+            'labels': ['work'] if i % 2 else [],
+            'due': {'date': '2023-06-01'} if i % 5 == 0 else None,
+        })
+
+    return databases
+
+
+def write_config(folder, notion_url, todoist_url, databases):
+    config = {
+        'notion': dict(databases, key=KEY, base_url=notion_url, rate=1000, burst=50),
+        'calendar': {'ignore': []},
+        'todoist': {'key': KEY, 'endpoint': todoist_url + '/sync/v9'},
+        'backfill': {'workers': 4, 'rate': 1000},
+        'logs': {'keep_for_days': 7},
+        'misc': {'timezone': 'Europe/Rome'},
+    }
+
+    with open(os.path.join(folder, 'config.toml'), 'w') as f:
+        toml.dump(config, f)
+
+
+def edit(notion, todoist, databases, n_changes, rng):
+    """Edit items on both sides between two cycles
+
+    Returns:
+        int: number of edited items
+    """
+
+    with todoist.lock:
+        items = [i for i in todoist.items.values() if not i['is_deleted']]
+        for item in rng.sample(items, min(n_changes, len(items))):
+            todoist.update_item({'id': item['id'], 'content': item['content'] + ' (edited)'})
+
+    with notion.lock:
+        pages = [p for p in notion.pages.values() if p['parent']['database_id'] == databases['tasks_db'] and not p['archived']]
+        for page in rng.sample(pages, min(n_changes, len(pages))):
+            title = page['properties']['Nome']['title'][0]['plain_text']
+            notion.update_page(page['id'], {'Nome': {'title': [{'text': {'content': title + ' (notion)'}}]}})
+
+    return 2 * n_changes
+
+
+def report(cycle, items, elapsed, notion, todoist, error=None):
+    calls = sum(notion.calls.values()) + sum(todoist.calls.values())
+    errors = sum(notion.errors.values()) + sum(todoist.errors.values())
+    per_item = calls / items if items else 0
+    rate = items / elapsed if elapsed > 0 else 0
+
+    print(f'Cycle {cycle}: {items} items in {elapsed:.2f} s, {rate:.1f} items/s, {calls} calls ({per_item:.2f}/item), {errors} x 429'
+          + (f' - FAILED: {error}' if error else ''))
+
+    top = (notion.calls + todoist.calls).most_common(5)
+    print('    ' + ', '.join(f'{endpoint}: {count}' for endpoint, count in top))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000, help='Todoist items seeded before the first cycle')
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--changes', type=int, default=50, help='items edited on each side between cycles')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='probability of a 429 response')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    rng = random.Random(args.seed)
+
+    notion = NotionEmulator(args.latency, args.error_rate, args.seed)
+    todoist = TodoistEmulator(args.latency, args.error_rate, args.seed)
+    notion_url = notion.start()
+    todoist_url = todoist.start()
+
+    databases = seed(notion, todoist, args.items)
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_config(folder, notion_url, todoist_url, databases)
+        syncer = TodoistSync(Config(data_folder=folder))
+
+        for cycle in range(1, args.cycles + 1):
+            items = args.items if cycle == 1 else edit(notion, todoist, databases, args.changes, rng)
+            notion.reset_counters()
+            todoist.reset_counters()
+
+            error = None
+            start = time.perf_counter()
+            try:
+                syncer.sync()
+            except Exception as e:
+                error = e
+            elapsed = time.perf_counter() - start
+
+            report(cycle, items, elapsed, notion, todoist, error)
+
+    notion.stop()
+    todoist.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+"""Microbenchmarks of the per-item CPU work of the sync, with a regression gate
+
+Every benchmark runs a hot path over a synthetic fixture of 10k items and reports the
+time per item (best of the repeats). The results are compared with the baseline saved
+in benchmarks/baseline.json: the script exits with status 1 if a benchmark is slower
+than the baseline by more than the threshold. The baseline depends on the machine, so
+save it on the machine where the gate runs.
+
+Benchmarks whose module can't be imported on this platform (e.g. Outlook without
+pywin32) are reported as skipped.
+
+Usage:
+    python benchmarks/microbench.py [--items 10000] [--repeat 5] [--threshold 0.25]
+                                    [--only NAME] [--save-baseline]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'src'))
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'baseline.json')
+
+PROJECTS = [f'Project {i}' for i in range(40)]
+
+TEAMS_BODY = ('Agenda of the meeting\r\n\r\nPlease review the document before the call.\r\n\r\n'
+              + '_' * 80 + '\r\nMicrosoft Teams meeting\r\nJoin on your computer or mobile app\r\n' + 'Click here to join\r\n' * 20)
+
+MEET_BODY = ('Google Meet\nJoin with Google Meet: https://meet.google.com/abc-defg-hij\n'
+             'More phone numbers <https://tel.meet/abc-defg-hij>\n\nDescription\nWeekly sync about the project status.\n'
+             'When\nEvery Monday 10:00')
+
+
+# Fixtures
+
+def todoist_items(n):
+    items = []
+    for i in range(n):
+        items.append({
+            'id': str(6000000000 + i),
+            'content': f'Task number {i} with a reasonably long title',
+            'description': 'Some notes about the task' if i % 3 == 0 else '',
+            'priority': 1 + i % 4,
+            'due': None if i % 3 else {'date': '2023-05-17', 'is_recurring': i % 9 == 0, 'string': 'every day', 'lang': 'en'},
+            'project_id': str(2200000000 + i % len(PROJECTS)),
+            'labels': ['work', 'next_action'] if i % 2 else [],
+            'checked': i % 7 == 0,
+            'is_deleted': False,
+        })
+    return items
+
+
+def tasks(n):
+    from records import Task
+
+    result = []
+    for i in range(n):
+        result.append(Task(
+            id=str(6000000000 + i),
+            content=f'Task number {i} with a reasonably long title',
+            description='Some notes about the task' if i % 3 == 0 else '',
+            priority=1 + i % 4,
+            due=datetime.date(2023, 5, 17) if i % 3 == 0 else None,
+            project=PROJECTS[i % len(PROJECTS)],
+            labels=['work', 'next_action'] if i % 2 else [],
+            checked=i % 7 == 0,
+            recurrence='every day' if i % 9 == 0 else None,
+        ))
+    return result
+
+
+def notion_pages(n):
+    pages = []
+    for i in range(n):
+        pages.append({
+            'object': 'page',
+            'id': f'00000000-0000-0000-0000-{i:012d}',
+            'last_edited_time': '2023-05-17T10:00:00.000Z',
+            'archived': False,
+            'properties': {
+                'Id': {'rich_text': [{'type': 'text', 'text': {'content': str(6000000000 + i)}, 'plain_text': str(6000000000 + i)}]},
+                'Nome': {'title': [{'type': 'text', 'text': {'content': f'Task number {i}'}, 'plain_text': f'Task number {i}'}]},
+                'Priorità': {'select': {'name': str(1 + i % 3)} if i % 4 else None},
+                'Data': {'date': {'start': '2023-05-17'} if i % 3 == 0 else None},
+                'Progetto': {'relation': [{'id': f'project-{i % len(PROJECTS)}'}] if i % 5 else []},
+                'Ricorrenza': {'rich_text': []},
+                'Tags': {'multi_select': [{'name': 'Work'}, {'name': 'Next action'}] if i % 2 else []},
+                'Fatto': {'checkbox': i % 7 == 0},
+            }
+        })
+    return pages
+
+
+def events(n):
+    from records import Event
+
+    start = datetime.datetime(2023, 5, 17, 9, 0, tzinfo=datetime.timezone.utc)
+    result = []
+    for i in range(n):
+        event_start = start + datetime.timedelta(hours=i)
+        result.append(Event(
+            id=f'040000008200E00074C5B7101A82E008{i:016X}',
+            subject=f'Meeting {i}',
+            start=event_start,
+            end=event_start + datetime.timedelta(minutes=30 + 15 * (i % 4)),
+            location='Microsoft Teams Meeting',
+            project=[PROJECTS[i % len(PROJECTS)]] if i % 2 else [],
+            organizer='Someone',
+            body='Agenda of the meeting' if i % 3 else '',
+            last_modified=start,
+        ))
+    return result
+
+
+class FakeAppointment:
+    """Stand-in for an Outlook AppointmentItem COM object, with the attributes read by the sync"""
+
+    def __init__(self, i):
+        start = datetime.datetime(2023, 5, 17, 9, 0, tzinfo=datetime.timezone.utc) + datetime.timedelta(hours=i)
+        self.GlobalAppointmentID = f'040000008200E00074C5B7101A82E008{i:016X}'
+        self.Subject = f'Meeting {i}'
+        self.Start = start
+        self.End = start + datetime.timedelta(minutes=30)
+        self.Location = 'Microsoft Teams Meeting'
+        self.Categories = PROJECTS[i % len(PROJECTS)] + '; Work' if i % 2 else ''
+        self.Organizer = 'Someone'
+        self.LastModificationTime = start
+        self.Body = [TEAMS_BODY, MEET_BODY, 'Plain body'][i % 3]
+
+
+def log_records(n):
+    records = []
+    levels = [logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR]
+    for i in range(n):
+        records.append(logging.LogRecord('todoist_sync', levels[i % 4], __file__, 100 + i % 50, f'Updating task: Task number {i}', None, None))
+    return records
+
+
+# Benchmarks: each one returns the function to time and the number of items it processes
+
+def notion_client(projects):
+    from notion import Notion
+
+    notion = Notion.__new__(Notion)
+    notion.timezone = 'Europe/Rome'
+    notion.projects = projects
+    # the body export is an API call, not CPU work
+    notion.get_description = lambda page_id: None
+    return notion
+
+
+def bench_convert_task_to_notion(n):
+    notion = notion_client({name: f'project-{i}' for i, name in enumerate(PROJECTS)})
+    fixture = tasks(n)
+    return lambda: [notion.convert_task_to_notion(t) for t in fixture]
+
+
+def bench_convert_event_to_notion(n):
+    notion = notion_client({name: f'project-{i}' for i, name in enumerate(PROJECTS)})
+    fixture = events(n)
+    return lambda: [notion.convert_event_to_notion(e) for e in fixture]
+
+
+def bench_notion_parse_task(n):
+    from notion import NotionTask
+
+    notion = notion_client({name: f'project-{i}' for i, name in enumerate(PROJECTS)})
+    fixture = notion_pages(n)
+    # the fields are parsed when read: all of them are, but the description (an API call)
+    fields = [field for field in NotionTask.FIELDS if field != 'description']
+    return lambda: [[task[field] for field in fields] for task in map(notion.parse_task, fixture)]
+
+
+def bench_todoist_process_item(n):
+    from todoist import Todoist
+
+    todoist = Todoist({'key': 'benchmark'})
+    todoist.projects = {str(2200000000 + i): name for i, name in enumerate(PROJECTS)}
+    fixture = todoist_items(n)
+    return lambda: [todoist.process_item(i) for i in fixture]
+
+
+def bench_task_fingerprint(n):
+    from fingerprint import task_fingerprint
+
+    fixture = tasks(n)
+    return lambda: [task_fingerprint(t) for t in fixture]
+
+
+def bench_task_equality(n):
+    fixture = tasks(n)
+    copies = [t.replace() for t in fixture]
+    return lambda: [a == b for a, b in zip(fixture, copies)]
+
+
+def outlook_calendar_client():
+    from outlook_calendar import OutlookCalendar
+
+    calendar = OutlookCalendar.__new__(OutlookCalendar)
+    calendar.logger = logging.getLogger('outlook_calendar')
+    calendar.deleted_recurrences = []
+    return calendar
+
+
+def bench_appointment_to_dict(n):
+    calendar = outlook_calendar_client()
+    fixture = [FakeAppointment(i) for i in range(n)]
+    return lambda: [calendar.appointment_to_dict(a) for a in fixture]
+
+
+def bench_clean_body(n):
+    calendar = outlook_calendar_client()
+    fixture = [[TEAMS_BODY, MEET_BODY, 'Plain body'][i % 3] for i in range(n)]
+    return lambda: [calendar.clean_body(b) for b in fixture]
+
+
+def bench_stdout_formatter(n):
+    from _logger import StdoutFormatter
+
+    formatter = StdoutFormatter()
+    fixture = log_records(n)
+    return lambda: [formatter.format(r) for r in fixture]
+
+
+BENCHMARKS = {
+    'convert_task_to_notion': bench_convert_task_to_notion,
+    'convert_event_to_notion': bench_convert_event_to_notion,
+    'notion_parse_task': bench_notion_parse_task,
+    'todoist_process_item': bench_todoist_process_item,
+    'task_fingerprint': bench_task_fingerprint,
+    'task_equality': bench_task_equality,
+    'appointment_to_dict': bench_appointment_to_dict,
+    'clean_body': bench_clean_body,
+    'stdout_formatter': bench_stdout_formatter,
+}
+
+
+def run(name, n, repeat):
+    """Run a benchmark
+
+    Returns:
+        float: best time per item in seconds, None if skipped
+    """
+
+    try:
+        function = BENCHMARKS[name](n)
+    except ImportError as e:
+        print(f'{name:<26} skipped ({e})')
+        return None
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown over the baseline, 0.25 = 25%%')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help='run only this benchmark, can be repeated')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    args = parser.parse_args()
+
+    # the debug logs of the hot paths would measure the logging, not the conversion
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('outlook_calendar').setLevel(logging.WARNING)
+
+    baseline = {}
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+
+    for name in args.only or BENCHMARKS:
+        per_item = run(name, args.items, args.repeat)
+        if per_item is None:
+            continue
+
+        results[name] = per_item
+        line = f'{name:<26} {per_item * 1e6:9.2f} us/item'
+
+        if name in baseline:
+            ratio = per_item / baseline[name]
+            line += f'  baseline {baseline[name] * 1e6:9.2f} us/item  ({(ratio - 1) * 100:+.1f}%)'
+
+            if ratio > 1 + args.threshold:
+                regressions.append(name)
+                line += '  REGRESSION'
+
+        print(line)
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f'Baseline saved to {BASELINE_FILE}')
+
+    elif regressions:
+        print(f'{len(regressions)} benchmarks regressed more than {args.threshold * 100:.0f}%: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,81 +1,322 @@
+import atexit
+import copy
+import datetime as dt
+import gzip
+import json
 import logging
 import os
+import shutil
+import time
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
 # [ ] fix log output to file: se metto level stdout a info, debug su file sfasa
 
+LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL
+}
 
-def logger_setup(path, stdout_level='debug', keep_for_days=None):
+# listener writing the records queued by the threads, stopped at exit
+LISTENER = None
+
+
+def logger_setup(path, stdout_level='debug', keep_for_days=None, file_level='debug', json_lines=False, max_bytes=10 * 1024 * 1024, compress=True):
     """Setup the logger to print to stdout and to a file
 
+    The records are put in a queue by the logging threads and formatted and written by a
+    listener thread, so the sync threads don't wait for the formatting and the disk.
+
     Args:
         path (str): path to the log folder. If the folder doesn't exist, it will be created.
         stdout_level (str, optional): level of log to print to stdout, defaults to 'debug'.
         keep_for_days (int, optional): number of days to keep log files. Defaults to None.
+        file_level (str, optional): level of log to write to the file, defaults to 'debug'.
+        json_lines (bool, optional): also write the logs as JSON lines to "<date>.jsonl". Defaults to False.
+        max_bytes (int, optional): size of a log file before it's rotated, 0 to never rotate by size. Defaults to 10 MiB.
+        compress (bool, optional): compress the rotated log files. Defaults to True.
+
+    Returns:
+        logging.handlers.QueueListener: listener writing the logs, stopped by `stop_listener`
     """
 
+    global LISTENER
+
     # tries to create the logs folder if it doesn't exist
     if not os.path.exists(path):
         os.makedirs(path)
 
-    # create log file name
-    filename = f'{datetime.now().isoformat()[:10]}.log'
-    file_path = os.path.join(path, filename)
-
     if keep_for_days is not None:
         # delete files older than "keep_for_days" days
         delete_older_files(path, keep_for_days)
 
+    if compress:
+        compress_older_files(path)
+
     # create logger
     logger = logging.getLogger('root')
-    logger.setLevel(logging.DEBUG)
     logger.handlers.clear()
     logger.propagate = False
 
+    stop_listener()
+
     # log to stdout handler
-    stdout_handler  = logging.StreamHandler()
+    stdout_handler = logging.StreamHandler()
     stdout_handler.setFormatter(StdoutFormatter())
+    stdout_handler.setLevel(LEVELS[stdout_level.lower()])
 
-    levels = { 
-        'debug': logging.DEBUG,
-        'info': logging.INFO,
-        'warning': logging.WARNING,
-        'error': logging.ERROR,
-        'critical': logging.CRITICAL
-    }
-    
-    stdout_handler.setLevel(levels[stdout_level.lower()])
+    # log to file handler, rotated every day and when it's too big
+    file_handler = RotatingLogHandler(path, '.log', max_bytes, compress)
+    file_handler.setFormatter(logging.Formatter("%(asctime)s | %(name)s | %(levelname)s | %(message)s (%(filename)s:%(lineno)d)"))
+    file_handler.setLevel(LEVELS[file_level.lower()])
+
+    handlers = [stdout_handler, file_handler]
+
+    if json_lines:
+        json_handler = RotatingLogHandler(path, '.jsonl', max_bytes, compress)
+        json_handler.setFormatter(JsonFormatter())
+        json_handler.setLevel(file_handler.level)
+        handlers.append(json_handler)
+
+    # the records below the level of every handler are dropped before they're formatted
+    logger.setLevel(min(h.level for h in handlers))
+
+    queue = SimpleQueue()
+    logger.addHandler(LazyQueueHandler(queue))
+
+    LISTENER = QueueListener(queue, *handlers, respect_handler_level=True)
+    LISTENER.start()
+
+    return LISTENER
+
+
+def stop_listener():
+    """Write the queued records and stop the listener"""
+
+    global LISTENER
+
+    if LISTENER is not None:
+        LISTENER.stop()
+        LISTENER = None
+
+
+# the queued records are written at exit, whatever the number of setups
+atexit.register(stop_listener)
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queue handler that leaves all the formatting, including the merge of the message
+    with its arguments, to the handlers of the listener thread. The arguments must not be
+    changed after they're logged: the logged tasks and events are immutable records."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+
+        # the traceback objects keep the frames of the thread alive
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        return record
+
+
+class RotatingLogHandler(logging.FileHandler):
+    """File handler writing to "<folder>/<date><extension>", rotated every day and when
+    the file is bigger than `max_bytes`. The files rotated for their size are renamed to
+    "<date>.<n><extension>", so the current file always has the name of the day.
+    The rotated files are compressed with gzip.
+
+    Attributes:
+        folder (str): logs folder
+        extension (str): extension of the files, e.g. ".log"
+        max_bytes (int): size of a file before it's rotated, 0 to never rotate by size
+        compress (bool): whether to compress the rotated files
+        date (datetime.date): date of the current file
+        size (int): size of the current file, in characters
+    """
+
+    def __init__(self, folder, extension='.log', max_bytes=10 * 1024 * 1024, compress=True):
+        self.folder = folder
+        self.extension = extension
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.date = dt.date.today()
+        self.rollover_at = next_midnight(self.date)
+        self.size = None
+        super().__init__(self.path(), encoding='utf-8', delay=True)
+
+
+    def path(self, index=None):
+        name = f'{self.date.isoformat()}{"" if index is None else f".{index}"}{self.extension}'
+        return os.path.join(self.folder, name)
+
+
+    def emit(self, record):
+        try:
+            if record.created >= self.rollover_at:
+                self.rotate_day(dt.date.fromtimestamp(record.created))
+
+            message = self.format(record) + self.terminator
+
+            if self.stream is None:
+                self.stream = self._open()
+                self.size = os.path.getsize(self.baseFilename)
+
+            if self.max_bytes and self.size and self.size + len(message) > self.max_bytes:
+                self.rotate_size()
+                self.stream = self._open()
+                self.size = 0
+
+            self.stream.write(message)
+            self.stream.flush()
+            self.size += len(message)
+
+        except Exception:
+            self.handleError(record)
+
+
+    def rotate_size(self):
+        """Rename the current file to the next "<date>.<n><extension>" and compress it"""
+
+        self.close_stream()
+
+        index = 1
+        while os.path.exists(self.path(index)) or os.path.exists(self.path(index) + '.gz'):
+            index += 1
+
+        os.rename(self.baseFilename, self.path(index))
+        if self.compress:
+            compress_file(self.path(index))
+
+
+    def rotate_day(self, date):
+        """Close the file of the previous day, compress it and switch to the file of the day"""
 
-    # log to file handler
-    fh_formatter = logging.Formatter("%(asctime)s | %(name)s | %(levelname)s | %(message)s (%(filename)s:%(lineno)d)")
-    file_handler = logging.getLogger('root')
-    file_handler = logging.FileHandler(file_path, encoding='utf-8')
-    file_handler.setFormatter(fh_formatter)
+        self.close_stream()
 
-    # add handlers to logger
-    logger.addHandler(stdout_handler)
-    logger.addHandler(file_handler)
+        if self.compress and os.path.exists(self.baseFilename):
+            compress_file(self.baseFilename)
+
+        self.date = date
+        self.rollover_at = next_midnight(date)
+        self.baseFilename = os.path.abspath(self.path())
+
+
+    def close_stream(self):
+        """Close the current file, keeping the handler open"""
+
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formatter of JSON lines, one object per record"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'name': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+            'file': record.filename,
+            'line': record.lineno,
+        }
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def next_midnight(date):
+    """Get the timestamp of the midnight after a date
+
+    Args:
+        date (datetime.date): date
+
+    Returns:
+        float: timestamp
+    """
+
+    return time.mktime((date + dt.timedelta(days=1)).timetuple())
+
+
+def compress_file(path):
+    """Compress a file with gzip to "<path>.gz", deleting the original
+
+    Args:
+        path (str): path of the file
+    """
+
+    with open(path, 'rb') as source, gzip.open(path + '.gz', 'wb') as destination:
+        shutil.copyfileobj(source, destination)
+
+    os.remove(path)
+
+
+def log_files(path):
+    """Iterate through the log files of the folder, named after their date
+
+    Args:
+        path (str): path to the log folder
+
+    Yields:
+        tuple: file path, file name, date
+    """
+
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+
+            try:
+                date = dt.date.fromisoformat(entry.name[:10])
+            except ValueError:
+                continue
+
+            yield entry.path, entry.name, date
 
 
 def delete_older_files(path, days):
-    """Delete logs older than "days" days
+    """Delete logs older than "days" days. The date is read from the file name, the
+    subfolders (traces, profiles...) keep their own number of files.
 
     Args:
         path (str): path to the log folder
         days (int): number of days to keep log files
     """
 
-    today = datetime.today()
+    oldest = dt.date.today() - dt.timedelta(days=days)
 
-    for root, _, files in os.walk(path,topdown=False): 
-        for name in files:
-            # this is the last modified time
-            t = os.stat(os.path.join(root, name))[8] 
-            filetime = datetime.fromtimestamp(t) - today
+    for file_path, _, date in list(log_files(path)):
+        # checking if file is more than n days old
+        if date <= oldest:
+            os.remove(file_path)
 
-            # checking if file is more than n days old 
-            if filetime.days <= -days:
-                os.remove(os.path.join(root, name))
+
+def compress_older_files(path):
+    """Compress the logs of the previous days left uncompressed, e.g. by a process stopped
+    before the end of the day
+
+    Args:
+        path (str): path to the log folder
+    """
+
+    today = dt.date.today()
+
+    for file_path, name, date in list(log_files(path)):
+        if date < today and not name.endswith('.gz'):
+            compress_file(file_path)
 
 
 def text_format(text, style, additional_style=None):
@@ -112,7 +353,8 @@ def text_format(text, style, additional_style=None):
 class StdoutFormatter(logging.Formatter):
     """Custom formatter for standard output with colors and custom format"""
 
-    format_string = f"%(asctime)s.%(msecs)03d | %(name)s | {text_format('%(levelname)s', 'bold')} | %(message)s (%(filename)s:%(lineno)d)"
+    # name and levelname are truncated and padded by the format
+    format_string = f"%(asctime)s.%(msecs)03d | %(name)-11.11s | {text_format('%(levelname)-6.6s', 'bold')} | %(message)s (%(filename)s:%(lineno)d)"
 
     # set colors for levels of log
     FORMATS = {
@@ -123,12 +365,11 @@ class StdoutFormatter(logging.Formatter):
         logging.CRITICAL: text_format(format_string, 'red')
     }
 
-    def format(self, record):
-        # truncate name and levelname
-        record.name = record.name[:11].ljust(11)
-        record.levelname = record.levelname[:6].ljust(6)
-
-        log_fmt = self.FORMATS.get(record.levelno)
+    def __init__(self):
+        super().__init__()
         date_fmt = "%H:%M:%S"
-        formatter = logging.Formatter(log_fmt, date_fmt)
-        return formatter.format(record)
\ No newline at end of file
+        self.formatters = {level: logging.Formatter(log_fmt, date_fmt) for level, log_fmt in self.FORMATS.items()}
+        self.default_formatter = logging.Formatter(self.format_string, date_fmt)
+
+    def format(self, record):
+        return self.formatters.get(record.levelno, self.default_formatter).format(record)
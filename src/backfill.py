@@ -0,0 +1,109 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from rate_limit import RateLimiter
+from metrics import REGISTRY
+
+
+class Backfill:
+    """Bulk writer for first-time syncs
+
+    The writes computed from the prefetched data are run by a pool of threads, limited
+    to a maximum rate. Every completed write is checkpointed, so an interrupted backfill
+    resumes where it stopped, and the throughput and ETA are logged while it runs.
+
+    Attributes:
+        config (Config): Config
+        activity (str): activity name
+        workers (int): number of concurrent writers
+        limiter (RateLimiter): rate limiter for the writes
+        progress_callback (callable): called with a progress message, can be None
+    """
+
+    def __init__(self, config, activity, progress_callback=None):
+        self.config = config
+        self.activity = activity
+        self.logger = logging.getLogger(__name__)
+
+        backfill_config = self.config.config.get('backfill', {})
+        self.workers = backfill_config.get('workers', 4)
+        self.limiter = RateLimiter(backfill_config.get('rate', 3), burst=self.workers)
+        self.progress_callback = progress_callback
+        self.report_interval = 2
+
+
+    def run(self, jobs):
+        """Run the writes
+
+        Args:
+            jobs (list): list of (item_key, description, function) tuples
+
+        Returns:
+            int: number of completed writes
+        """
+
+        total = len(jobs)
+        completed = 0
+        failed = 0
+        start = time.monotonic()
+        last_report = start
+
+        self.logger.info(f"Backfill: {total} writes with {self.workers} workers")
+
+        # the writers record their calls with the labels of the syncer
+        with ThreadPoolExecutor(max_workers=self.workers, initializer=REGISTRY.set_context, initargs=(REGISTRY.get_context(),)) as executor:
+            futures = {executor.submit(self.write, function): (item_key, description) for item_key, description, function in jobs}
+
+            for future in as_completed(futures):
+                item_key, description = futures[future]
+
+                try:
+                    future.result()
+                    self.config.mark_done(self.activity, item_key)
+                    completed += 1
+
+                except Exception as e:
+                    self.logger.error(f"Backfill: {description} failed: {e}")
+                    failed += 1
+
+                now = time.monotonic()
+                if now - last_report >= self.report_interval or completed + failed == total:
+                    self.report(completed + failed, total, now - start)
+                    last_report = now
+
+        if failed > 0:
+            # the completed writes are checkpointed, the next sync retries the failed ones
+            raise Exception(f"Backfill: {failed} writes failed")
+
+        return completed
+
+
+    def write(self, function):
+        """Run a write respecting the rate limit
+
+        Args:
+            function (callable): write to run
+        """
+
+        self.limiter.acquire()
+        function()
+
+
+    def report(self, done, total, elapsed):
+        """Log the progress of the backfill
+
+        Args:
+            done (int): completed writes
+            total (int): total writes
+            elapsed (float): elapsed seconds
+        """
+
+        throughput = done / elapsed if elapsed > 0 else 0
+        eta = (total - done) / throughput if throughput > 0 else 0
+        minutes, seconds = divmod(int(eta), 60)
+
+        message = f"Backfill: {done}/{total} ({done * 100 // max(total, 1)}%), {throughput:.1f} items/s, ETA {minutes}m {seconds:02d}s"
+        self.logger.info(message)
+
+        if self.progress_callback is not None:
+            self.progress_callback(message)
@@ -0,0 +1,370 @@
+import sqlite3
+import threading
+from reconcile import id_hash
+
+
+class CheckpointStore:
+    """Journaled store of the sync checkpoints
+
+    The checkpoints are kept in a SQLite database in WAL mode: every write is a transaction,
+    so a crash never leaves a half written file, and every thread gets its own connection,
+    so concurrent syncers don't overwrite each other's entries.
+
+    Besides the last sync of every activity, the store records the items completed by the
+    running sync, so a sync interrupted halfway can resume from the last committed item,
+    the receipts of the writes of the syncers, so the changes they read back can be
+    recognized as their own, the last synced state of every item, the base of the
+    merges of the changes made on both sides, with the digests of the buckets of their
+    ids (see `reconcile.IdBuckets`), the outbox of the writes not yet applied
+    to their destination and the states of the syncers (e.g. the mark of a change feed),
+    saved with the checkpoint they belong to.
+
+    Attributes:
+        path (str): path to the database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+
+        with self.connection() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS checkpoints (activity TEXT PRIMARY KEY, last_sync TEXT NOT NULL, sync_token TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS runs (activity TEXT PRIMARY KEY, started_at TEXT NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS progress (activity TEXT NOT NULL, item_key TEXT NOT NULL, PRIMARY KEY (activity, item_key))')
+            db.execute('CREATE TABLE IF NOT EXISTS states (name TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS receipts (destination TEXT NOT NULL, entity TEXT NOT NULL, hash TEXT NOT NULL, written_at TEXT NOT NULL, '
+                       'properties_hash TEXT, edited_at TEXT, PRIMARY KEY (destination, entity))')
+            db.execute('CREATE TABLE IF NOT EXISTS bases (entity TEXT PRIMARY KEY, fields TEXT NOT NULL, synced_at TEXT NOT NULL, bucket TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS base_buckets (bucket TEXT PRIMARY KEY, digest INTEGER NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS outbox (seq INTEGER PRIMARY KEY AUTOINCREMENT, activity TEXT NOT NULL, destination TEXT NOT NULL, '
+                       'entity TEXT NOT NULL, action TEXT NOT NULL, data TEXT, fields TEXT, target TEXT, key TEXT NOT NULL, '
+                       'attempts INTEGER NOT NULL DEFAULT 0, queued_at TEXT NOT NULL, modified TEXT)')
+
+            # columns added to the tables of the older databases
+            for table, added in (('receipts', ('properties_hash', 'edited_at')), ('outbox', ('modified',)), ('bases', ('bucket',))):
+                columns = {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+                for column in added:
+                    if column not in columns:
+                        db.execute(f'ALTER TABLE {table} ADD COLUMN {column} TEXT')
+
+            db.execute('CREATE INDEX IF NOT EXISTS bases_bucket ON bases (bucket)')
+
+            # the bases saved before the buckets
+            entities = [row[0] for row in db.execute('SELECT entity FROM bases WHERE bucket IS NULL')]
+            for entity in entities:
+                db.execute('UPDATE bases SET bucket = ? WHERE entity = ?', (id_hash(entity)[0], entity))
+                self.update_bucket(db, entity)
+
+
+    def connection(self):
+        """Get the connection of the current thread
+
+        Returns:
+            sqlite3.Connection: connection
+        """
+
+        db = getattr(self.local, 'db', None)
+
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+
+        return db
+
+
+    def load(self, activity):
+        """Load the checkpoint of an activity
+
+        Args:
+            activity (str): activity name
+
+        Returns:
+            tuple: (last_sync, sync_token), None if the activity was never synced
+        """
+
+        row = self.connection().execute('SELECT last_sync, sync_token FROM checkpoints WHERE activity = ?', (activity,)).fetchone()
+        return row
+    
+
+    def save(self, activity, last_sync, sync_token=None, states=None):
+        """Save the checkpoint of an activity and close its running sync, in a single transaction
+
+        Args:
+            activity (str): activity name
+            last_sync (str): last sync
+            sync_token (str, optional): sync token. Defaults to None.
+            states (dict, optional): {name: JSON data} of the states saved with the checkpoint. Defaults to None.
+        """
+
+        with self.connection() as db:
+            db.execute('INSERT OR REPLACE INTO checkpoints (activity, last_sync, sync_token) VALUES (?, ?, ?)', (activity, last_sync, sync_token))
+            db.execute('DELETE FROM runs WHERE activity = ?', (activity,))
+            db.execute('DELETE FROM progress WHERE activity = ?', (activity,))
+            db.executemany('INSERT OR REPLACE INTO states (name, data) VALUES (?, ?)', (states or {}).items())
+
+
+    def load_state(self, name):
+        """Load a state
+
+        Args:
+            name (str): state name
+
+        Returns:
+            str: JSON data, None if the state was never saved
+        """
+
+        row = self.connection().execute('SELECT data FROM states WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else None
+
+
+    def save_state(self, name, data):
+        """Save a state, replacing the previous one
+
+        Args:
+            name (str): state name
+            data (str): JSON data
+        """
+
+        with self.connection() as db:
+            db.execute('INSERT OR REPLACE INTO states (name, data) VALUES (?, ?)', (name, data))
+
+
+    def begin_run(self, activity, started_at):
+        """Start a sync of an activity, or resume the one that was interrupted
+
+        Args:
+            activity (str): activity name
+            started_at (str): start time of the sync
+
+        Returns:
+            set: keys of the items already completed by the interrupted sync, empty for a new sync
+        """
+
+        with self.connection() as db:
+            db.execute('INSERT OR IGNORE INTO runs (activity, started_at) VALUES (?, ?)', (activity, started_at))
+            rows = db.execute('SELECT item_key FROM progress WHERE activity = ?', (activity,)).fetchall()
+
+        return {row[0] for row in rows}
+
+
+    def mark_done(self, activity, item_key):
+        """Record that an item of the running sync has been completed
+
+        Args:
+            activity (str): activity name
+            item_key (str): item key
+        """
+
+        with self.connection() as db:
+            db.execute('INSERT OR IGNORE INTO progress (activity, item_key) VALUES (?, ?)', (activity, item_key))
+
+
+    def record_receipt(self, destination, entity, content_hash, written_at, properties_hash=None):
+        """Record the receipt of a write, replacing the previous one of the entity. The edit
+        time of the entity is kept, see `record_edit_time`.
+
+        Args:
+            destination (str): side written, e.g. "notion"
+            entity (str): id of the entity written
+            content_hash (str): hash of the content written
+            written_at (str): time of the write
+            properties_hash (str, optional): hash of the content without the body. Defaults to None.
+        """
+
+        with self.connection() as db:
+            db.execute('INSERT INTO receipts (destination, entity, hash, written_at, properties_hash) VALUES (?, ?, ?, ?, ?) '
+                       'ON CONFLICT (destination, entity) DO UPDATE SET hash = excluded.hash, written_at = excluded.written_at, '
+                       'properties_hash = excluded.properties_hash', (destination, entity, content_hash, written_at, properties_hash))
+
+
+    def record_edit_time(self, destination, entity, edited_at, written_at):
+        """Record the edit time of an entity returned by the destination after a write. The
+        write may be applied before its receipt is recorded: the receipt is created empty.
+
+        Args:
+            destination (str): side written
+            entity (str): id of the entity written
+            edited_at (str): edit time, in the format of the destination
+            written_at (str): time of the write
+        """
+
+        with self.connection() as db:
+            db.execute("INSERT INTO receipts (destination, entity, hash, written_at, edited_at) VALUES (?, ?, '', ?, ?) "
+                       'ON CONFLICT (destination, entity) DO UPDATE SET edited_at = excluded.edited_at', (destination, entity, written_at, edited_at))
+
+
+    def load_receipt(self, destination, entity):
+        """Load the last write of an entity
+
+        Args:
+            destination (str): side written
+            entity (str): id of the entity
+
+        Returns:
+            tuple: (hash, properties hash, edit time), None if the entity was never written
+        """
+
+        return self.connection().execute('SELECT hash, properties_hash, edited_at FROM receipts WHERE destination = ? AND entity = ?',
+                                         (destination, entity)).fetchone()
+
+
+    def delete_receipts(self, entity):
+        """Delete the receipts of an entity on every side
+
+        Args:
+            entity (str): id of the entity
+        """
+
+        with self.connection() as db:
+            db.execute('DELETE FROM receipts WHERE entity = ?', (entity,))
+
+
+    def prune_receipts(self, before):
+        """Delete the receipts of the writes older than a time
+
+        Args:
+            before (str): time, in the format of `written_at`
+        """
+
+        with self.connection() as db:
+            db.execute('DELETE FROM receipts WHERE written_at < ?', (before,))
+
+
+    def save_base(self, entity, fields, synced_at):
+        """Save the last synced state of an entity
+
+        Args:
+            entity (str): id of the entity
+            fields (str): synced fields, as JSON
+            synced_at (str): time of the sync
+        """
+
+        with self.connection() as db:
+            cursor = db.execute('UPDATE bases SET fields = ?, synced_at = ? WHERE entity = ?', (fields, synced_at, entity))
+
+            if cursor.rowcount == 0:
+                db.execute('INSERT INTO bases (entity, fields, synced_at, bucket) VALUES (?, ?, ?, ?)', (entity, fields, synced_at, id_hash(entity)[0]))
+                self.update_bucket(db, entity)
+
+
+    def load_base(self, entity):
+        """Load the last synced state of an entity
+
+        Args:
+            entity (str): id of the entity
+
+        Returns:
+            str: synced fields as JSON, None if the entity was never synced
+        """
+
+        row = self.connection().execute('SELECT fields FROM bases WHERE entity = ?', (entity,)).fetchone()
+        return row[0] if row is not None else None
+
+
+    def delete_base(self, entity):
+        """Delete the last synced state of an entity
+
+        Args:
+            entity (str): id of the entity
+        """
+
+        with self.connection() as db:
+            if db.execute('DELETE FROM bases WHERE entity = ?', (entity,)).rowcount > 0:
+                self.update_bucket(db, entity)
+
+
+    def update_bucket(self, db, entity):
+        """Add or remove an entity from the digest of its bucket, in the transaction of the change of its base
+
+        Args:
+            db (sqlite3.Connection): connection, in a transaction
+            entity (str): id of the entity
+        """
+
+        bucket, value = id_hash(entity)
+        # XOR, which SQLite doesn't have
+        db.execute('INSERT INTO base_buckets (bucket, digest) VALUES (?, ?) '
+                   'ON CONFLICT (bucket) DO UPDATE SET digest = (digest | excluded.digest) - (digest & excluded.digest)', (bucket, value))
+
+
+    def base_digests(self):
+        """Get the digests of the buckets of the entities with a last synced state
+
+        Returns:
+            dict: {bucket: digest}, see `reconcile.IdBuckets`
+        """
+
+        return dict(self.connection().execute('SELECT bucket, digest FROM base_buckets WHERE digest != 0'))
+
+
+    def base_entities(self, buckets=None):
+        """Get the ids of the entities with a last synced state
+
+        Args:
+            buckets (list, optional): buckets of the ids, None for all of them. Defaults to None.
+
+        Returns:
+            list: ids
+        """
+
+        if buckets is None:
+            return [row[0] for row in self.connection().execute('SELECT entity FROM bases')]
+
+        ids = []
+        for i in range(0, len(buckets), 500):
+            chunk = buckets[i:i + 500]
+            ids += [row[0] for row in self.connection().execute(f"SELECT entity FROM bases WHERE bucket IN ({', '.join('?' * len(chunk))})", chunk)]
+
+        return ids
+
+
+    def append_outbox(self, activity, rows, queued_at):
+        """Append writes to the outbox of an activity, in a single transaction
+
+        Args:
+            activity (str): activity name
+            rows (list): (destination, entity, action, data, fields, target, key, modified) of the writes, data and fields as JSON
+            queued_at (str): time of the writes
+        """
+
+        with self.connection() as db:
+            db.executemany('INSERT INTO outbox (activity, destination, entity, action, data, fields, target, key, modified, queued_at) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [(activity, *row, queued_at) for row in rows])
+
+
+    def load_outbox(self, activity):
+        """Load the writes in the outbox of an activity, in the order they were appended
+
+        Args:
+            activity (str): activity name
+
+        Returns:
+            list: (seq, destination, entity, action, data, fields, target, key, attempts, modified) of the writes
+        """
+
+        return self.connection().execute('SELECT seq, destination, entity, action, data, fields, target, key, attempts, modified '
+                                         'FROM outbox WHERE activity = ? ORDER BY seq', (activity,)).fetchall()
+
+
+    def delete_outbox(self, seqs):
+        """Delete writes from the outbox
+
+        Args:
+            seqs (list): sequence numbers of the writes
+        """
+
+        with self.connection() as db:
+            db.executemany('DELETE FROM outbox WHERE seq = ?', [(seq,) for seq in seqs])
+
+
+    def retry_outbox(self, seqs):
+        """Count a failed attempt of writes of the outbox
+
+        Args:
+            seqs (list): sequence numbers of the writes
+        """
+
+        with self.connection() as db:
+            db.executemany('UPDATE outbox SET attempts = attempts + 1 WHERE seq = ?', [(seq,) for seq in seqs])
@@ -1,12 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
 import sys
 import pytz
 import toml
+from checkpoint import CheckpointStore
 
 class Config:
-    def __init__(self):
+    def __init__(self, data_folder=None, logs_folder=None):
         # Get file directory
         if getattr(sys, 'frozen', False):   # if it's an exe
             self.src_folder = os.path.dirname(sys.executable)
@@ -15,13 +16,14 @@ class Config:
 
         # get directories
         self.base_folder = os.path.dirname(self.src_folder)
-        self.data_folder = os.path.join(self.base_folder, 'data')
+        self.data_folder = data_folder or os.path.join(self.base_folder, 'data')
         self.assets_folder = os.path.join(self.base_folder, 'assets')
-        self.logs_folder = os.path.join(self.base_folder, 'logs')
+        self.logs_folder = logs_folder or os.path.join(self.base_folder, 'logs')
 
         # set file paths
         self.config_file = os.path.join(self.data_folder, 'config.toml')
         self.last_sync_file = os.path.join(self.data_folder, 'last_sync.json')
+        self.checkpoints_file = os.path.join(self.data_folder, 'checkpoints.db')
 
         # Load config file
         self.config = toml.load(self.config_file)
@@ -30,34 +32,28 @@ class Config:
         self.timezone_str = self.config['misc']['timezone']
         self.timezone = pytz.timezone(self.timezone_str)
 
+        # Open the checkpoints store
+        self.checkpoints = CheckpointStore(self.checkpoints_file)
+
 
     def load_last_sync(self, activity, sync_token=False):
-        """Load last sync from config file.
+        """Load last sync from the checkpoints store.
 
         Returns:
             datetime.datetime: last sync
         """
 
-        # check if the file exists
-        if not os.path.isfile(self.last_sync_file):
+        checkpoint = self.checkpoints.load(activity)
+
+        if checkpoint is None:
+            checkpoint = self.load_legacy_last_sync(activity)
+
+        if checkpoint is None:
             if sync_token:
                 return None, None
             return None
-        
-        # load last sync
-        with open(self.last_sync_file, 'r') as f:
-            data = json.load(f)
-            if activity not in data:
-                if sync_token:
-                    return None, None
-                return None
-            
-            if sync_token:
-                data = data[activity]
-                last_sync = data['last_sync']
-                sync_token = data['sync_token']
-            else:
-                last_sync = data[activity]
+
+        last_sync, token = checkpoint
 
         # convert to datetime
         last_sync = datetime.strptime(last_sync, '%Y-%m-%d %H:%M:%S.%f')
@@ -66,13 +62,43 @@ class Config:
         last_sync = self.timezone.localize(last_sync)
 
         if sync_token:
-            return last_sync, sync_token
+            return last_sync, token
         
         return last_sync
+
+
+    def load_legacy_last_sync(self, activity):
+        """Load last sync from the json file used before the checkpoints store.
+
+        Returns:
+            tuple: (last_sync, sync_token), None if not found
+        """
+
+        # check if the file exists
+        if not os.path.isfile(self.last_sync_file):
+            return None
+        
+        with open(self.last_sync_file, 'r') as f:
+            data = json.load(f)
+
+        if activity not in data:
+            return None
+
+        data = data[activity]
+        if isinstance(data, dict):
+            return data['last_sync'], data['sync_token']
+
+        return data, None
     
 
-    def update_last_sync(self, activity, sync_token=None):
-        """Update last sync in config file.
+    def update_last_sync(self, activity, sync_token=None, states=None):
+        """Update last sync in the checkpoints store, closing the running sync. The states
+        of the sync are saved in the same transaction, so they never get out of step with it.
+
+        Args:
+            activity (str): activity name
+            sync_token (str, optional): sync token. Defaults to None.
+            states (dict, optional): {name: state} to save, see `save_state`. Defaults to None.
 
         Returns:
             datetime.datetime: last sync
@@ -80,23 +106,222 @@ class Config:
 
         last_sync = datetime.now(self.timezone)
         last_sync_str = last_sync.strftime('%Y-%m-%d %H:%M:%S.%f')
-        
-        if sync_token is not None:
-            data = {activity: {'last_sync': last_sync_str, 'sync_token': sync_token}}
-
-        else:
-            data = {activity: last_sync_str}
-        
-        # update the json file
-        if os.path.isfile(self.last_sync_file):
-            with open(self.last_sync_file, 'r') as f:
-                last_sync_file = json.load(f)
-            last_sync_file.update(data)
-            data = last_sync_file
 
-        with open(self.last_sync_file, 'w') as f:
-            json.dump(data, f)
+        states = {name: json.dumps(state) for name, state in (states or {}).items()}
+        self.checkpoints.save(activity, last_sync_str, sync_token, states)
 
         return last_sync
-    
 
+
+    def begin_sync(self, activity):
+        """Start a sync, or resume the one that was interrupted.
+
+        Returns:
+            set: keys of the items already completed by the interrupted sync
+        """
+
+        started_at = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S.%f')
+        return self.checkpoints.begin_run(activity, started_at)
+
+
+    def mark_done(self, activity, item_key):
+        """Record that an item of the running sync has been completed."""
+
+        self.checkpoints.mark_done(activity, item_key)
+
+
+    def record_write(self, destination, entity, content_hash, properties_hash=None):
+        """Record the receipt of a write of a syncer, so the change can be recognized
+        when it's read back from the destination.
+
+        Args:
+            destination (str): side written, e.g. "notion"
+            entity (str): id of the entity written
+            content_hash (str): hash of the content written
+            properties_hash (str, optional): hash of the content without the body, which
+                takes another call to read. Defaults to None.
+        """
+
+        written_at = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S.%f')
+        self.checkpoints.record_receipt(destination, str(entity), content_hash, written_at, properties_hash)
+
+
+    def record_edit_time(self, destination, entity, edited_at):
+        """Record the edit time of an entity after a write, as returned by the destination.
+        The entity read back with the same edit time wasn't changed since.
+        """
+
+        written_at = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S.%f')
+        self.checkpoints.record_edit_time(destination, str(entity), edited_at, written_at)
+
+
+    def is_echo(self, destination, entity, content_hash):
+        """Check if a change read from a side is the echo of our own last write.
+
+        Returns:
+            bool: True if the content is the one we wrote
+        """
+
+        receipt = self.checkpoints.load_receipt(destination, str(entity))
+        return receipt is not None and receipt[0] == content_hash
+
+
+    def load_write(self, destination, entity):
+        """Load the receipt of the last write of an entity.
+
+        Returns:
+            dict: hash, properties_hash and edited_at (None if unknown), None if the entity was never written
+        """
+
+        receipt = self.checkpoints.load_receipt(destination, str(entity))
+        return dict(zip(('hash', 'properties_hash', 'edited_at'), receipt)) if receipt is not None else None
+
+
+    def forget_writes(self, entity):
+        """Delete the receipts and the base of an entity, e.g. when it's deleted."""
+
+        self.checkpoints.delete_receipts(str(entity))
+        self.checkpoints.delete_base(str(entity))
+
+
+    def load_base(self, entity):
+        """Load the fields of an entity at its last sync, the base of the merges.
+
+        Returns:
+            dict: fields, None if the entity was never synced
+        """
+
+        fields = self.checkpoints.load_base(str(entity))
+        return json.loads(fields) if fields is not None else None
+
+
+    def save_base(self, entity, fields):
+        """Save the fields of an entity at the end of its sync.
+
+        Args:
+            entity (str): id of the entity
+            fields (dict): synced fields, JSON serializable
+        """
+
+        synced_at = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S.%f')
+        self.checkpoints.save_base(str(entity), json.dumps(fields, sort_keys=True), synced_at)
+
+
+    def prune_writes(self, days):
+        """Delete the receipts of the writes older than some days."""
+
+        before = datetime.now(self.timezone) - timedelta(days=days)
+        self.checkpoints.prune_receipts(before.strftime('%Y-%m-%d %H:%M:%S.%f'))
+
+
+    def synced_entities(self, buckets=None):
+        """Get the ids of the entities synced on both sides, the ones with a base.
+
+        Args:
+            buckets (list, optional): buckets of the ids, see `synced_digests`. Defaults to all of them.
+
+        Returns:
+            list: ids
+        """
+
+        return self.checkpoints.base_entities(buckets)
+
+
+    def synced_digests(self):
+        """Get the digests of the buckets of the ids of the entities synced on both sides.
+
+        Returns:
+            dict: {bucket: digest}, see `reconcile.IdBuckets`
+        """
+
+        return self.checkpoints.base_digests()
+
+
+    def queue_writes(self, activity, writes):
+        """Store writes in the outbox of an activity, until they're applied.
+
+        Args:
+            activity (str): activity name
+            writes (list): dicts with the destination, entity, action, data, fields, target, key and modified
+                (time of the change written on the source, ISO format) of the writes, data and fields JSON serializable
+        """
+
+        queued_at = datetime.now(self.timezone).strftime('%Y-%m-%d %H:%M:%S.%f')
+        rows = [(w['destination'], str(w['entity']), w['action'], json.dumps(w['data']), json.dumps(w['fields']), w['target'], w['key'],
+                 w.get('modified')) for w in writes]
+        self.checkpoints.append_outbox(activity, rows, queued_at)
+
+
+    def queued_writes(self, activity):
+        """Load the writes in the outbox of an activity, oldest first.
+
+        Returns:
+            list: dicts with the seq, destination, entity, action, data, fields, target, key, attempts and modified of the writes
+        """
+
+        names = ('seq', 'destination', 'entity', 'action', 'data', 'fields', 'target', 'key', 'attempts', 'modified')
+        writes = [dict(zip(names, row)) for row in self.checkpoints.load_outbox(activity)]
+
+        for write in writes:
+            write['data'] = json.loads(write['data'])
+            write['fields'] = json.loads(write['fields'])
+
+        return writes
+
+
+    def complete_writes(self, seqs):
+        """Remove applied (or dropped) writes from the outbox."""
+
+        self.checkpoints.delete_outbox(seqs)
+
+
+    def retry_writes(self, seqs):
+        """Count a failed attempt of writes of the outbox."""
+
+        self.checkpoints.retry_outbox(seqs)
+
+
+    def load_state(self, name):
+        """Load a persisted state from the checkpoints store.
+
+        Args:
+            name (str): state name
+
+        Returns:
+            dict: state, None if it was never saved
+        """
+
+        data = self.checkpoints.load_state(name)
+
+        if data is None:
+            return self.load_legacy_state(name)
+
+        return json.loads(data)
+
+
+    def load_legacy_state(self, name):
+        """Load a state from the json file used before the checkpoints store.
+
+        Returns:
+            dict: state, None if not found
+        """
+
+        state_file = os.path.join(self.data_folder, f'{name}.json')
+
+        if not os.path.isfile(state_file):
+            return None
+
+        with open(state_file, 'r') as f:
+            return json.load(f)
+
+
+    def save_state(self, name, state):
+        """Save a state in the checkpoints store. The states that go with a checkpoint are
+        saved by `update_last_sync` instead.
+
+        Args:
+            name (str): state name
+            state (dict): JSON serializable state
+        """
+
+        self.checkpoints.save_state(name, json.dumps(state))
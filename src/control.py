@@ -0,0 +1,165 @@
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+
+class ControlError(Exception):
+    """Error of a control request, returned with its HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def cycle_stats(root):
+    """Get the stats of a sync cycle from its trace: duration, error and the attributes
+    of its phases (e.g. created, updated and deleted items)
+
+    Args:
+        root (Span): root span of the cycle
+
+    Returns:
+        dict: stats
+    """
+
+    return {
+        'time': root.attributes.get('time'),
+        'duration': round(root.duration, 3),
+        'error': root.attributes.get('error'),
+        'phases': {span.name: dict(span.attributes, duration=round(span.duration, 3)) for span in root.children},
+    }
+
+
+class ControlServer:
+    """HTTP API on localhost to control the syncers:
+    - GET /status[/<connector>]: status, last sync, last cycle stats, backlog and next run
+    - POST /sync[/<connector>][?item=<id>&direction=<direction>]: sync now, or only an item
+    - POST /pause[/<connector>], POST /resume[/<connector>]
+
+    The connectors are objects with the methods `get_status()`, `request_sync(item_id, direction)`,
+    `request_pause()` and `request_resume()`, called from the server threads.
+    The requests sent by a browser (with an Origin header) are refused, so a web page
+    can't control the syncers.
+
+    Attributes:
+        port (int): port
+        connectors (dict): {name: connector}
+    """
+
+    def __init__(self, port, connectors):
+        self.port = port
+        self.connectors = connectors
+        self.logger = logging.getLogger(__name__)
+        self.server = None
+
+
+    def select(self, name):
+        """Get the connectors addressed by a request
+
+        Args:
+            name (str): connector name, None for all of them
+
+        Returns:
+            dict: {name: connector}
+        """
+
+        if name is None:
+            return self.connectors
+
+        if name not in self.connectors:
+            raise ControlError(404, f"Unknown connector: {name}")
+
+        return {name: self.connectors[name]}
+
+
+    def handle(self, method, path, query):
+        """Run a control request
+
+        Args:
+            method (str): HTTP method
+            path (str): request path
+            query (dict): query parameters
+
+        Returns:
+            tuple: HTTP status, response data
+        """
+
+        parts = [p for p in path.split('/') if p]
+        if not parts or len(parts) > 2:
+            raise ControlError(404, f"Unknown path: {path}")
+
+        action = parts[0]
+        connectors = self.select(parts[1] if len(parts) == 2 else None)
+
+        if method == 'GET' and action == 'status':
+            return 200, {name: c.get_status() for name, c in connectors.items()}
+
+        if method != 'POST' or action not in ('sync', 'pause', 'resume'):
+            raise ControlError(404, f"Unknown request: {method} {path}")
+
+        if action == 'pause':
+            for connector in connectors.values():
+                connector.request_pause()
+            return 202, {'paused': list(connectors)}
+
+        if action == 'resume':
+            for connector in connectors.values():
+                connector.request_resume()
+            return 202, {'resumed': list(connectors)}
+
+        item_id = query.get('item')
+        if item_id is not None and len(connectors) != 1:
+            raise ControlError(400, "The connector of the item is required: POST /sync/<connector>?item=<id>")
+
+        return 202, {name: {'backlog': c.request_sync(item_id, query.get('direction'))} for name, c in connectors.items()}
+
+
+    def start(self):
+        control = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self, method):
+                url = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+
+                try:
+                    if self.headers.get('Origin') is not None:
+                        raise ControlError(403, "Requests from browsers are not allowed")
+
+                    status, data = control.handle(method, url.path, query)
+
+                except ControlError as e:
+                    status, data = e.status, {'error': str(e)}
+
+                except Exception as e:
+                    control.logger.exception(e)
+                    status, data = 500, {'error': repr(e)}
+
+                body = json.dumps(data, indent=4, default=str).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.respond('GET')
+
+            def do_POST(self):
+                self.respond('POST')
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info(f"Control API available at http://127.0.0.1:{self.port}/status")
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
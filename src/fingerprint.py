@@ -0,0 +1,96 @@
+import datetime
+import hashlib
+import json
+from collections.abc import Mapping
+from dataclasses import fields, is_dataclass
+
+# synced fields of the tasks
+TASK_FIELDS = ('content', 'description', 'labels', 'checked', 'due', 'project', 'priority', 'recurrence')
+
+
+def to_json(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+
+    if is_dataclass(value):
+        return {f.name: getattr(value, f.name) for f in fields(value)}
+
+    return str(value)
+
+
+def fingerprint(data):
+    """Compute a stable hash of a JSON-like structure
+
+    Keys are sorted, mappings and records are hashed as dicts and values that JSON can't represent
+    (dates, datetimes) are converted to strings, so two equal structures always get the same hash.
+
+    Args:
+        data (dict | list): data to hash
+
+    Returns:
+        str: hex digest
+    """
+
+    serialized = json.dumps(data, sort_keys=True, default=to_json, ensure_ascii=False)
+    return hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def task_fields(task, body=True):
+    """Get the synced fields of a task, normalized so a task written to one side and
+    read back from it gets the same values: Todoist and Notion represent dates, labels,
+    empty descriptions and the inbox project differently.
+
+    Args:
+        task (dict): task data, read from Todoist or parsed from a Notion page
+        body (bool, optional): include the description, which is the body of the Notion
+            page and takes another call to read. Defaults to True.
+
+    Returns:
+        dict: {field: normalized value}, JSON serializable
+    """
+
+    due = task.get('due')
+    if isinstance(due, datetime.datetime):
+        due = due.date()
+
+    fields = {
+        'content': task.get('content'),
+        'description': (task.get('description') or '').strip() if body else None,
+        'labels': sorted(label.replace(' ', '_').lower() for label in task.get('labels') or []),
+        'checked': bool(task.get('checked')),
+        'due': due.isoformat() if due is not None else None,
+        'project': task.get('project') or 'Inbox',
+        'priority': task.get('priority') or 1,
+        'recurrence': task.get('recurrence') or None,
+    }
+
+    if not body:
+        del fields['description']
+
+    return fields
+
+
+def task_fingerprint(task):
+    """Compute the hash of the synced fields of a task, see `task_fields`
+
+    Args:
+        task (dict): task data
+
+    Returns:
+        str: hex digest
+    """
+
+    return fingerprint(task_fields(task))
+
+
+def properties_fingerprint(task):
+    """Compute the hash of the synced fields of a task but the description, see `task_fields`
+
+    Args:
+        task (dict): task data, the description isn't read
+
+    Returns:
+        str: hex digest
+    """
+
+    return fingerprint(task_fields(task, body=False))
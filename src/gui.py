@@ -4,6 +4,9 @@ import os
 import sys
 import datetime
 import time
+import threading
+from collections import deque
+from contextlib import nullcontext
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -21,6 +24,11 @@ from outlook_calendar_sync import CalendarSync
 from todoist_sync import TodoistSync
 from config import Config
 from _logger import logger_setup
+from metrics import REGISTRY, QUANTILES, MetricsServer, write_cycle_snapshot
+from tracing import TRACER
+from profiling import profile
+from memory import MemoryWatch
+from control import ControlServer, ControlError, cycle_stats
 
 
 # [ ] update the tarkbar tooltip with the last sync date
@@ -30,13 +38,22 @@ from _logger import logger_setup
 
 class SyncGUI(QMainWindow):
 
-    def __init__(self):
+    def __init__(self, profile_cycles=False):
         super().__init__()
         self.config = Config()
         self.config_data = self.config.config
 
         self.logger = logging.getLogger(__name__)
-        logger_setup(self.config.logs_folder, keep_for_days=self.config_data['logs']['keep_for_days'], stdout_level='DEBUG')
+        logs_config = self.config_data['logs']
+        logger_setup(
+            self.config.logs_folder,
+            keep_for_days=logs_config['keep_for_days'],
+            stdout_level='DEBUG',
+            file_level=logs_config.get('level', 'debug'),
+            json_lines=logs_config.get('json_lines', False),
+            max_bytes=logs_config.get('max_mb', 10) * 1024 * 1024,
+            compress=logs_config.get('compress', True)
+        )
         
         # Set up the main window
         self.setWindowTitle("NotionSync 0.0.1")
@@ -46,24 +63,44 @@ class SyncGUI(QMainWindow):
         self.tray_icon = QSystemTrayIcon(self)
         self.tray_icon.activated.connect(self.on_tray_icon_activated)
         self.tray_icon.setIcon(QIcon(os.path.join(self.config.assets_folder, "icon.png")))
-        self.tray_icon.setToolTip("Calendar status: OK\nLast sync: " + str(datetime.date.today()))
         self.tray_icon.setVisible(True)
 
         # Create a context menu for the system tray icon
         self.tray_menu = QMenu()
         self.tray_menu.addAction("Open", self.show)
         self.tray_menu.addAction("Logs", self.open_logs)
+        self.tray_menu.addAction("Profile next cycle", self.profile_next_cycle)
         self.tray_menu.addAction("Quit", QApplication.quit)
         self.tray_icon.setContextMenu(self.tray_menu)
 
+        # Expose the metrics on localhost
+        metrics_port = self.config_data.get('metrics', {}).get('port')
+        if metrics_port:
+            self.metrics_server = MetricsServer(metrics_port)
+            self.metrics_server.start()
+
         # Initialize the objects
         calendar = CalendarSync(self.config, threaded=True)
         todoist = TodoistSync(self.config)
 
         # Create the widgets
         # TODO: make active configurable
-        self.calendar_gui_syncer = SyncElement(calendar, self.config, 'Calendar')
-        self.todoist_gui_syncer = SyncElement(todoist, self.config, 'Todoist', is_paused=True)
+        # profile every cycle if requested from the command line or the config
+        profile_cycles = profile_cycles or self.config_data.get('profiling', {}).get('enabled', False)
+        self.calendar_gui_syncer = SyncElement(calendar, self.config, 'Calendar', profile_cycles=profile_cycles)
+        self.todoist_gui_syncer = SyncElement(todoist, self.config, 'Todoist', is_paused=True, profile_cycles=profile_cycles)
+
+        # Control the syncers from localhost
+        control_port = self.config_data.get('control', {}).get('port')
+        if control_port:
+            elements = (self.calendar_gui_syncer, self.todoist_gui_syncer)
+            self.control_server = ControlServer(control_port, {e.handler.activity: e for e in elements})
+            self.control_server.start()
+
+        # Keep the tray tooltip updated with the status and the propagation lag
+        for element in (self.calendar_gui_syncer, self.todoist_gui_syncer):
+            element.sync_worker.is_running.connect(self.update_tooltip)
+        self.update_tooltip()
 
         # Create the main layout
         self.main_layout = QVBoxLayout()
@@ -91,6 +128,31 @@ class SyncGUI(QMainWindow):
 
 
 
+    def profile_next_cycle(self):
+        """Profile the next cycle of every syncer"""
+
+        self.logger.info("Profiling the next cycle")
+        for element in (self.calendar_gui_syncer, self.todoist_gui_syncer):
+            element.sync_worker.profile_next = True
+
+
+    def update_tooltip(self, *args):
+        """Update the tray icon tooltip with the status and the propagation lag of every syncer"""
+
+        lines = ["Status - lag p50/p95/p99"]
+
+        for element in (self.calendar_gui_syncer, self.todoist_gui_syncer):
+            line = f"{element.name}: {element.ok_label.text()}"
+
+            lag = REGISTRY.quantiles('propagation_lag_seconds', {'connector': element.handler.activity})
+            if lag is not None:
+                line += " - " + "/".join(format_duration(lag[q]) for q in QUANTILES)
+
+            lines.append(line)
+
+        self.tray_icon.setToolTip("\n".join(lines))
+
+
     def on_tray_icon_activated(self, reason):
         if reason == QSystemTrayIcon.DoubleClick:
             self.show()
@@ -102,9 +164,14 @@ class SyncGUI(QMainWindow):
 
 
 class SyncElement(QHBoxLayout):
-    def __init__(self, handler, config, name, is_paused=False, *args, **kwargs):
+    # requests of the control API, run in the GUI thread
+    pause_requested = pyqtSignal()
+    resume_requested = pyqtSignal()
+
+    def __init__(self, handler, config, name, is_paused=False, profile_cycles=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.logger = logging.getLogger(__name__)
+        self.status = "OK"
 
         self.name = name
         self.label = QLabel(self.name)
@@ -143,10 +210,11 @@ class SyncElement(QHBoxLayout):
         self.addWidget(self.pause_button)
 
         self.sync_thread = QThread()
-        self.sync_worker = SyncScheduler(self.handler, self.config.timezone, 1)
+        self.sync_worker = SyncScheduler(self.handler, self.config.timezone, 1, profile_cycles=profile_cycles)
         self.sync_worker.moveToThread(self.sync_thread)
         self.sync_thread.started.connect(self.sync_worker.start_sync)
         self.sync_worker.last_sync.connect(self.update_sync_time)
+        self.sync_worker.progress.connect(self.sync_label.setText)
 
         # disable the buttons if the sync process is running
         self.sync_worker.is_running.connect(self.pause_button.setDisabled)
@@ -156,6 +224,9 @@ class SyncElement(QHBoxLayout):
         # connect has_error
         self.sync_worker.has_error.connect(self.update_status_error)
 
+        self.pause_requested.connect(self.pause_process)
+        self.resume_requested.connect(self.start_process)
+
         if not self.is_paused:
             self.start_sync_thread()
         
@@ -184,16 +255,26 @@ class SyncElement(QHBoxLayout):
         Manually sync with the button.
         """
 
-        if not self.is_running:
-            self.logger.info("Manual sync")
-            self.quit_sync_thread()
-            self.start_sync_thread()
+        if self.is_running:
+            return
+
+        self.logger.info("Manual sync")
+
+        # the thread is stopped while paused
+        if self.is_paused:
+            self.start_process()
+
+        else:
+            self.sync_worker.request_sync()
 
 
     def pause_process(self):
         """
         Pause the sync process.
         """
+        if self.is_paused:
+            return
+
         self.is_paused = True
         self.pause_button.setIcon(QIcon(os.path.join(self.config.assets_folder, "play.png")))
         self.update_status("Paused")
@@ -205,6 +286,9 @@ class SyncElement(QHBoxLayout):
         """
         Start the sync process.
         """
+        if not self.is_paused and self.sync_thread.isRunning():
+            return
+
         self.is_paused = False
         self.pause_button.setIcon(QIcon(os.path.join(self.config.assets_folder, "pause.png")))
         self.update_status("OK")
@@ -223,6 +307,62 @@ class SyncElement(QHBoxLayout):
             self.pause_process()
 
     
+    def get_status(self):
+        """Get the status of the syncer for the control API
+
+        Returns:
+            dict: status
+        """
+
+        last_sync = self.handler.last_sync
+        next_run = self.sync_worker.next_run
+
+        return {
+            'name': self.name,
+            'status': self.status,
+            'paused': self.is_paused,
+            'running': self.is_running,
+            'last_sync': last_sync.isoformat() if last_sync is not None else None,
+            'next_run': datetime.datetime.fromtimestamp(next_run).isoformat() if next_run is not None and not self.is_paused else None,
+            'backlog': self.sync_worker.backlog(),
+            'last_cycle': self.sync_worker.last_cycle,
+        }
+
+
+    def request_sync(self, item_id=None, direction=None):
+        """Request a sync from the control API
+
+        Args:
+            item_id (str, optional): only sync this item. Defaults to None.
+            direction (str, optional): direction of the item sync, defaults to the first one of the handler.
+
+        Returns:
+            int: requests waiting to be run
+        """
+
+        if self.is_paused:
+            raise ControlError(409, f"{self.name} is paused")
+
+        if item_id is not None:
+            directions = getattr(self.handler, 'ITEM_DIRECTIONS', ())
+            if not directions:
+                raise ControlError(400, f"{self.name} can't sync single items")
+
+            direction = direction or directions[0]
+            if direction not in directions:
+                raise ControlError(400, f"Unknown direction: {direction}, expected one of {', '.join(directions)}")
+
+        return self.sync_worker.request_sync(item_id, direction)
+
+
+    def request_pause(self):
+        self.pause_requested.emit()
+
+
+    def request_resume(self):
+        self.resume_requested.emit()
+
+
     def update_status_error(self, has_error):
         """
         Update the value of the has_error attribute.
@@ -291,6 +431,7 @@ class SyncElement(QHBoxLayout):
             "Syncing...": "gray"
         }
 
+        self.status = status
         self.ok_label.setText(status)
         self.ok_label.setStyleSheet(f"color: {color_map[status]}; font-weight: bold;")
 
@@ -299,22 +440,41 @@ class SyncScheduler(QObject):
     last_sync = pyqtSignal(datetime.datetime)
     is_running = pyqtSignal(bool)
     has_error = pyqtSignal(bool)
+    progress = pyqtSignal(str)
 
-    def __init__(self, handler, timezone, minutes, *args, **kwargs):
+    def __init__(self, handler, timezone, minutes, profile_cycles=False, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.logger = logging.getLogger(__name__)
         self.handler = handler
+        self.handler.progress_callback = self.progress.emit
         self.timezone = timezone
         self.minutes = minutes
         self.pause = False
+        self.metrics_snapshot = {}
+        self.profile_cycles = profile_cycles
+        self.profile_next = False
+        self.memory_watch = MemoryWatch.from_config(self.handler.activity, self.handler.config.logs_folder, self.handler.config.config)
+        self.requests = deque()
+        self.sync_requested = False
+        self.wakeup = threading.Event()
+        self.next_run = None
+        self.last_cycle = None
         self.is_running.emit(False)
 
 
     def sync(self):
+        # the API calls of this thread are recorded with the activity name
+        REGISTRY.set_context({'activity': self.handler.activity})
+        root = None
+
         try:
             self.is_running.emit(True)
 
-            last_sync = self.handler.sync()
+            # every cycle is traced to the logs folder
+            tracing_config = self.handler.config.config.get('tracing', {})
+            with TRACER.trace(self.handler.activity, self.handler.config.logs_folder, keep=tracing_config.get('keep', 50)) as root:
+                with self.profiler():
+                    last_sync = self.handler.sync()
 
             self.has_error.emit(False)
             self.last_sync.emit(last_sync)
@@ -323,43 +483,157 @@ class SyncScheduler(QObject):
             self.logger.exception(e)
             self.has_error.emit(True)
         
+        finally:
+            if root is not None:
+                self.last_cycle = cycle_stats(root)
+            self.is_running.emit(False)
+            self.metrics_snapshot = write_cycle_snapshot(self.handler.config.logs_folder, self.handler.activity, self.metrics_snapshot)
+
+            if self.memory_watch is not None:
+                self.memory_watch.end_cycle()
+
+
+    def profiler(self):
+        """Get the profiler of the next cycle
+
+        Returns:
+            contextmanager: profiler, a no-op context if the cycle isn't profiled
+        """
+
+        if not (self.profile_cycles or self.profile_next):
+            return nullcontext()
+
+        self.profile_next = False
+        profiling_config = self.handler.config.config.get('profiling', {})
+
+        return profile(
+            self.handler.activity,
+            self.handler.config.logs_folder,
+            mode=profiling_config.get('mode', 'sampling'),
+            keep=profiling_config.get('keep', 20),
+            interval=profiling_config.get('interval_ms', 5) / 1000
+        )
+
+
+    def sync_item(self, item_id, direction):
+        """Sync a single item requested by the control API"""
+
+        REGISTRY.set_context({'activity': self.handler.activity})
+
+        try:
+            self.is_running.emit(True)
+
+            tracing_config = self.handler.config.config.get('tracing', {})
+            with TRACER.trace(self.handler.activity, self.handler.config.logs_folder, keep=tracing_config.get('keep', 50), item=item_id, direction=direction):
+                action = self.handler.sync_item(item_id, direction)
+
+            self.logger.info(f"Synced item {item_id} ({direction}): {action or 'nothing to sync'}")
+
+        except Exception as e:
+            self.logger.exception(e)
+
         finally:
             self.is_running.emit(False)
 
 
+    def request_sync(self, item_id=None, direction=None):
+        """Request a sync, run as soon as the current one ends. Thread safe.
+
+        Args:
+            item_id (str, optional): only sync this item. Defaults to None.
+            direction (str, optional): direction of the item sync. Defaults to None.
+
+        Returns:
+            int: requests waiting to be run
+        """
+
+        if item_id is None:
+            self.sync_requested = True
+        else:
+            self.requests.append((item_id, direction))
+
+        self.wakeup.set()
+        return self.backlog()
+
+
+    def backlog(self):
+        """Get the number of requested syncs waiting to be run
+
+        Returns:
+            int: requests
+        """
+
+        return len(self.requests) + self.sync_requested
+
+
+    def run_requests(self):
+        """Run the requested item syncs
+
+        Returns:
+            bool: whether a full sync was requested
+        """
+
+        while self.requests and not self.pause:
+            item_id, direction = self.requests.popleft()
+            self.sync_item(item_id, direction)
+
+        return self.sync_requested
+
+
     def start_sync(self):
         self.pause = False
-        refresh_time = 1
 
         while not self.pause:
+            # the cycle satisfies the full syncs requested before it
+            self.sync_requested = False
             self.sync()
+            self.next_run = time.time() + self.minutes * 60
 
-            sleep_time = self.minutes * 60
+            # Wait for the next cycle, a pause or a requested sync
+            while not self.pause and time.time() < self.next_run:
+                self.wakeup.wait(self.next_run - time.time())
+                self.wakeup.clear()
 
-            # Check every second if the pause button has been pressed
-            while sleep_time > 0:
-                if self.pause:
+                if self.run_requests():
                     break
 
-                time.sleep(refresh_time)
-                sleep_time -= refresh_time
-
     
     def pause_sync(self):
         self.pause = True
+        self.wakeup.set()
             
 
+def format_duration(seconds):
+    """Format a duration in a short form, e.g. "45s", "3m", "1.5h"
+
+    Args:
+        seconds (float): duration in seconds
+
+    Returns:
+        str: formatted duration
+    """
+
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}m"
+
+    return f"{seconds / 3600:.1f}h"
+
+
 if __name__ == '__main__':
     # Create an argument parser
     parser = argparse.ArgumentParser()
     parser.add_argument("--start-from", choices=["gui", "taskbar"], default="gui")
+    parser.add_argument("--profile", action="store_true", help="profile every sync cycle, the profiles are saved in the logs folder")
 
     # Parse the arguments
     args = parser.parse_args()
 
     # Start the application
     app = QApplication(sys.argv)
-    myapp = SyncGUI()
+    myapp = SyncGUI(profile_cycles=args.profile)
 
     # Determine whether to start from GUI or taskbar
     if args.start_from == "gui":
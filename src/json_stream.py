@@ -0,0 +1,157 @@
+import codecs
+import json
+
+WHITESPACE = ' \t\n\r'
+
+
+class JSONStream:
+    """Incremental reader of a JSON document received in chunks
+
+    Only the part of the document that hasn't been decoded yet is kept in memory,
+    so the peak memory depends on the size of the largest value read at once,
+    not on the size of the document.
+
+    Attributes:
+        chunks (iterator): chunks of the document, bytes or str
+        buffer (str): received text not decoded yet
+        pos (int): position of the next character to read in the buffer
+        eof (bool): whether the whole document has been received
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+
+    def fill(self):
+        """Read the next chunk, dropping the part of the buffer already decoded
+
+        Returns:
+            bool: False if the stream has ended
+        """
+
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            chunk = self.text_decoder.decode(b'', final=True)
+            self.buffer = self.buffer[self.pos:] + chunk
+            self.pos = 0
+            return False
+
+        if isinstance(chunk, bytes):
+            chunk = self.text_decoder.decode(chunk)
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+
+    def peek(self):
+        """Skip the whitespace and return the next character without consuming it
+
+        Returns:
+            str: next character
+        """
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self.fill() and self.pos >= len(self.buffer):
+                raise ValueError('Unexpected end of JSON stream')
+
+
+    def expect(self, chars):
+        """Consume the next character, that must be one of `chars`
+
+        Args:
+            chars (str): allowed characters
+
+        Returns:
+            str: consumed character
+        """
+
+        char = self.peek()
+        if char not in chars:
+            raise ValueError(f'Expected one of "{chars}" at position {self.pos}, found "{char}"')
+
+        self.pos += 1
+        return char
+
+
+    def value(self):
+        """Decode the next JSON value
+
+        Returns:
+            object: decoded value
+        """
+
+        self.peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+
+                # a value at the end of the buffer could be truncated (e.g. a number)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            self.fill()
+
+
+def iter_array(chunks, key, fields):
+    """Decode a JSON object received in chunks, yielding the entries of one of its arrays
+    while they arrive. The other members of the object are stored in `fields` as soon as
+    they are decoded, so they are complete once the iteration is over.
+
+    Args:
+        chunks (iterator): chunks of the document, bytes or str
+        key (str): name of the array to stream
+        fields (dict): dict where the other members are stored
+
+    Yields:
+        object: entries of the array
+    """
+
+    stream = JSONStream(chunks)
+    stream.expect('{')
+
+    if stream.peek() == '}':
+        return
+
+    while True:
+        name = stream.value()
+        stream.expect(':')
+
+        if name == key and stream.peek() == '[':
+            stream.expect('[')
+
+            if stream.peek() == ']':
+                stream.expect(']')
+
+            else:
+                while True:
+                    yield stream.value()
+
+                    if stream.expect(',]') == ']':
+                        break
+
+        else:
+            fields[name] = stream.value()
+
+        if stream.expect(',}') == '}':
+            break
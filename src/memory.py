@@ -0,0 +1,246 @@
+import ctypes
+import datetime
+import logging
+import os
+import sys
+import tracemalloc
+from collections import deque
+
+# allocations of the import machinery and of tracemalloc itself are noise in the reports
+IGNORED_FILES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def current_rss():
+    """Get the resident set size of the process
+
+    Returns:
+        int: RSS in bytes, None if it can't be read on this platform
+    """
+
+    if sys.platform.startswith('linux'):
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    if sys.platform == 'win32':
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', ctypes.c_ulong),
+                ('PageFaultCount', ctypes.c_ulong),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+
+        return counters.WorkingSetSize
+
+    return None
+
+
+def format_size(size):
+    """Format a size in bytes, e.g. "12.3 MiB"
+
+    Args:
+        size (int): size in bytes
+
+    Returns:
+        str: formatted size
+    """
+
+    if size is None:
+        return 'n/a'
+
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+        size /= 1024
+
+    return f'{size:.1f} GiB'
+
+
+class MemoryWatch:
+    """Watermarks of the memory of the process, sampled at the end of every N sync cycles
+
+    At every sample it records the RSS and the memory traced by tracemalloc, and writes a
+    report with the top allocation sites and their growth since the previous sample to
+    "<folder>/memory". If the memory grew at every one of the last `growth_samples`
+    samples, the growth is flagged as a possible leak.
+
+    tracemalloc traces the whole process, so the reports of an activity also include the
+    allocations of the other sync threads.
+
+    Attributes:
+        name (str): name of the watched cycles, e.g. the activity
+        folder (str): logs folder
+        every (int): cycles between two samples
+        top (int): allocation sites listed in the reports
+        growth_samples (int): samples of continuous growth flagged as a leak
+        keep (int): number of reports kept
+        cycles (int): cycles since the start
+        history (collections.deque): (time, rss, traced) of the recent samples
+        snapshot (tracemalloc.Snapshot): snapshot of the previous sample
+    """
+
+    def __init__(self, name, folder, every=10, top=20, growth_samples=3, frames=1, keep=20):
+        self.logger = logging.getLogger(__name__)
+        self.name = name
+        self.folder = os.path.join(folder, 'memory')
+        self.every = every
+        self.top = top
+        self.growth_samples = growth_samples
+        self.keep = keep
+        self.cycles = 0
+        self.history = deque(maxlen=growth_samples + 1)
+        self.snapshot = None
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+
+    @classmethod
+    def from_config(cls, name, folder, config):
+        """Create the watch from the [memory] section of the config
+
+        Args:
+            name (str): name of the watched cycles
+            folder (str): logs folder
+            config (dict): config
+
+        Returns:
+            MemoryWatch: watch, None if it's disabled
+        """
+
+        memory_config = config.get('memory', {})
+        if not memory_config.get('enabled', False):
+            return None
+
+        return cls(
+            name,
+            folder,
+            every=memory_config.get('every', 10),
+            top=memory_config.get('top', 20),
+            growth_samples=memory_config.get('growth_samples', 3),
+            frames=memory_config.get('frames', 1),
+            keep=memory_config.get('keep', 20)
+        )
+
+
+    def end_cycle(self):
+        """Count a finished cycle, sampling the memory every `every` cycles
+
+        Returns:
+            str: path of the report, None if the memory wasn't sampled
+        """
+
+        self.cycles += 1
+        if self.cycles % self.every:
+            return None
+
+        return self.sample()
+
+
+    def sample(self):
+        """Sample the memory and write the report
+
+        Returns:
+            str: path of the report
+        """
+
+        rss = current_rss()
+        traced, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(IGNORED_FILES)
+        self.history.append((datetime.datetime.now(), rss, traced))
+
+        growing = self.growing()
+        if growing:
+            self.logger.warning(f"Memory of {self.name} grew for {self.growth_samples} samples in a row "
+                                f"({', '.join(growing)}), possible leak: see the reports in {self.folder}")
+
+        self.logger.info(f"Memory after {self.cycles} {self.name} cycles: RSS {format_size(rss)}, traced {format_size(traced)}, peak {format_size(peak)}")
+
+        path = self.write_report(snapshot, rss, traced, peak, growing)
+        self.snapshot = snapshot
+        return path
+
+
+    def growing(self):
+        """Get the measures that grew at every one of the recent samples
+
+        Returns:
+            list: names of the growing measures, e.g. ["rss", "traced"]
+        """
+
+        if len(self.history) < self.history.maxlen:
+            return []
+
+        growing = []
+        for index, measure in ((1, 'rss'), (2, 'traced')):
+            values = [sample[index] for sample in self.history]
+            if None not in values and all(a < b for a, b in zip(values, values[1:])):
+                growing.append(measure)
+
+        return growing
+
+
+    def write_report(self, snapshot, rss, traced, peak, growing):
+        """Write the report of a sample, deleting the oldest reports
+
+        Returns:
+            str: path of the report
+        """
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        lines = [
+            f"{self.name} after {self.cycles} cycles",
+            f"RSS: {format_size(rss)}",
+            f"Traced: {format_size(traced)} (peak {format_size(peak)})",
+        ]
+
+        if growing:
+            lines.append(f"POSSIBLE LEAK: {', '.join(growing)} grew for {self.growth_samples} samples in a row")
+
+        lines.append('')
+        lines.append('History:')
+        for time, sample_rss, sample_traced in self.history:
+            lines.append(f"    {time:%Y-%m-%d %H:%M:%S}  RSS {format_size(sample_rss):>12}  traced {format_size(sample_traced):>12}")
+
+        if self.snapshot is not None:
+            lines.append('')
+            lines.append(f'Top {self.top} growing allocation sites since the previous sample:')
+            differences = [d for d in snapshot.compare_to(self.snapshot, 'traceback') if d.size_diff > 0]
+            for difference in differences[:self.top]:
+                lines.append(f"    {format_size(difference.size_diff):>12} ({difference.count_diff:+} blocks)  total {format_size(difference.size):>12}  {difference.traceback}")
+                if len(difference.traceback) > 1:
+                    lines.extend(f"        {line}" for line in difference.traceback.format())
+
+        lines.append('')
+        lines.append(f'Top {self.top} allocation sites:')
+        for statistic in snapshot.statistics('traceback')[:self.top]:
+            lines.append(f"    {format_size(statistic.size):>12} ({statistic.count} blocks)  {statistic.traceback}")
+
+        path = os.path.join(self.folder, f"{self.name}-{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}.txt")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+        reports = sorted(f for f in os.listdir(self.folder) if f.startswith(self.name + '-'))
+        for old in reports[:-self.keep]:
+            os.remove(os.path.join(self.folder, old))
+
+        return path
@@ -0,0 +1,114 @@
+import logging
+from fingerprint import task_fields
+from notion_change_feed import parse_notion_time
+
+# sides kept when a field is changed on both Todoist and Notion
+POLICIES = ('newest', 'todoist', 'notion')
+
+logger = logging.getLogger(__name__)
+
+
+class MergeResult:
+    """Result of the three-way merge of a task
+
+    Attributes:
+        fields (dict): merged fields, normalized as `task_fields`
+        todoist_fields (list): fields to write on Todoist, with the values of the Notion task
+        notion_fields (list): fields to write on Notion, with the values of the Todoist task
+        conflicts (dict): {field: side kept} of the fields changed on both sides
+    """
+
+    def __init__(self, fields, todoist_fields, notion_fields, conflicts):
+        self.fields = fields
+        self.todoist_fields = todoist_fields
+        self.notion_fields = notion_fields
+        self.conflicts = conflicts
+
+
+def newest_side(todoist_task, notion_task):
+    """Get the side with the most recent edit of a task, Todoist if unknown.
+
+    The edit time of the Todoist tasks is their `updated_at`, which the items of the Sync
+    API v9 don't have: without it the conflicts of the "newest" policy are resolved
+    for Todoist, as the "todoist" policy.
+
+    Args:
+        todoist_task (dict): task read from Todoist
+        notion_task (dict): task parsed from Notion
+
+    Returns:
+        str: "todoist" or "notion"
+    """
+
+    todoist_time = todoist_task.get('last_modified')
+    notion_time = notion_task.get('last_edited_time')
+
+    if todoist_time is None or notion_time is None:
+        logger.debug(f"Edit time of task {todoist_task.get('id')} unknown on {'Todoist' if todoist_time is None else 'Notion'}: "
+                    "keeping the Todoist values of the conflicting fields")
+        return 'todoist'
+
+    return 'notion' if parse_notion_time(notion_time) > todoist_time else 'todoist'
+
+
+def merge_task(base, todoist_task, notion_task, policy='todoist', field_policies=None):
+    """Merge the changes of a task on Todoist and Notion from their last synced state
+
+    Every field changed on a single side is taken from that side. A field changed on both
+    sides to different values is a conflict, resolved by the policy of the field or by the
+    default policy: "todoist", "notion" or "newest" (the side edited last).
+    A side that didn't change is assumed to be equal to the base. Without a base the
+    task can't be diffed: if only one side is known, all its fields are written to the
+    other one, if both are, every field that differs is a conflict.
+
+    Args:
+        base (dict): fields of the last sync, None if unknown
+        todoist_task (dict): task read from Todoist, None if unchanged
+        notion_task (dict): task parsed from Notion, None if unchanged
+        policy (str, optional): default policy. Defaults to "todoist".
+        field_policies (dict, optional): {field: policy}. Defaults to None.
+
+    Returns:
+        MergeResult: result
+    """
+
+    field_policies = field_policies or {}
+    todoist = task_fields(todoist_task) if todoist_task is not None else base
+    notion = task_fields(notion_task) if notion_task is not None else base
+
+    if todoist is None or notion is None:
+        # a single side without base: copied whole
+        if todoist is None:
+            return MergeResult(notion, list(notion), [], {})
+        return MergeResult(todoist, [], list(todoist), {})
+
+    fields = {}
+    todoist_fields = []
+    notion_fields = []
+    conflicts = {}
+
+    for field, todoist_value in todoist.items():
+        notion_value = notion[field]
+
+        if todoist_value == notion_value:
+            fields[field] = todoist_value
+            continue
+
+        if base is not None and notion_value == base[field]:
+            side = 'todoist'
+        elif base is not None and todoist_value == base[field]:
+            side = 'notion'
+        else:
+            side = field_policies.get(field, policy)
+            if side == 'newest':
+                side = newest_side(todoist_task, notion_task)
+            conflicts[field] = side
+
+        if side == 'todoist':
+            fields[field] = todoist_value
+            notion_fields.append(field)
+        else:
+            fields[field] = notion_value
+            todoist_fields.append(field)
+
+    return MergeResult(fields, todoist_fields, notion_fields, conflicts)
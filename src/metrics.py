@@ -0,0 +1,455 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Histogram with fixed buckets"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+                break
+
+
+class Summary:
+    """Quantiles over a sliding window of the most recent values"""
+
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.sum = 0
+
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+
+def quantiles(samples):
+    """Compute the quantiles of a list of values
+
+    Args:
+        samples (list): values
+
+    Returns:
+        dict: {quantile: value}
+    """
+
+    samples = sorted(samples)
+    return {q: samples[round(q * (len(samples) - 1))] for q in QUANTILES}
+
+
+class MetricsRegistry:
+    """Process-wide registry of counters and histograms
+
+    Every series is identified by a name and a set of labels. The labels of the context
+    of the current thread (e.g. the activity being synced) are added to every series
+    recorded by the thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.types = {}
+        self.counters = {}
+        self.histograms = {}
+        self.summaries = {}
+        self.local = threading.local()
+
+
+    def get_context(self):
+        """Get the labels of the context of the current thread
+
+        Returns:
+            dict: labels
+        """
+
+        return dict(getattr(self.local, 'context', {}))
+
+
+    def set_context(self, labels):
+        """Set the labels added to the series recorded by the current thread
+
+        Args:
+            labels (dict): labels
+        """
+
+        self.local.context = dict(labels)
+
+
+    def key(self, name, labels):
+        labels = dict(self.get_context(), **(labels or {}))
+        return name, tuple(sorted(labels.items()))
+
+
+    def inc(self, name, labels=None, value=1):
+        """Increment a counter
+
+        Args:
+            name (str): metric name
+            labels (dict, optional): labels. Defaults to None.
+            value (int, optional): increment. Defaults to 1.
+        """
+
+        key = self.key(name, labels)
+
+        with self.lock:
+            self.types.setdefault(name, 'counter')
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def observe(self, name, value, labels=None):
+        """Record a value in a histogram
+
+        Args:
+            name (str): metric name
+            value (float): value
+            labels (dict, optional): labels. Defaults to None.
+        """
+
+        key = self.key(name, labels)
+
+        with self.lock:
+            self.types.setdefault(name, 'histogram')
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+
+    def summarize(self, name, value, labels=None):
+        """Record a value in a summary
+
+        Args:
+            name (str): metric name
+            value (float): value
+            labels (dict, optional): labels. Defaults to None.
+        """
+
+        key = self.key(name, labels)
+
+        with self.lock:
+            self.types.setdefault(name, 'summary')
+            summary = self.summaries.get(key)
+            if summary is None:
+                summary = self.summaries[key] = Summary()
+            summary.observe(value)
+
+
+    def quantiles(self, name, labels=None):
+        """Get the quantiles of the recent values of the summaries matching the labels
+
+        Args:
+            name (str): metric name
+            labels (dict, optional): labels the series must have. Defaults to None.
+
+        Returns:
+            dict: {quantile: value}, None if there are no values
+        """
+
+        labels = set((labels or {}).items())
+
+        with self.lock:
+            samples = [v for (key_name, key_labels), summary in self.summaries.items()
+                       if key_name == name and labels <= set(key_labels) for v in summary.samples]
+
+        if not samples:
+            return None
+
+        return quantiles(samples)
+
+
+    def observe_lag(self, connector, direction, modified, timezone=None):
+        """Record the propagation lag of an item: the time from its modification on the
+        source to the confirmed write on the destination, i.e. now
+
+        Args:
+            connector (str): connector, e.g. "todoist"
+            direction (str): direction, e.g. "todoist_to_notion"
+            modified (datetime.datetime): modification time on the source
+            timezone (pytz.timezone, optional): timezone of `modified` if it's naive. Defaults to None.
+        """
+
+        if modified is None:
+            return
+
+        if modified.tzinfo is None:
+            modified = timezone.localize(modified) if timezone is not None else modified.replace(tzinfo=datetime.timezone.utc)
+
+        lag = (datetime.datetime.now(datetime.timezone.utc) - modified).total_seconds()
+        self.summarize('propagation_lag_seconds', max(lag, 0), {'connector': connector, 'direction': direction})
+
+
+    def observe_call(self, service, endpoint, seconds, status=None, size=0):
+        """Record an API call
+
+        Args:
+            service (str): service called, e.g. "notion"
+            endpoint (str): endpoint called
+            seconds (float): duration of the call
+            status (int | str, optional): HTTP status, "error" if the call failed without a response. Defaults to None.
+            size (int, optional): bytes received. Defaults to 0.
+        """
+
+        labels = {'service': service, 'endpoint': endpoint}
+
+        self.inc('api_calls_total', labels)
+        self.observe('api_call_duration_seconds', seconds, labels)
+
+        if size:
+            self.inc('api_received_bytes_total', labels, size)
+
+        if status == 429:
+            self.inc('api_throttled_total', labels)
+
+        if status is not None and not (isinstance(status, int) and 200 <= status <= 299):
+            self.inc('api_errors_total', dict(labels, status=str(status)))
+
+
+    def record_size(self, size):
+        """Record the bytes received by the call running in the current thread,
+        for clients that only see the size at the transport level
+
+        Args:
+            size (int): bytes received
+        """
+
+        self.local.size = getattr(self.local, 'size', 0) + size
+
+
+    @contextmanager
+    def time_call(self, service, endpoint):
+        """Time an API call. The block can set "status" and "size" in the yielded dict.
+        If the block raises, the call is recorded as an error.
+
+        Args:
+            service (str): service called
+            endpoint (str): endpoint called
+
+        Yields:
+            dict: call info
+        """
+
+        call = {'status': None, 'size': 0}
+        self.local.size = 0
+        start = time.perf_counter()
+
+        try:
+            yield call
+
+        except Exception as e:
+            if call['status'] is None:
+                call['status'] = getattr(e, 'status', None) or getattr(e, 'status_code', None) or 'error'
+            raise
+
+        finally:
+            size = call['size'] or self.local.size
+            self.observe_call(service, endpoint, time.perf_counter() - start, call['status'] or 200, size)
+
+
+    def snapshot(self, labels=None):
+        """Get the value of every series, in Prometheus notation
+
+        Args:
+            labels (dict, optional): only return the series with these labels. Defaults to None.
+
+        Returns:
+            dict: {series: value}
+        """
+
+        labels = set((labels or {}).items())
+        series = {}
+
+        with self.lock:
+            for (name, key_labels), value in self.counters.items():
+                if labels <= set(key_labels):
+                    series[format_series(name, key_labels)] = value
+
+            for (name, key_labels), histogram in self.histograms.items():
+                if not labels <= set(key_labels):
+                    continue
+
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    series[format_series(name + '_bucket', key_labels + (('le', str(bucket)),))] = cumulative
+
+                series[format_series(name + '_bucket', key_labels + (('le', '+Inf'),))] = histogram.count
+                series[format_series(name + '_count', key_labels)] = histogram.count
+                series[format_series(name + '_sum', key_labels)] = histogram.sum
+
+            for (name, key_labels), summary in self.summaries.items():
+                if not labels <= set(key_labels) or not summary.samples:
+                    continue
+
+                for q, value in quantiles(summary.samples).items():
+                    series[format_series(name, key_labels + (('quantile', str(q)),))] = value
+
+                series[format_series(name + '_count', key_labels)] = summary.count
+                series[format_series(name + '_sum', key_labels)] = summary.sum
+
+        return series
+
+
+    def render_prometheus(self):
+        """Render all the series in the Prometheus text format
+
+        Returns:
+            str: metrics
+        """
+
+        snapshot = self.snapshot()
+
+        with self.lock:
+            types = dict(self.types)
+
+        lines = []
+        for name, kind in sorted(types.items()):
+            lines.append(f'# TYPE {name} {kind}')
+            for series, value in snapshot.items():
+                if series.split('{')[0] in (name, name + '_bucket', name + '_count', name + '_sum'):
+                    lines.append(f'{series} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_series(name, labels):
+    if not labels:
+        return name
+
+    labels = ','.join(f'{k}="{v}"' for k, v in labels)
+    return f'{name}{{{labels}}}'
+
+
+def write_cycle_snapshot(folder, activity, previous, labels=None):
+    """Write the metrics of an activity to "<folder>/metrics/<activity>.json", with the
+    difference from the previous snapshot as the cost of the last cycle
+
+    Args:
+        folder (str): logs folder
+        activity (str): activity name
+        previous (dict): snapshot of the previous cycle
+        labels (dict, optional): other labels of the series, e.g. the tenant. Defaults to None.
+
+    Returns:
+        dict: current snapshot
+    """
+
+    current = REGISTRY.snapshot(dict(labels or {}, activity=activity))
+    # quantiles are current values, not totals
+    cycle = {series: value if 'quantile=' in series else value - previous.get(series, 0) for series, value in current.items()}
+
+    folder = os.path.join(folder, 'metrics')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    data = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'activity': activity,
+        'cycle': {series: value for series, value in cycle.items() if value},
+        'total': current
+    }
+
+    path = os.path.join(folder, f'{activity}.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(path + '.tmp', path)
+
+    return current
+
+
+class InstrumentedClient:
+    """Proxy of an API client that records every method call, e.g. `client.databases.query(...)`
+    is recorded as the "databases.query" endpoint.
+    """
+
+    def __init__(self, target, service, name=None):
+        self.target = target
+        self.service = service
+        self.name = name
+
+
+    def __getattr__(self, attr):
+        value = getattr(self.target, attr)
+        name = attr if self.name is None else f'{self.name}.{attr}'
+
+        if callable(value):
+            def call(*args, **kwargs):
+                with REGISTRY.time_call(self.service, name):
+                    return value(*args, **kwargs)
+
+            return call
+
+        return InstrumentedClient(value, self.service, name)
+
+
+class MetricsServer:
+    """HTTP server exposing the metrics on localhost: "/metrics" in the Prometheus text format,
+    "/metrics.json" as a JSON snapshot
+
+    Attributes:
+        port (int): port
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.logger = logging.getLogger(__name__)
+        self.server = None
+
+
+    def start(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = REGISTRY.render_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(REGISTRY.snapshot(), indent=4).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info(f"Metrics available at http://127.0.0.1:{self.port}/metrics")
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+
+REGISTRY = MetricsRegistry()
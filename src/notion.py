@@ -1,31 +1,70 @@
 from datetime import datetime
-import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from urllib.parse import unquote
+import httpx
 from notion_client import Client
-from notion2md.exporter.block import StringExporter
+from notion2md.config import Config as ExportConfig
+from notion2md.convertor.block import BlockConvertor
+from metrics import REGISTRY, InstrumentedClient
+from rate_limit import FairRateLimiter
+
+# properties read from the pages of the tasks
+TASK_READ_PROPERTIES = ('Id', 'Nome', 'Priorità', 'Data', 'Progetto', 'Ricorrenza', 'Tags', 'Fatto')
+
+# conditions of the compound filters of the batched Id lookups
+ID_FILTER_SIZE = 100
+
+# properties of the synced fields of the tasks
+TASK_PROPERTIES = {
+    'content': 'Nome',
+    'project': 'Progetto',
+    'checked': 'Fatto',
+    'labels': 'Tags',
+    'priority': 'Priorità',
+    'due': 'Data',
+    'recurrence': 'Ricorrenza',
+}
 
 
 class Notion:
     def __init__(self, config, timezone):
-        self.notion = Client(auth=config['key'])
+        # the syncers using the same integration share the client, its rate budget and the projects
+        self.session = NotionSession.get(config)
+        self.notion = self.session.client
         self.project_db = config['projects_db']
         self.calendar_db = config['calendar_db']
         self.tasks_db = config['tasks_db']
         self.timezone = timezone
-
-        # export NOTION_TOKEN environment variable for notion2md
-        os.environ['NOTION_TOKEN'] = config['key']
+        self.page_ids = PageIdCache(config.get('id_cache', 1000))
 
     
-    def update_projects(self):
-        """Get all the projects from Notion database
-        
+    def update_projects(self, refresh=False):
+        """Get all the projects from Notion database. The projects are shared by the
+        syncers and read again only when they're older than the session TTL.
+
+        Args:
+            refresh (bool, optional): read the projects even if they're recent. Defaults to False.
+
         Returns:
             dict: {project_name: project_id}
         """
-        response = self.notion.databases.query(database_id=self.project_db)
-        self.projects = {p['properties']['Nome']['title'][0]['text']['content']:p['id'] for p in response['results']}
+
+        self.projects = self.session.project_registry(self.project_db).get(self.query_projects, refresh)
 
         return self.projects
+
+
+    def query_projects(self):
+        """Read all the projects from Notion database
+
+        Returns:
+            dict: {project_name: project_id}
+        """
+
+        return {p['properties']['Nome']['title'][0]['text']['content']: p['id'] for p in self.query_database(self.project_db, properties=['Nome'])}
     
 
     def get_projects(self):
@@ -103,21 +142,19 @@ class Notion:
                     projects_names.append(project_name)
 
     
-    def get_from_db(self, db_id, id):
+    def get_from_db(self, db_id, id, properties=None):
         """Get an element from a database
 
         Args:
             db_id (str): database id
             id (str): element id
+            properties (list, optional): names of the properties returned, None for all of them. Defaults to None.
 
         Returns:
             dict: element data
         """
 
-        response = self.notion.databases.query(
-            database_id=db_id,
-            filter={"property": "Id", "rich_text": {"equals": id}}
-        )
+        response = self.query(db_id, properties, filter={"property": "Id", "rich_text": {"equals": id}})
 
         if response['results']:
             return response['results'][0]
@@ -125,14 +162,76 @@ class Notion:
         return None
         
 
+    def find_page(self, db_id, id):
+        """Get the page id of an element, from the pages resolved by `resolve_ids` or
+        with a query
+
+        Args:
+            db_id (str): database id
+            id (str): element id
+
+        Returns:
+            str: page id, None if the element isn't in the database
+        """
+
+        found, page_id = self.page_ids.get(db_id, id)
+        if found:
+            return page_id
+
+        data = self.get_from_db(db_id, id, properties=['Id'])
+        page_id = data['id'] if data is not None else None
+        self.page_ids.put(db_id, id, page_id)
+        return page_id
+
+
+    def resolve_ids(self, db_id, ids):
+        """Find the pages of many elements with a few queries, e.g. the elements changed in
+        a sync cycle: the ids are looked up `ID_FILTER_SIZE` at a time with a compound
+        filter, and the pages found are kept for `find_page`
+
+        Args:
+            db_id (str): database id
+            ids (iterable): element ids
+
+        Returns:
+            dict: {element id: page id}, the page id is None if the element isn't in the database
+        """
+
+        ids = list(dict.fromkeys(i for i in ids if i is not None))
+        pages = {}
+
+        for start in range(0, len(ids), ID_FILTER_SIZE):
+            chunk = ids[start:start + ID_FILTER_SIZE]
+            query_filter = {'or': [{'property': 'Id', 'rich_text': {'equals': i}} for i in chunk]}
+
+            found = {}
+            for page in self.query_database(db_id, ['Id'], filter=query_filter, page_size=100):
+                found.setdefault(self.get_id_property(page), page['id'])
+
+            for i in chunk:
+                pages[i] = found.get(i)
+                self.page_ids.put(db_id, i, pages[i])
+
+        return pages
+
+
     def add_in_db(self, db_id, data, **kwargs):
         """Add an element in a database
         
         Args:
             db_id (str): database id
             data (dict): element data
+
+        Returns:
+            dict: page
         """
-        self.notion.pages.create(parent={"database_id": db_id}, properties=data, **kwargs)
+        page = self.notion.pages.create(parent={"database_id": db_id}, properties=data, **kwargs)
+
+        element_id = self.get_id_property(page)
+        if element_id is not None:
+            self.page_ids.put(db_id, element_id, page['id'])
+
+        return page
 
 
     def add_calendar_event(self, data, **kwargs):
@@ -170,6 +269,7 @@ class Notion:
         """
         
         self.notion.blocks.delete(event_internal_id)
+        self.page_ids.forget_page(event_internal_id)
 
 
     def convert_event_to_notion(self, event):
@@ -227,24 +327,54 @@ class Notion:
         return data, content, icon
 
 
-    def get_calendar_events(self, start_date, end_date):
-        """Get all the events in a date range
+    def query_calendar_events(self, start_date, end_date, properties=None):
+        """Iterate through the events in a date range
         
         Args:
             start_date (str): start date
             end_date (str): end date
+            properties (list, optional): names of the properties returned, None for all of them. Defaults to None.
         
-        Returns:
-            list: list of events
+        Yields:
+            dict: Notion page
         """
-        response = self.notion.databases.query(
-            database_id=self.calendar_db,
+        yield from self.query_database(
+            self.calendar_db,
+            properties,
             filter={"and": [
                 {"property": "Intervallo", "date": {"on_or_after": start_date, "on_or_before": end_date}},
                 {"property": "Tags", "multi_select": {"contains": "Meeting"}}
             ]},
             sorts=[{"property": "Intervallo", "direction": "ascending"}])
-        return response['results']
+
+
+    def get_calendar_events(self, start_date, end_date):
+        """Get all the events in a date range
+        
+        Args:
+            start_date (str): start date
+            end_date (str): end date
+        
+        Returns:
+            list: list of events
+        """
+        return list(self.query_calendar_events(start_date, end_date))
+
+
+    def get_id_property(self, page):
+        """Get the value of the Id property of a page
+
+        Args:
+            page (dict): Notion page
+
+        Returns:
+            str: id, None if empty
+        """
+        value = page['properties']['Id']['rich_text']
+        if value != []:
+            return value[0]['text']['content']
+
+        return None
     
 
     def check_event_exists(self, event_id):
@@ -256,12 +386,7 @@ class Notion:
         Returns:
             str: event internal id
         """
-        data = self.get_from_db(self.calendar_db, event_id)
-        
-        if data is not None:
-            return data['id']
-        
-        return None
+        return self.find_page(self.calendar_db, event_id)
     
 
     def check_task_exists(self, task_id):
@@ -273,12 +398,7 @@ class Notion:
         Returns:
             str: task internal id
         """
-        data = self.get_from_db(self.tasks_db, task_id)
-        
-        if data is not None:
-            return data['id']
-        
-        return None
+        return self.find_page(self.tasks_db, task_id)
 
 
     def add_task(self, data, **kwargs):
@@ -286,23 +406,66 @@ class Notion:
         
         Args:
             data (dict): task data
+
+        Returns:
+            dict: page
         """
         properties, content = self.convert_task_to_notion(data)
-        self.add_in_db(self.tasks_db, properties, children=content, **kwargs)
+        return self.add_in_db(self.tasks_db, properties, children=content, **kwargs)
 
 
-    def update_task(self, task_internal_id, data, **kwargs):
+    def update_task(self, task_internal_id, data, fields=None, **kwargs):
         """Edit a task in Notion
         
         Args:
             task_id (str): task id
             data (dict): task data
+            fields (list, optional): fields to write, None for the properties of all of them. Defaults to None.
+                "id" writes the Id property, see `update_id_task`.
+
+        Returns:
+            dict: page updated, None if the body was replaced too: its edit time isn't the one of the page returned
         """
-        # TODO update the content too
-        properties, _ = self.convert_task_to_notion(data)
+        properties, content = self.convert_task_to_notion(data)
+
+        # the empty values clear the properties
+        properties = dict({'Priorità': {'select': None}, 'Data': {'date': None}, 'Ricorrenza': {'rich_text': []}}, **properties)
+
+        if fields is not None:
+            names = {TASK_PROPERTIES[f] for f in fields if f in TASK_PROPERTIES}
+            if 'id' in fields:
+                names.add('Id')
+            properties = {name: value for name, value in properties.items() if name in names}
 
         # update the page
-        self.notion.pages.update(task_internal_id, properties=properties, **kwargs)
+        page = None
+        if properties:
+            page = self.notion.pages.update(task_internal_id, properties=properties, **kwargs)
+
+        if fields is not None and 'id' in fields:
+            self.page_ids.forget_page(task_internal_id)
+            self.page_ids.put(self.tasks_db, data['id'], task_internal_id)
+
+        if fields is not None and 'description' in fields:
+            self.replace_body(task_internal_id, content)
+            return None
+
+        return page
+
+
+    def replace_body(self, page_id, content):
+        """Replace the blocks of the body of a page
+
+        Args:
+            page_id (str): page id
+            content (list): new blocks
+        """
+
+        for block in self.session.blocks.get_children(page_id):
+            self.notion.blocks.delete(block['id'])
+
+        if content:
+            self.notion.blocks.children.append(page_id, children=content)
 
     
     def update_id_task(self, internal_id, new_id):
@@ -313,6 +476,8 @@ class Notion:
             new_id (str): new task id
         """
         self.notion.pages.update(internal_id, properties={'Id': {'rich_text': [{'text': {'content': new_id}}]}})
+        self.page_ids.forget_page(internal_id)
+        self.page_ids.put(self.tasks_db, new_id, internal_id)
 
 
     def delete_task(self, task_internal_id):
@@ -322,6 +487,7 @@ class Notion:
             task_id (str): task id
         """
         self.notion.blocks.delete(task_internal_id)
+        self.page_ids.forget_page(task_internal_id)
 
     
     def convert_task_to_notion(self, task):
@@ -375,111 +541,505 @@ class Notion:
         return data, content
     
 
+    def query(self, db_id, properties=None, **kwargs):
+        """Query a database, returning only some properties of the pages
+
+        Args:
+            db_id (str): database id
+            properties (list, optional): names of the properties returned, None for all of them. Defaults to None.
+            **kwargs: query parameters (filter, sorts, start_cursor, ...)
+
+        Returns:
+            dict: response
+        """
+
+        if properties is None:
+            return self.notion.databases.query(database_id=db_id, **kwargs)
+
+        # filter_properties is a query string parameter, not supported by databases.query of notion_client
+        with REGISTRY.time_call('notion', 'databases.query'):
+            return self.session.raw_client.request(
+                path=f'databases/{db_id}/query',
+                method='POST',
+                query={'filter_properties': self.session.property_ids(db_id, properties)},
+                body=kwargs
+            )
+
+
+    def query_database(self, db_id, properties=None, **kwargs):
+        """Query a database, following the pagination
+
+        Args:
+            db_id (str): database id
+            properties (list, optional): names of the properties returned, None for all of them. Defaults to None.
+            **kwargs: query parameters (filter, sorts, ...)
+
+        Yields:
+            dict: page
+        """
+
+        start_cursor = None
+
+        while True:
+            if start_cursor is not None:
+                kwargs['start_cursor'] = start_cursor
+
+            response = self.query(db_id, properties, **kwargs)
+            yield from response['results']
+
+            if not response.get('has_more'):
+                break
+
+            start_cursor = response['next_cursor']
+
+
+    def query_tasks(self, from_date=None, to_date=None, properties=TASK_READ_PROPERTIES):
+        """Get the raw pages of the tasks edited in a date range
+
+        Args:
+            from_date (datetime.datetime, optional): edited on or after this date. Defaults to None.
+            to_date (datetime.datetime, optional): edited on or before this date. Defaults to None.
+            properties (list, optional): names of the properties returned, None for all of them. Defaults to the ones read by `parse_task`.
+
+        Yields:
+            dict: Notion page
+        """
+
+        # FIXME it doesn't find archived tasks, so it can't update them
+
+        if from_date is None and to_date is None:
+            yield from self.query_database(self.tasks_db, properties)
+            return
+
+        filter_params = {
+            "and": []
+        }
+        
+        if from_date is not None:
+            filter_params['and'].append({
+                "timestamp": "last_edited_time",
+                "last_edited_time": {
+                    "on_or_after": from_date.isoformat()
+                }
+            })
+
+        if to_date is not None:
+            filter_params['and'].append({
+                "timestamp": "last_edited_time",
+                "last_edited_time": {
+                    "on_or_before": to_date.isoformat()
+                }
+            })
+
+        yield from self.query_database(self.tasks_db, properties, filter=filter_params)
+
+
+    def parse_task(self, task):
+        """Convert a Notion page to a task. The fields are converted when they're read,
+        see `NotionTask`.
+
+        Args:
+            task (dict): Notion page
+
+        Returns:
+            NotionTask: task data
+        """
+
+        return NotionTask(self, task)
+    
+
+    def get_description(self, page_id):
+        """Get the description of a task: the plain text of the page body
+
+        Args:
+            page_id (str): page id
+
+        Returns:
+            str: description, None if the body is empty
+        """
+
+        # the blocks are read with the session client, rate limited and with the right token,
+        # and given to the notion2md converter, which reads the children blocks with it too
+        convertor = BlockConvertor(ExportConfig(block_id=page_id), self.session.blocks)
+        description = convertor.to_string(self.session.blocks.get_children(page_id)).replace('<br/>', '\n')
+        if description == '':
+            return None
+
+        return description
+
+
     def get_tasks(self, from_date=None, to_date=None):
-        """Get all the tasks in Notion from last edit
+        """Get all the tasks in Notion edited in a date range
         
         Args:
-            last_edit (datetime.datetime, optional): last edit date. Defaults to None.
+            from_date (datetime.datetime, optional): edited on or after this date. Defaults to None.
+            to_date (datetime.datetime, optional): edited on or before this date. Defaults to None.
         
+        Yields:
+            dict: task data
+        """
+
+        for task in self.query_tasks(from_date, to_date):
+            yield self.parse_task(task)
+
+
+class NotionTask(MutableMapping):
+    """Task of a Notion page, parsed lazily: every field is converted from the page the
+    first time it's read, so the fields that aren't used are never converted and the body
+    of the page (the description, an API call) is only read when needed.
+
+    The fields can be set like the ones of a dict, e.g. the id of a new Todoist task.
+
+    Attributes:
+        notion (Notion): Notion client, to read the projects and the description
+        page (dict): Notion page
+    """
+
+    FIELDS = ('notion_id', 'id', 'content', 'description', 'labels', 'checked', 'is_deleted',
+              'due', 'project', 'priority', 'recurrence', 'last_edited_time')
+
+    def __init__(self, notion, page):
+        self.notion = notion
+        self.page = page
+        self.values = {}
+
+
+    def __getitem__(self, key):
+        if key not in self.values:
+            if key not in self.FIELDS:
+                raise KeyError(key)
+
+            self.values[key] = getattr(self, f'parse_{key}')()
+
+        return self.values[key]
+
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+
+    def __delitem__(self, key):
+        del self.values[key]
+
+
+    def __iter__(self):
+        yield from self.FIELDS
+        yield from (key for key in self.values if key not in self.FIELDS)
+
+
+    def __len__(self):
+        return len(self.FIELDS) + sum(1 for key in self.values if key not in self.FIELDS)
+
+
+    def __repr__(self):
+        return f'NotionTask({self.page["id"]})'
+
+
+    @property
+    def properties(self):
+        return self.page['properties']
+
+
+    def parse_notion_id(self):
+        return self.page['id']
+
+
+    def parse_id(self):
+        return self.notion.get_id_property(self.page)
+
+
+    def parse_content(self):
+        return self.properties['Nome']['title'][0]['text']['content']
+
+
+    def parse_description(self):
+        return self.notion.get_description(self.page['id'])
+
+
+    def parse_labels(self):
+        return [t['name'].replace(' ', '_').lower() for t in self.properties['Tags']['multi_select']]
+
+
+    def parse_checked(self):
+        return self.properties['Fatto']['checkbox']
+
+
+    def parse_is_deleted(self):
+        return self.page['archived']
+
+
+    def parse_due(self):
+        due = self.properties['Data']['date']
+        if due is not None:
+            due = datetime.fromisoformat(due['start'])
+
+        return due
+
+
+    def parse_project(self):
+        project = self.properties['Progetto']['relation']
+
+        if project != []:
+            return self.notion.get_project_name(project[0]['id'])
+
+        return 'Inbox'
+
+
+    def parse_priority(self):
+        priority = self.properties['Priorità']['select']
+        if priority is not None:
+            return 5 - int(priority['name'])
+
+        return 1
+
+
+    def parse_recurrence(self):
+        recurrence = self.properties['Ricorrenza']['rich_text']
+        if recurrence != []:
+            return recurrence[0]['text']['content']
+
+        return None
+
+
+    def parse_last_edited_time(self):
+        return self.page['last_edited_time']
+
+
+def record_response_size(response):
+    """Record the size of a Notion API response in the metrics
+
+    Args:
+        response (httpx.Response): response
+    """
+    response.read()
+    REGISTRY.record_size(len(response.content))
+
+
+class ProjectRegistry:
+    """Projects of the Notion projects database shared by the syncers, read again
+    when they're older than `ttl` seconds
+
+    Attributes:
+        ttl (float): seconds the projects are kept
+        projects (dict): {project_name: project_id}
+        updated (float): monotonic time of the last read
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.projects = None
+        self.updated = 0
+        self.lock = threading.Lock()
+
+
+    def get(self, query, refresh=False):
+        """Get the projects, reading them if they're missing or expired
+
+        Args:
+            query (callable): function reading the projects
+            refresh (bool, optional): read the projects even if they're recent. Defaults to False.
+
         Returns:
-            list: list of tasks
+            dict: {project_name: project_id}
         """
 
-        # FIXME it doesn't find archived tasks, so it can't update them
-        # FIXME Last edited and created time properties are rounded to the nearest minute, take this into account
+        # the syncers asking at the same time wait for a single read
+        with self.lock:
+            if refresh or self.projects is None or time.monotonic() - self.updated > self.ttl:
+                self.projects = query()
+                self.updated = time.monotonic()
 
-        if from_date is None and to_date is None:
-            response = self.notion.databases.query(database_id=self.tasks_db)
+            return self.projects
 
-        else:
-            filter_params = {
-                "and": []
-            }
-            
-            if from_date is not None:
-                filter_params['and'].append({
-                    "timestamp": "last_edited_time",
-                    "last_edited_time": {
-                        "on_or_after": from_date.isoformat()
-                    }
-                })
-
-            if to_date is not None:
-                filter_params['and'].append({
-                    "timestamp": "last_edited_time",
-                    "last_edited_time": {
-                        "on_or_before": to_date.isoformat()
-                    }
-                })
-
-            response = self.notion.databases.query(
-                database_id=self.tasks_db,
-                filter=filter_params
-            )
 
-        for task in response['results']:
-            # get the last edit time
-            last_edit = task['last_edited_time']
-            print(from_date, to_date, last_edit)
-            
-            # TODO last edit arrotondato al minuto, trovare una maniera per gestirlo
-
-
-            task_id = task['properties']['Id']['rich_text']
-            if task_id != []:
-                task_id = task_id[0]['text']['content']
-            else:
-                task_id = None
-
-            # Convert the priority
-            priority = task['properties']['Priorità']['select']
-            if priority is not None:
-                priority = priority['name']
-                priority = int(priority)
-                priority = 5-priority
-            else:
-                priority = 1
-
-            # Convert the due date
-            due = task['properties']['Data']['date']
-            if due is not None:
-                due = datetime.fromisoformat(due['start'])
-
-            # Get the project name
-            project = task['properties']['Progetto']['relation']
-
-            if project != []:
-                project = self.get_project_name(project[0]['id'])
-            else:
-                project = 'Inbox'
-
-            # Get the description: use the plain text of the body
-            description = StringExporter(block_id=task['id']).export().replace('<br/>', '\n')
-            if description == '':
-                description = None
-
-            # Get the recurrence
-            recurrence = task['properties']['Ricorrenza']['rich_text']
-            if recurrence != []:
-                recurrence = recurrence[0]['text']['content']
-            else:
-                recurrence = None
-                
-
-            processed_item = {
-                'notion_id': task['id'],
-                'id': task_id,
-                'content': task['properties']['Nome']['title'][0]['text']['content'],
-                'description': description,
-                'labels': [t['name'].replace(' ', '_').lower() for t in task['properties']['Tags']['multi_select']],
-                'checked': task['properties']['Fatto']['checkbox'],
-                'is_deleted': task['archived'],
-                'due': due,
-                'project': project,
-                'priority': priority,
-                'recurrence': recurrence
-            }
+class PageIdCache:
+    """Least recently used page ids of the elements of the databases, including the
+    elements that aren't in their database
+
+    Attributes:
+        size (int): maximum number of elements
+        pages (collections.OrderedDict): {(database id, element id): page id}, from the least recently used
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+
+    def get(self, db_id, id):
+        """Get the page id of an element
+
+        Returns:
+            tuple: (found, page id), the page id is None if the element isn't in the database
+        """
+
+        with self.lock:
+            if (db_id, id) not in self.pages:
+                return False, None
+
+            self.pages.move_to_end((db_id, id))
+            return True, self.pages[db_id, id]
+
+
+    def put(self, db_id, id, page_id):
+        with self.lock:
+            self.pages[db_id, id] = page_id
+            self.pages.move_to_end((db_id, id))
+
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+
+
+    def forget_page(self, page_id):
+        """Forget the element of a page, e.g. when it's deleted"""
+
+        with self.lock:
+            for key in [k for k, v in self.pages.items() if v == page_id]:
+                del self.pages[key]
+
+
+class NotionSession:
+    """Notion client shared by all the syncers of the process using the same integration
+
+    The integration rate limit is shared by all its clients, so every request takes a
+    token from a single rate limiter. The tokens are given in turn to the contexts of the
+    calling threads (e.g. the activities), so a backfill can't starve the other syncers.
+
+    Attributes:
+        key (str): integration token
+        client (InstrumentedClient): Notion client
+        raw_client (notion_client.Client): Notion client, for the requests not recorded by the instrumented one
+        blocks (BlockReader): reader of the page bodies for notion2md
+        limiter (FairRateLimiter): rate limiter of the requests
+        projects (dict): {projects database id: ProjectRegistry}, the syncers can use different projects databases
+        schemas (dict): {database id: {property name: property id}} of the databases queried
+    """
+
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    def __init__(self, config):
+        self.key = config['key']
+        self.limiter = FairRateLimiter(config.get('rate', 3), burst=config.get('burst', 3))
+        self.projects_ttl = config.get('projects_ttl', 60)
+        self.projects = {}
+        self.projects_lock = threading.Lock()
+
+        # every call is recorded in the metrics, with the size of the response
+        http_client = httpx.Client(event_hooks={'request': [self.throttle], 'response': [record_response_size]})
+        client = Client(client=http_client, auth=config['key'], base_url=config.get('base_url', 'https://api.notion.com'))
+        self.raw_client = client
+        self.client = InstrumentedClient(client, 'notion')
+        self.blocks = BlockReader(self.client)
+        self.schemas = {}
+        self.schemas_lock = threading.Lock()
+
+
+    @classmethod
+    def get(cls, config):
+        """Get the session of an integration, creating it on first use
+
+        Args:
+            config (dict): notion config
+
+        Returns:
+            NotionSession: session
+        """
+
+        key = (config['key'], config.get('base_url'))
+
+        with cls.sessions_lock:
+            if key not in cls.sessions:
+                cls.sessions[key] = cls(config)
+
+            return cls.sessions[key]
+
+
+    def project_registry(self, db_id):
+        """Get the projects of a projects database, creating their registry on first use
+
+        Args:
+            db_id (str): projects database id
+
+        Returns:
+            ProjectRegistry: projects
+        """
+
+        with self.projects_lock:
+            if db_id not in self.projects:
+                self.projects[db_id] = ProjectRegistry(self.projects_ttl)
+
+            return self.projects[db_id]
+
+
+    def property_ids(self, db_id, names):
+        """Get the ids of properties of a database, as required by filter_properties.
+        The schema of a database is read once.
+
+        Args:
+            db_id (str): database id
+            names (list): property names, the ones not in the database are ignored
+
+        Returns:
+            list: property ids
+        """
+
+        with self.schemas_lock:
+            schema = self.schemas.get(db_id)
+
+        if schema is None:
+            database = self.client.databases.retrieve(database_id=db_id)
+            # the ids are URL encoded, they're encoded again with the query string
+            schema = {name: unquote(p['id']) for name, p in database['properties'].items()}
+
+            with self.schemas_lock:
+                self.schemas[db_id] = schema
+
+        return [schema[name] for name in names if name in schema]
+
+
+    def throttle(self, request):
+        """Wait for the turn of the calling thread before a request
+
+        Args:
+            request (httpx.Request): request
+        """
+
+        context = REGISTRY.get_context()
+        waited = self.limiter.acquire(tuple(sorted(context.items())))
+        REGISTRY.observe('rate_limit_wait_seconds', waited, {'service': 'notion'})
+
+
+class BlockReader:
+    """Reader of the children of a block, used by notion2md to export the page bodies
+
+    Attributes:
+        client (InstrumentedClient): Notion client
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+
+    def get_children(self, parent_id):
+        """Get all the children of a block
+
+        Args:
+            parent_id (str): block id
+
+        Returns:
+            list: blocks
+        """
+
+        results = []
+        start_cursor = None
+
+        while True:
+            response = self.client.blocks.children.list(block_id=parent_id, start_cursor=start_cursor, page_size=100)
+            results.extend(response['results'])
+
+            if not response.get('has_more'):
+                return results
 
-            priority = task['properties']['Priorità']['select']
-            
-            yield processed_item
+            start_cursor = response['next_cursor']
@@ -0,0 +1,142 @@
+import datetime
+import logging
+
+
+class NotionChangeFeed:
+    """Incremental feed of the pages edited in a Notion database
+
+    Notion rounds `last_edited_time` to the minute, so a plain "edited since last sync"
+    filter either loses the edits made in the last minute before a sync or fetches them
+    again every cycle. The feed queries from a high-water mark minus an overlap window
+    and drops the pages already processed with the same edit time, if that minute was
+    over when they were processed. The pages edited in the minute of the mark may have
+    been edited again in the same minute, e.g. their body, with the same edit time: they
+    are returned again, the syncers recognize the unchanged ones. So no edit is lost and
+    re-processing is bounded to the overlap.
+
+    The state of the feed is saved by the syncer with its checkpoint, see `commit`.
+
+    Attributes:
+        notion (Notion): Notion client
+        config (Config): Config
+        name (str): name of the persisted state
+        overlap (datetime.timedelta): overlap window
+        high_water (datetime.datetime): pages edited before this time have been processed
+        seen (dict): {page_id: last_edited_time} for the pages in the overlap window
+    """
+
+    def __init__(self, notion, config, name, since=None, overlap_minutes=2):
+        self.notion = notion
+        self.config = config
+        self.name = name
+        self.overlap = datetime.timedelta(minutes=overlap_minutes)
+        self.logger = logging.getLogger(__name__)
+
+        state = self.config.load_state(self.name)
+
+        if state is not None:
+            self.high_water = datetime.datetime.fromisoformat(state['high_water'])
+            # the older states have the content hash of the pages too
+            self.seen = {page_id: value[0] if isinstance(value, list) else value for page_id, value in state['seen'].items()}
+        else:
+            # first run with the feed: start from the last sync, if any
+            self.high_water = since
+            self.seen = {}
+
+        self.pending = {}
+        self.pending_high_water = None
+
+
+    def changes(self, until=None):
+        """Iterate through the pages edited since the last commit
+
+        Args:
+            until (datetime.datetime, optional): start time of the current cycle, used as the next high-water mark.
+                Defaults to now.
+
+        Yields:
+            dict: Notion page
+        """
+
+        if until is None:
+            until = datetime.datetime.now(datetime.timezone.utc)
+
+        from_date = None
+        if self.high_water is not None:
+            from_date = self.high_water - self.overlap
+
+        skipped = 0
+
+        for page in self.notion.query_tasks(from_date):
+            edited = page['last_edited_time']
+
+            # a page edited in the minute of the mark may have changed since it was processed
+            if self.seen.get(page['id']) == edited and parse_notion_time(edited) < self.high_water:
+                skipped += 1
+                continue
+
+            self.pending[page['id']] = edited
+            yield page
+
+        if skipped > 0:
+            self.logger.debug(f"Skipped {skipped} pages already processed in the overlap window")
+
+        # edits are rounded to the minute, so the mark is the start of the minute
+        self.pending_high_water = until.replace(second=0, microsecond=0)
+
+
+    def commit(self):
+        """Mark the pages returned by `changes` as processed and advance the high-water mark
+
+        Returns:
+            dict: {state name: state} of the feed, saved with the checkpoint by `Config.update_last_sync`
+        """
+
+        if self.pending_high_water is None:
+            return {}
+
+        self.seen.update(self.pending)
+        self.high_water = self.pending_high_water
+
+        # pages edited before the overlap window won't be returned again unless edited
+        cutoff = self.high_water - self.overlap
+        self.seen = {
+            page_id: value for page_id, value in self.seen.items()
+            if parse_notion_time(value) >= cutoff
+        }
+
+        self.pending = {}
+        self.pending_high_water = None
+
+        return {self.name: {'high_water': self.high_water.isoformat(), 'seen': self.seen}}
+
+
+    def reset(self, until=None):
+        """Skip all the edits made before `until`, e.g. after a backfill
+
+        Args:
+            until (datetime.datetime, optional): new high-water mark. Defaults to now.
+
+        Returns:
+            dict: {state name: state} of the feed, see `commit`
+        """
+
+        if until is None:
+            until = datetime.datetime.now(datetime.timezone.utc)
+
+        self.pending = {}
+        self.pending_high_water = until.replace(second=0, microsecond=0)
+        return self.commit()
+
+
+def parse_notion_time(value):
+    """Parse a Notion timestamp
+
+    Args:
+        value (str): timestamp, e.g. "2023-01-01T10:00:00.000Z"
+
+    Returns:
+        datetime.datetime: timezone aware datetime
+    """
+
+    return datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
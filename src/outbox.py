@@ -0,0 +1,178 @@
+import datetime
+import logging
+import uuid
+import httpx
+import requests
+from notion_client.errors import RequestTimeoutError
+from metrics import REGISTRY
+from write_queue import PendingWrite
+
+
+def is_unreachable(error):
+    """Check if an error means the destination can't be reached now: network errors,
+    timeouts, rate limits and server errors. The other errors are caused by the write.
+
+    Args:
+        error (Exception): error of a write
+
+    Returns:
+        bool: True if the write should be retried later as it is
+    """
+
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError, RequestTimeoutError)):
+        return True
+
+    # TodoistError and notion_client.APIResponseError
+    status = getattr(error, 'status', None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+class Outbox:
+    """Durable queue of the writes of a syncer, stored in the checkpoints database
+
+    The writes are stored before being applied and removed once applied, so the writes
+    of a cycle survive a destination that can't be reached and a restart: the checkpoint
+    can move forward and the next cycles replay the writes in order, while the reads go
+    on. Every write has an idempotency key, so a write applied whose response was lost
+    isn't applied twice: the uuid of the Todoist command, and for the Notion pages the Id
+    property, looked up before a create is replayed. The writes not appended by this
+    outbox, left by a run that stopped while applying them, are all replayed ones.
+
+    A destination that can't be reached keeps its writes and isn't tried again until
+    `replay(retry=True)`, at the start of the next cycle. A write failing with another
+    error is retried up to `max_attempts` times, then dropped with the receipts and the
+    base of its entity, which no longer match any side.
+
+    Attributes:
+        config (Config): config, with the checkpoints database
+        activity (str): activity name
+        writers (dict): {destination: function applying a list of `PendingWrite` in order and calling their `done`}
+        max_attempts (int): failed attempts before a write is dropped
+        unreachable (set): destinations that couldn't be reached in this cycle
+        appended (set): keys of the writes appended by this outbox and not yet tried
+    """
+
+    def __init__(self, config, activity, writers, max_attempts=5):
+        self.logger = logging.getLogger(__name__)
+        self.config = config
+        self.activity = activity
+        self.writers = writers
+        self.max_attempts = max_attempts
+        self.unreachable = set()
+        self.appended = set()
+
+
+    def append(self, writes):
+        """Store writes, giving them their idempotency key
+
+        Args:
+            writes (list): `PendingWrite`, with JSON serializable data
+        """
+
+        if not writes:
+            return
+
+        for write in writes:
+            write.key = write.key or str(uuid.uuid4())
+            self.appended.add(write.key)
+
+        self.config.queue_writes(self.activity, [{
+            'destination': write.destination,
+            'entity': write.entity_id,
+            'action': write.action,
+            'data': dict(write.data) if write.data is not None else None,
+            'fields': write.fields,
+            'target': write.target,
+            'key': write.key,
+            'modified': write.modified.isoformat() if write.modified is not None else None,
+        } for write in writes])
+
+
+    def pending(self):
+        """Count the stored writes not yet applied
+
+        Returns:
+            dict: {destination: number of writes}
+        """
+
+        counts = {}
+        for row in self.config.queued_writes(self.activity):
+            counts[row['destination']] = counts.get(row['destination'], 0) + 1
+
+        return counts
+
+
+    def entities(self):
+        """Get the entities with stored writes not yet applied
+
+        Returns:
+            set: entity ids
+        """
+
+        return {row['entity'] for row in self.config.queued_writes(self.activity)}
+
+
+    def replay(self, retry=False):
+        """Apply the stored writes in order, destination by destination
+
+        Args:
+            retry (bool, optional): try again the destinations that couldn't be reached. Defaults to False.
+
+        Returns:
+            int: number of writes applied
+        """
+
+        if retry:
+            self.unreachable.clear()
+
+        by_destination = {}
+        for row in self.config.queued_writes(self.activity):
+            modified = datetime.datetime.fromisoformat(row['modified']) if row['modified'] is not None else None
+            write = PendingWrite(row['destination'], row['entity'], row['action'], row['data'], row['fields'],
+                                 row['target'], row['key'], row['seq'], row['attempts'], modified)
+            write.replayed = write.attempts > 0 or write.key not in self.appended
+            by_destination.setdefault(write.destination, []).append(write)
+
+        applied = 0
+        error = None
+
+        for destination, writes in by_destination.items():
+            if destination in self.unreachable:
+                continue
+
+            # from now on they may be applied
+            self.appended.difference_update(w.key for w in writes)
+
+            try:
+                self.writers[destination](writes)
+
+            except Exception as e:
+                failed = [w for w in writes if not w.applied]
+                self.config.retry_writes([w.seq for w in failed])
+
+                if is_unreachable(e):
+                    self.unreachable.add(destination)
+                    REGISTRY.inc('outbox_unreachable_total', {'destination': destination})
+                    self.logger.warning(f"{destination} can't be reached, {len(failed)} writes kept for later: {e!r}")
+
+                elif failed and failed[0].attempts + 1 >= self.max_attempts:
+                    # the first write not applied is the one that failed
+                    self.config.complete_writes([failed[0].seq])
+                    self.config.forget_writes(failed[0].entity_id)
+                    REGISTRY.inc('outbox_dropped_total', {'destination': destination})
+                    self.logger.error(f"Dropping the {failed[0].action} of {failed[0].entity_id} on {destination} "
+                                      f"after {self.max_attempts} attempts: {e!r}")
+
+                else:
+                    error = error or e
+
+            finally:
+                done = [w.seq for w in writes if w.applied]
+                self.config.complete_writes(done)
+                applied += len(done)
+                REGISTRY.inc('outbox_applied_total', {'destination': destination}, len(done))
+
+        if error is not None:
+            raise error
+
+        return applied
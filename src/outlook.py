@@ -1,6 +1,7 @@
 import win32com.client
 import pythoncom
 import logging
+from metrics import REGISTRY
 
 class Outlook:
     """Outlook client class"""
@@ -60,6 +61,8 @@ class Outlook:
         else:
             self.logger.info(f"Iterating through folder {folder}")
 
+        endpoint = folder_mapping.get(folder, str(folder))
+
         folder = mapi.GetDefaultFolder(folder).Items
         folder.IncludeRecurrences = True
 
@@ -82,7 +85,16 @@ class Outlook:
         if len(restrictions) > 0:
             restrictions = " AND ".join(restrictions)
             self.logger.debug(f"Restricting folder to {restrictions}")
-            folder = folder.Restrict(restrictions)
+            with REGISTRY.time_call('outlook', f'{endpoint}.Restrict'):
+                folder = folder.Restrict(restrictions)
+
+        # time every item fetched through COM
+        items = iter(folder)
+        while True:
+            with REGISTRY.time_call('outlook', f'{endpoint}.next'):
+                item = next(items, None)
+
+            if item is None:
+                break
 
-        for item in folder:
-            yield item
\ No newline at end of file
+            yield item
@@ -1,8 +1,10 @@
 import datetime
+import logging
 import math
 import re
 import pywintypes
 from outlook import Outlook
+from records import Event
 
 # [ ] get the link for joining a meeting
 # [ ] eventi ricorrenti sono buggati quando vanno aggiornati o cancellati (se cambio orario non lo trova più...)
@@ -33,7 +35,10 @@ class OutlookCalendar(Outlook):
         Yields:
             dict: Event
         """
-        
+
+        # the deleted occurrences are collected again on every iteration
+        self.deleted_recurrences = []
+
         for event in self.iterate_folder(9, from_date, to_date, last_modified, threaded=threaded):
             self.logger.info(f"Event: {event.Subject} - start: {event.Start} - last modified: {event.LastModificationTime}")
 
@@ -162,7 +167,7 @@ class OutlookCalendar(Outlook):
 
 
     def appointment_to_dict(self, appointment, recurrence_num=None, recurrence_date=None):
-        """Convert an appointment object to a dict
+        """Convert an appointment object to an event record
 
         Args:
             appointment (win32com.client.Dispatch): Appointment object
@@ -170,7 +175,7 @@ class OutlookCalendar(Outlook):
             recurrence_date (datetime): Recurrence date
 
         Returns:
-            dict: Event data
+            Event: Event data
         """
 
         identifier = appointment.GlobalAppointmentID
@@ -186,21 +191,22 @@ class OutlookCalendar(Outlook):
             appointment_end = recurrence_date + (appointment.End - appointment.Start)
             
 
-        event_dict = {
-            "id": identifier,
-            "subject": appointment.Subject,
-            "start": appointment_start,
-            "end": appointment_end,
-            "location": appointment.Location,
-            "project": appointment.Categories.split("; ") if appointment.Categories else [],
-            "organizer": appointment.Organizer,
-            "last_modified": appointment.LastModificationTime,
-        }
-        
-        self.logger.debug(f"Event dict: {event_dict}")
-
-        event_dict.update({"body": self.clean_body(appointment.Body)})
-        return event_dict
+        event = Event(
+            id=identifier,
+            subject=appointment.Subject,
+            start=appointment_start,
+            end=appointment_end,
+            location=appointment.Location,
+            project=appointment.Categories.split("; ") if appointment.Categories else (),
+            organizer=appointment.Organizer,
+            body=self.clean_body(appointment.Body),
+            last_modified=appointment.LastModificationTime,
+        )
+
+        # logged without the body, which is long and may be private
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Event: %s", event.replace(body=''))
+        return event
     
 
     def clean_body(self, body):
@@ -1,9 +1,17 @@
 import datetime
+import heapq
+import itertools
+import time
 from outlook_calendar import OutlookCalendar
 from notion import Notion
 import logging
 import pythoncom
 import fnmatch
+from fingerprint import fingerprint
+from functools import partial
+from backfill import Backfill
+from tracing import TRACER
+from metrics import REGISTRY
 
 # [ ] Log migliori
 # [ ] Trovare come fare update senza cancellare e ricreare
@@ -38,6 +46,7 @@ class CalendarSync:
         self.notion = Notion(self.config_data['notion'], self.config.timezone_str)
 
         self.activity = 'calendar'
+        self.progress_callback = None
         self.last_sync = self.config.load_last_sync(self.activity)
 
         if self.last_sync is not None:
@@ -49,82 +58,104 @@ class CalendarSync:
     def sync(self, from_date=None, to_date=None):
         """Sync calendar events from Outlook to Notion
 
+        The changes are written in order of urgency: first the deletions, time changes and
+        new events of the imminent meetings, then the other changes of the imminent meetings,
+        then the later events by start time and finally the past ones. With a time budget
+        ([calendar] time_budget_seconds) the cycle stops when the budget is spent: the
+        written events are checkpointed and the rest is carried over to the next cycle.
+
         Args:
             from_date (datetime): Only return events from this date
             to_date (datetime): Only return events to this date
         """
 
+        started = time.monotonic()
+        budget = self.config_data['calendar'].get('time_budget_seconds')
+
         created = 0
         updated = 0
         deleted = 0
 
-        self.notion.update_projects()
+        with TRACER.span('projects'):
+            self.notion.update_projects()
 
         # make this configurable
         from_date = datetime.datetime.now(self.config.timezone).replace(hour=0, minute=0, second=0, microsecond=0)
         to_date = from_date + datetime.timedelta(days=14)
 
+        # start and end of the synced events, to tell the time changes apart
+        times = self.config.load_state('calendar_event_times') or {}
+
         try:
             if self.threaded:
                 pythoncom.CoInitialize()
 
-            # Iterate through all new and modified events
-            for event in self.outlook_calendar.iterate_events(from_date, to_date, self.last_sync, self.threaded):
-                if any(fnmatch.fnmatch(event['subject'], i) for i in self.config_data['calendar']['ignore']):
-                    self.logger.info(f"Skipping event: {event['subject']}")
-                    continue
+            # Events completed by an interrupted sync are skipped
+            done = self.config.begin_sync(self.activity)
+            if done:
+                self.logger.info(f"Resuming interrupted sync: {len(done)} events already synced")
 
-                self.logger.info(f"Syncing event: {event['subject']} ({event['start'].strftime('%d/%m/%Y')}")
+            queue = []
 
-                # Check if event exists in notion
-                notion_event_id = self.notion.check_event_exists(event['id'])
+            if self.last_sync is None:
+                with TRACER.span('backfill'):
+                    self.backfill(from_date, to_date, done, times)
 
-                if notion_event_id is not None:
-                    self.logger.info("Event already exists in Notion, updating it")
-                    self.notion.update_calendar_event(notion_event_id, event)
-                    updated += 1
+            else:
+                with TRACER.span('read_changes') as phase:
+                    queue = self.read_changes(from_date, to_date, times)
 
-                else:
-                    self.logger.info("Event does not exist in Notion, creating it")
-                    self.notion.add_calendar_event(event)
-                    created += 1
+                    if phase is not None:
+                        phase.set(count=len(queue))
 
-            # Iterate through all deleted events from last sync
-            for event in self.outlook_calendar.iterate_deleted_events(self.last_sync, self.threaded):
-                if any(fnmatch.fnmatch(event['subject'], i) for i in self.config_data['calendar']['ignore']):
-                    self.logger.info(f"Skipping event: {event['subject']}")
-                    continue
+                # The pages of the changed events are found with a few queries
+                with TRACER.span('resolve_ids'):
+                    self.notion.resolve_ids(self.notion.calendar_db, [event['id'] for *_, event in queue])
 
-                self.logger.info(f"Deleting event: {event['subject']}")
+                # Write the changes, the most urgent first
+                with TRACER.span('write_changes') as phase:
+                    while queue:
+                        if budget and time.monotonic() - started > budget:
+                            break
 
-                # Check if event exists in notion
-                notion_event_id = self.notion.check_event_exists(event['id'])
+                        _, _, _, change, event = heapq.heappop(queue)
 
-                if notion_event_id is not None:
-                    self.logger.info("Event exists in Notion, deleting it")
-                    self.notion.delete_calendar_event(notion_event_id)
-                    deleted += 1
+                        if change == 'deleted':
+                            deleted += self.delete_event(event, done, times) is not None
 
-                else:
-                    self.logger.info("Event does not exist in Notion, skipping")
+                        else:
+                            action = self.write_event(event, done, times)
+                            created += action == 'created'
+                            updated += action == 'updated'
 
-            
-            success_message = f"Notion calendar sync successful: "
-            if created == 0 and updated == 0 and deleted == 0:
-                self.logger.info(success_message + "nothing to sync")
+                    if phase is not None:
+                        phase.set(created=created, updated=updated, deleted=deleted, carried_over=len(queue))
 
-            else:
-                if created > 0:
-                    success_message += f"{created} created, "
-                if updated > 0:
-                    success_message += f"{updated} updated, "
-                if deleted > 0:
-                    success_message += f"{deleted} deleted, "
+                success_message = f"Notion calendar sync successful: "
+                if created == 0 and updated == 0 and deleted == 0:
+                    self.logger.info(success_message + "nothing to sync")
 
-                self.logger.info(success_message[:-2])
+                else:
+                    if created > 0:
+                        success_message += f"{created} created, "
+                    if updated > 0:
+                        success_message += f"{updated} updated, "
+                    if deleted > 0:
+                        success_message += f"{deleted} deleted, "
+
+                    self.logger.info(success_message[:-2])
 
             # Save last sync
-            self.last_sync = self.config.update_last_sync(self.activity)
+            with TRACER.span('checkpoint'):
+                # forget the events that ended before the synced range
+                times = {k: v for k, v in times.items() if datetime.datetime.fromisoformat(v[1]) >= from_date}
+
+                if queue:
+                    # the sync is resumed by the next cycle, skipping the events already written
+                    self.logger.warning(f"Time budget of {budget}s spent, {len(queue)} events carried over to the next cycle")
+                    self.config.save_state('calendar_event_times', times)
+                else:
+                    self.last_sync = self.config.update_last_sync(self.activity, states={'calendar_event_times': times})
 
             pythoncom.CoUninitialize()
             
@@ -134,4 +165,205 @@ class CalendarSync:
         except Exception as e:
             if self.threaded:
                 pythoncom.CoUninitialize()
-            raise e
\ No newline at end of file
+            raise e
+
+
+    def local_time(self, value):
+        """Get a datetime with a timezone, the config one if it has none
+
+        Args:
+            value (datetime.datetime): datetime
+
+        Returns:
+            datetime.datetime: datetime with a timezone
+        """
+
+        if value.tzinfo is None:
+            return self.config.timezone.localize(value)
+
+        return value
+
+
+    def read_changes(self, from_date, to_date, times):
+        """Read the new, modified and deleted events since the last sync in a priority queue.
+        The queue is ordered by:
+        0. deletions, time changes and new events of the imminent meetings
+        1. other changes of the imminent meetings
+        2. later events
+        3. past events
+        and then by start time.
+
+        Args:
+            from_date (datetime): Only return events from this date
+            to_date (datetime): Only return events to this date
+            times (dict): {event id: [start, end]} of the synced events
+
+        Returns:
+            list: heap of (priority, start, sequence, change, event), change is "event" or "deleted"
+        """
+
+        ignore = self.config_data['calendar']['ignore']
+        now = datetime.datetime.now(self.config.timezone)
+        imminent = now + datetime.timedelta(hours=self.config_data['calendar'].get('imminent_hours', 4))
+
+        queue = []
+        sequence = itertools.count()
+
+        def push(change, event):
+            if any(fnmatch.fnmatch(event['subject'], i) for i in ignore):
+                self.logger.info(f"Skipping event: {event['subject']}")
+                return
+
+            start = self.local_time(event['start'])
+            end = self.local_time(event['end'])
+
+            if end < now:
+                priority = 3
+            elif start > imminent:
+                priority = 2
+            elif change == 'deleted' or times.get(event['id']) != [start.isoformat(), end.isoformat()]:
+                priority = 0
+            else:
+                priority = 1
+
+            heapq.heappush(queue, (priority, start, next(sequence), change, event))
+
+        # the deleted occurrences of the recurring events are found while iterating the events
+        for event in TRACER.iterate(self.outlook_calendar.iterate_events(from_date, to_date, self.last_sync, self.threaded), 'outlook_read'):
+            push('event', event)
+
+        for event in TRACER.iterate(self.outlook_calendar.iterate_deleted_events(self.last_sync, self.threaded), 'outlook_read_deleted'):
+            push('deleted', event)
+
+        return queue
+
+
+    def write_event(self, event, done, times):
+        """Create or update an event in Notion
+
+        Args:
+            event (dict): event data
+            done (set): keys of the events already synced by an interrupted sync
+            times (dict): {event id: [start, end]} of the synced events, updated
+
+        Returns:
+            str: "created" or "updated", None if it was already synced
+        """
+
+        with TRACER.span('notion_write', id=event['id']):
+            item_key = f"event:{event['id']}:{fingerprint(event)}"
+            if item_key in done:
+                return None
+
+            self.logger.info(f"Syncing event: {event['subject']} ({event['start'].strftime('%d/%m/%Y')}")
+
+            # Check if event exists in notion
+            notion_event_id = self.notion.check_event_exists(event['id'])
+
+            if notion_event_id is not None:
+                self.logger.info("Event already exists in Notion, updating it")
+                self.notion.update_calendar_event(notion_event_id, event)
+                action = 'updated'
+
+            else:
+                self.logger.info("Event does not exist in Notion, creating it")
+                self.notion.add_calendar_event(event)
+                action = 'created'
+
+            times[event['id']] = [self.local_time(event['start']).isoformat(), self.local_time(event['end']).isoformat()]
+            self.config.mark_done(self.activity, item_key)
+            REGISTRY.observe_lag(self.activity, 'outlook_to_notion', event['last_modified'], self.config.timezone)
+
+            return action
+
+
+    def delete_event(self, event, done, times):
+        """Delete an event from Notion
+
+        Args:
+            event (dict): event data
+            done (set): keys of the events already synced by an interrupted sync
+            times (dict): {event id: [start, end]} of the synced events, updated
+
+        Returns:
+            str: "deleted", None if it was already deleted or it doesn't exist in Notion
+        """
+
+        with TRACER.span('notion_delete', id=event['id']):
+            item_key = f"deleted:{event['id']}:{fingerprint(event)}"
+            if item_key in done:
+                return None
+
+            self.logger.info(f"Deleting event: {event['subject']}")
+            action = None
+
+            # Check if event exists in notion
+            notion_event_id = self.notion.check_event_exists(event['id'])
+
+            if notion_event_id is not None:
+                self.logger.info("Event exists in Notion, deleting it")
+                self.notion.delete_calendar_event(notion_event_id)
+                action = 'deleted'
+
+            else:
+                self.logger.info("Event does not exist in Notion, skipping")
+
+            times.pop(event['id'], None)
+            self.config.mark_done(self.activity, item_key)
+
+            # the lag is measured on the writes only
+            if action == 'deleted':
+                REGISTRY.observe_lag(self.activity, 'outlook_to_notion', event['last_modified'], self.config.timezone)
+
+            return action
+
+
+    def backfill(self, from_date, to_date, done, times):
+        """Sync all the events in bulk, used for the first sync.
+        Both sides are read upfront and the writes are run concurrently.
+
+        Args:
+            from_date (datetime): Only sync events from this date
+            to_date (datetime): Only sync events to this date
+            done (set): keys of the events already synced by an interrupted backfill
+            times (dict): {event id: [start, end]} of the synced events, updated
+        """
+
+        ignore = self.config_data['calendar']['ignore']
+
+        # Prefetch both sides
+        self.logger.info("Backfill: reading Outlook events")
+        events = [e for e in self.outlook_calendar.iterate_events(from_date, to_date, threaded=self.threaded)
+                  if not any(fnmatch.fnmatch(e['subject'], i) for i in ignore)]
+
+        self.logger.info("Backfill: reading Notion events")
+        notion_events = {}
+        for page in self.notion.query_calendar_events(from_date.isoformat(), to_date.isoformat(), properties=['Id']):
+            event_id = self.notion.get_id_property(page)
+            if event_id is not None:
+                notion_events[event_id] = page['id']
+
+        # Compute the writes
+        jobs = []
+        for event in events:
+            item_key = f"event:{event['id']}:{fingerprint(event)}"
+            if item_key in done:
+                continue
+
+            notion_event_id = notion_events.get(event['id'])
+            if notion_event_id is not None:
+                jobs.append((item_key, f"updating {event['subject']}", partial(self.notion.update_calendar_event, notion_event_id, event)))
+            else:
+                jobs.append((item_key, f"creating {event['subject']}", partial(self.notion.add_calendar_event, event)))
+
+        for event in self.outlook_calendar.iterate_deleted_events(threaded=self.threaded):
+            item_key = f"deleted:{event['id']}:{fingerprint(event)}"
+            notion_event_id = notion_events.pop(event['id'], None)
+
+            if notion_event_id is not None and item_key not in done:
+                jobs.append((item_key, f"deleting {event['subject']}", partial(self.notion.delete_calendar_event, notion_event_id)))
+
+        Backfill(self.config, self.activity, self.progress_callback).run(jobs)
+
+        for event in events:
+            times[event['id']] = [self.local_time(event['start']).isoformat(), self.local_time(event['end']).isoformat()]
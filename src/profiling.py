@@ -0,0 +1,114 @@
+import cProfile
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class SamplingProfiler:
+    """Profiler that samples the stack of a thread at a fixed interval
+
+    The samples are saved in the collapsed stack format ("frame;frame;frame count" per line),
+    which can be read by flamegraph.pl, speedscope and most flame graph tools. Sampling has a
+    low, constant overhead, so it can be left enabled on every cycle.
+
+    Attributes:
+        thread_id (int): id of the sampled thread
+        interval (float): seconds between two samples
+        samples (collections.Counter): {collapsed stack: count}
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.running = False
+        self.thread = None
+
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+    def run(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                    frame = frame.f_back
+
+                self.samples[';'.join(reversed(stack))] += 1
+
+            time.sleep(self.interval)
+
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.items():
+                f.write(f'{stack} {count}\n')
+
+
+@contextmanager
+def profile(name, folder, mode='sampling', keep=20, interval=0.005):
+    """Profile the code run in the block by the current thread, saving the profile to
+    "<folder>/profiles". Deterministic profiles are saved in the pstats format (.prof),
+    readable by snakeviz, flameprof and gprof2dot, sampling profiles in the collapsed
+    stack format (.folded).
+
+    Args:
+        name (str): profile name, e.g. the activity
+        folder (str): logs folder
+        mode (str, optional): "sampling" or "deterministic". Defaults to "sampling".
+        keep (int, optional): number of profiles kept per name. Defaults to 20.
+        interval (float, optional): seconds between two samples in sampling mode. Defaults to 0.005.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    folder = os.path.join(folder, 'profiles')
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    filename = f"{name}-{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}"
+
+    if mode == 'deterministic':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        profiler = SamplingProfiler(threading.get_ident(), interval)
+        profiler.start()
+
+    try:
+        yield
+
+    finally:
+        if mode == 'deterministic':
+            profiler.disable()
+            path = os.path.join(folder, filename + '.prof')
+            profiler.dump_stats(path)
+        else:
+            profiler.stop()
+            path = os.path.join(folder, filename + '.folded')
+            profiler.write(path)
+
+        logger.info(f"Profile saved to {path}")
+
+        # delete the oldest profiles
+        profiles = sorted(f for f in os.listdir(folder) if f.startswith(name + '-'))
+        for old in profiles[:-keep]:
+            os.remove(os.path.join(folder, old))
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class RateLimiter:
+    """Token bucket rate limiter, safe to share between threads
+
+    Attributes:
+        rate (float): tokens added per second
+        burst (int): maximum number of tokens
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+
+    def acquire(self):
+        """Wait until a token is available and take it"""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class FairRateLimiter(RateLimiter):
+    """Token bucket rate limiter shared by several callers, e.g. the syncers using the same
+    API token. When the callers are waiting, the tokens are given to them in turn, so a
+    caller making many requests can't starve the others.
+
+    Attributes:
+        rate (float): tokens added per second
+        burst (int): maximum number of tokens
+        queues (collections.OrderedDict): {caller: waiting tickets}, in the order they're served
+    """
+
+    def __init__(self, rate, burst=1):
+        super().__init__(rate, burst)
+        self.condition = threading.Condition(self.lock)
+        self.queues = OrderedDict()
+
+
+    def acquire(self, caller=None):
+        """Wait for the turn of the caller and for a token, and take it
+
+        Args:
+            caller (hashable, optional): caller, e.g. the activity. Defaults to None.
+
+        Returns:
+            float: seconds waited
+        """
+
+        ticket = object()
+        start = time.monotonic()
+
+        with self.condition:
+            self.queues.setdefault(caller, deque()).append(ticket)
+
+            while True:
+                wait = None
+
+                # the first ticket of the first caller in the queue is served
+                if next(iter(self.queues.values()))[0] is ticket:
+                    now = time.monotonic()
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+
+                        # the caller goes to the end of the line
+                        queue = self.queues.pop(caller)
+                        queue.popleft()
+                        if queue:
+                            self.queues[caller] = queue
+
+                        self.condition.notify_all()
+                        return now - start
+
+                    wait = (1 - self.tokens) / self.rate
+
+                self.condition.wait(wait)
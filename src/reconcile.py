@@ -0,0 +1,86 @@
+import hashlib
+
+# digits of the hash prefixes of the buckets, 16**DEPTH buckets
+DEPTH = 2
+
+
+def id_hash(item_id):
+    """Get the hash of an id: its bucket and its part of the digest of the bucket
+
+    Args:
+        item_id (str): id
+
+    Returns:
+        tuple: (bucket prefix, 60 bits integer)
+    """
+
+    digest = hashlib.sha1(item_id.encode('utf-8')).hexdigest()
+    return digest[:DEPTH], int(digest[DEPTH:DEPTH + 15], 16)
+
+
+class IdBuckets:
+    """Set of ids bucketed by the hex prefix of their hash, with a digest per bucket
+
+    The digest of a bucket is the XOR of the hashes of its ids: an id added or removed
+    updates it without reading the other ones, so the digests of a stored set can be kept
+    up to date as it changes (see `CheckpointStore.save_base`), and two sets are compared
+    bucket by bucket, reading the ids of the buckets that differ only.
+
+    Attributes:
+        buckets (dict): {prefix: set of ids} of the non empty buckets
+        digests (dict): {prefix: digest} of the non empty buckets
+    """
+
+    def __init__(self, ids=()):
+        self.buckets = {}
+        self.digests = {}
+
+        for item_id in ids:
+            self.add(item_id)
+
+
+    def add(self, item_id):
+        """Add an id, once"""
+
+        prefix, value = id_hash(item_id)
+        bucket = self.buckets.setdefault(prefix, set())
+
+        if item_id not in bucket:
+            bucket.add(item_id)
+            self.digests[prefix] = self.digests.get(prefix, 0) ^ value
+
+
+    def mismatched(self, digests):
+        """Get the buckets that differ from the ones of another set
+
+        Args:
+            digests (dict): {prefix: digest} of the other set, the empty buckets can be missing
+
+        Returns:
+            list: prefixes of the buckets, sorted
+        """
+
+        return sorted(prefix for prefix in set(self.digests) | set(digests) if self.digests.get(prefix, 0) != digests.get(prefix, 0))
+
+
+def missing_from(digests, scan, load_buckets):
+    """Get the ids of a stored set that are missing from a scanned one, reading only the
+    stored ids of the buckets whose digests differ
+
+    Args:
+        digests (dict): {prefix: digest} of the stored set
+        scan (IdBuckets): scanned set
+        load_buckets (callable): function getting the stored ids of a list of buckets
+
+    Returns:
+        tuple: (missing ids, number of mismatched buckets)
+    """
+
+    buckets = scan.mismatched(digests)
+    if not buckets:
+        return [], 0
+
+    scanned = set().union(*(scan.buckets.get(prefix, set()) for prefix in buckets))
+    missing = sorted(item_id for item_id in load_buckets(buckets) if item_id not in scanned)
+
+    return missing, len(buckets)
@@ -0,0 +1,106 @@
+import datetime
+import sys
+from dataclasses import dataclass, field, fields, replace
+
+
+def intern_all(values):
+    """Intern the strings of a sequence, sorted so equal sets are equal tuples
+
+    Args:
+        values (iterable): strings
+
+    Returns:
+        tuple: interned strings
+    """
+
+    return tuple(sorted(sys.intern(v) for v in values))
+
+
+class Record:
+    """Read access by field name shared by the records and the parsed Notion pages,
+    so the converters to the Notion and Todoist payloads accept both: the records can be
+    read as mappings of their fields, e.g. with `in`, `dict` or a `ChainMap`
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+    def keys(self):
+        return [f.name for f in fields(self)]
+
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def replace(self, **changes):
+        """Get a copy of the record with some fields changed"""
+
+        return replace(self, **changes)
+
+
+@dataclass(frozen=True, slots=True)
+class Task(Record):
+    """Task read from Todoist
+
+    Two tasks are equal if their synced fields are equal. The labels are a sorted tuple
+    and the project and label names are interned: the same few strings are shared by
+    all the tasks.
+    """
+
+    id: str
+    content: str
+    description: str = ''
+    priority: int = 1
+    due: datetime.date = None
+    project: str = None
+    labels: tuple = ()
+    checked: bool = False
+    is_deleted: bool = False
+    recurrence: str = None
+    last_modified: datetime.datetime = field(default=None, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'labels', intern_all(self.labels))
+        if self.project is not None:
+            object.__setattr__(self, 'project', sys.intern(self.project))
+
+
+@dataclass(frozen=True, slots=True)
+class Event(Record):
+    """Event read from Outlook
+
+    Two events are equal if their synced fields are equal. The projects (categories),
+    the organizer and the location are interned.
+    """
+
+    id: str
+    subject: str
+    start: datetime.datetime
+    end: datetime.datetime
+    location: str = ''
+    project: tuple = ()
+    organizer: str = ''
+    body: str = ''
+    last_modified: datetime.datetime = field(default=None, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'project', intern_all(self.project))
+        if self.organizer:
+            object.__setattr__(self, 'organizer', sys.intern(self.organizer))
+        if self.location:
+            object.__setattr__(self, 'location', sys.intern(self.location))
@@ -0,0 +1,272 @@
+"""Run the sync cycles of many accounts in a single process
+
+Every subfolder of the tenants folder with a config.toml is an account (tenant), with
+its own checkpoints, state and logs in the subfolder. The cycles of all the tenants are
+run by a bounded pool of workers:
+- a tenant activity is never run twice at the same time, so a huge account takes at
+  most one worker per activity
+- the due cycles are run in the order they became due, so the tenants with slow cycles
+  go back in line behind the others
+- every tenant uses its own tokens, so each one has its own Notion rate budget
+  ([notion] rate in the tenant config)
+
+The tenant config can set the activities and the interval of the cycles:
+    [tenant]
+    activities = ["todoist"]
+    minutes = 1
+
+The metrics of every cycle are labeled with the tenant and the activity.
+
+Usage:
+    python src/tenants.py TENANTS_FOLDER [--workers 8] [--minutes 1] [--metrics-port 0]
+"""
+
+import argparse
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from _logger import logger_setup
+from metrics import REGISTRY, MetricsServer, write_cycle_snapshot
+from tracing import TRACER
+
+
+def create_syncer(activity, config):
+    """Create the syncer of an activity. The syncers are imported when needed, the
+    calendar one needs Outlook.
+
+    Args:
+        activity (str): "todoist" or "calendar"
+        config (Config): tenant config
+
+    Returns:
+        TodoistSync | CalendarSync: syncer
+    """
+
+    if activity == 'todoist':
+        from todoist_sync import TodoistSync
+        return TodoistSync(config)
+
+    if activity == 'calendar':
+        from outlook_calendar_sync import CalendarSync
+        return CalendarSync(config, threaded=True)
+
+    raise ValueError(f"Unknown activity: {activity}")
+
+
+class TenantJob:
+    """Periodic sync cycle of an activity of a tenant
+
+    Attributes:
+        tenant (str): tenant name
+        activity (str): activity name
+        syncer (TodoistSync | CalendarSync): syncer
+        interval (float): seconds between the start of two cycles
+        metrics_snapshot (dict): metrics at the end of the previous cycle
+        last_sync (datetime.datetime): end of the last successful cycle
+        failures (int): consecutive failed cycles
+    """
+
+    def __init__(self, tenant, activity, syncer, interval):
+        self.tenant = tenant
+        self.activity = activity
+        self.syncer = syncer
+        self.interval = interval
+        self.metrics_snapshot = {}
+        self.last_sync = None
+        self.failures = 0
+
+
+    @property
+    def labels(self):
+        return {'tenant': self.tenant, 'activity': self.activity}
+
+
+class TenantRunner:
+    """Scheduler of the cycles of many tenants on a bounded pool of workers
+
+    Attributes:
+        folder (str): tenants folder
+        workers (int): maximum number of cycles run at the same time
+        interval (float): default seconds between the start of two cycles of a job, [tenant] minutes in the tenant config
+        jobs (list): jobs of all the tenants
+        queue (list): heap of (due time, sequence, job) of the jobs waiting for their turn
+    """
+
+    def __init__(self, folder, workers=8, minutes=1):
+        self.logger = logging.getLogger(__name__)
+        self.folder = folder
+        self.workers = workers
+        self.interval = minutes * 60
+        self.jobs = []
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.slots = threading.Semaphore(workers)
+        self.stopping = threading.Event()
+        self.executor = None
+
+
+    def load(self):
+        """Load the tenants of the folder and create their jobs. A tenant that can't be
+        loaded is logged and skipped.
+
+        Returns:
+            list: jobs
+        """
+
+        for name in sorted(os.listdir(self.folder)):
+            tenant_folder = os.path.join(self.folder, name)
+            if not os.path.isfile(os.path.join(tenant_folder, 'config.toml')):
+                continue
+
+            try:
+                config = Config(data_folder=tenant_folder, logs_folder=os.path.join(tenant_folder, 'logs'))
+
+                tenant_config = config.config.get('tenant', {})
+                interval = tenant_config.get('minutes', self.interval / 60) * 60
+
+                for activity in tenant_config.get('activities', ['todoist']):
+                    # the API calls of the constructors are recorded for the tenant too
+                    REGISTRY.set_context({'tenant': name, 'activity': activity})
+                    self.add(TenantJob(name, activity, create_syncer(activity, config), interval))
+
+            except Exception as e:
+                self.logger.exception(f"Skipping tenant {name}: {e}")
+
+            finally:
+                REGISTRY.set_context({})
+
+        self.logger.info(f"Loaded {len(self.jobs)} jobs of {len({j.tenant for j in self.jobs})} tenants")
+        return self.jobs
+
+
+    def add(self, job, due=None):
+        """Add a job, due now or at the given monotonic time
+
+        Args:
+            job (TenantJob): job
+            due (float, optional): monotonic time the job is due. Defaults to None.
+        """
+
+        if job not in self.jobs:
+            self.jobs.append(job)
+
+        self.push(job, time.monotonic() if due is None else due)
+
+
+    def push(self, job, due):
+        with self.condition:
+            heapq.heappush(self.queue, (due, next(self.sequence), job))
+            self.condition.notify()
+
+
+    def next_job(self):
+        """Wait for the first job in line to be due and take it
+
+        Returns:
+            TenantJob: job, None if the runner is stopping
+        """
+
+        with self.condition:
+            while not self.stopping.is_set():
+                wait = None
+
+                if self.queue:
+                    wait = self.queue[0][0] - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self.queue)[2]
+
+                self.condition.wait(wait)
+
+        return None
+
+
+    def run(self):
+        """Run the jobs until `stop` is called"""
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='tenant')
+
+        try:
+            while True:
+                # a job is taken only when a worker is free, so the jobs wait in the fair queue
+                self.slots.acquire()
+                job = self.next_job()
+
+                if job is None:
+                    break
+
+                self.executor.submit(self.run_cycle, job)
+
+        finally:
+            # the running cycles are completed
+            self.stop()
+            self.executor.shutdown(wait=True)
+
+
+    def stop(self):
+        """Stop taking jobs, the running cycles are completed"""
+
+        self.stopping.set()
+        with self.condition:
+            self.condition.notify_all()
+
+
+    def run_cycle(self, job):
+        """Run a sync cycle of a job and put it back in line for the next one
+
+        Args:
+            job (TenantJob): job
+        """
+
+        start = time.monotonic()
+        config = job.syncer.config
+        REGISTRY.set_context(job.labels)
+
+        try:
+            tracing_config = config.config.get('tracing', {})
+            with TRACER.trace(job.activity, config.logs_folder, keep=tracing_config.get('keep', 50), tenant=job.tenant):
+                job.last_sync = job.syncer.sync()
+
+            job.failures = 0
+
+        except Exception as e:
+            job.failures += 1
+            REGISTRY.inc('sync_failures_total')
+            self.logger.exception(f"Sync of {job.tenant}/{job.activity} failed ({job.failures} in a row): {e}")
+
+        finally:
+            elapsed = time.monotonic() - start
+            REGISTRY.observe('sync_cycle_seconds', elapsed)
+            job.metrics_snapshot = write_cycle_snapshot(config.logs_folder, job.activity, job.metrics_snapshot, {'tenant': job.tenant})
+            REGISTRY.set_context({})
+
+            # the next cycle is due an interval after the start of this one, or now if it took longer
+            self.push(job, start + max(job.interval, elapsed))
+            self.slots.release()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", help="folder with a subfolder for every tenant, containing its config.toml")
+    parser.add_argument("--workers", type=int, default=8, help="maximum number of cycles run at the same time")
+    parser.add_argument("--minutes", type=float, default=1, help="minutes between two cycles of a tenant")
+    parser.add_argument("--metrics-port", type=int, default=0, help="port of the metrics endpoint, 0 to disable it")
+    args = parser.parse_args()
+
+    logger_setup(os.path.join(args.folder, 'logs'), stdout_level='info', keep_for_days=7)
+
+    if args.metrics_port:
+        MetricsServer(args.metrics_port).start()
+
+    runner = TenantRunner(args.folder, args.workers, args.minutes)
+    runner.load()
+
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        pass
@@ -3,82 +3,248 @@ import uuid
 import requests
 import logging
 from simplejson.errors import JSONDecodeError
+from json_stream import iter_array
+from metrics import REGISTRY
+from records import Task
 
 # [ ] unire parti comuni add e update
 
+# commands sent in a single request of the sync API
+COMMANDS_LIMIT = 100
+
+
+class TodoistError(Exception):
+    """Error response of the Todoist API, with its HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def command_error(status):
+    """Get the error of a command from its sync status
+
+    Args:
+        status (str | dict): status of the command in the sync response
+
+    Returns:
+        str: error message, None if the command succeeded
+    """
+
+    if str(status) == 'ok':
+        return None
+
+    return status.get('error', str(status)) if isinstance(status, dict) else str(status)
+
 
 class Todoist:
     def __init__(self, config):
         self.config = config
         self.key = config['key']
         self.logger = logging.getLogger(__name__)
-        self.endpoint = 'https://api.todoist.com/sync/v9'
+        self.endpoint = config.get('endpoint', 'https://api.todoist.com/sync/v9')
         self.sync_token = None
+        self.projects = None
+        self.labels = None
     
 
     def request(self, method, endpoint, data=None):
         url = self.endpoint + endpoint
-        self.logger.debug(f'Request: {method} {url} {data}')
+        self.logger.debug('Request: %s %s %s', method, url, data)
         headers = {'Authorization': f'Bearer {self.key}', 'Content-Type': 'application/json'}
-        if method == 'GET':
-            response = requests.request(method, url, headers=headers, params=data)
-        else:
-            response = requests.request(method, url, headers=headers, json=data)
+
+        with REGISTRY.time_call('todoist', f'{method} {endpoint}') as call:
+            if method == 'GET':
+                response = requests.request(method, url, headers=headers, params=data)
+            else:
+                response = requests.request(method, url, headers=headers, json=data)
+
+            call['status'] = response.status_code
+            call['size'] = len(response.content)
 
         try:
             response_data = response.json()
         except JSONDecodeError as e:
             self.logger.error(f'Error: {response.content}')
+            if response.status_code < 200 or response.status_code > 299:
+                raise TodoistError(response.status_code, response.text) from e
             raise e
 
         if response.status_code < 200 or response.status_code > 299:
             # self.logger.error(f'Error: {response_data}')
-            raise Exception(response_data["error"])
+            raise TodoistError(response.status_code, response_data["error"])
         
         return response_data
 
 
+    def request_stream(self, method, endpoint, key, fields, data=None):
+        """Make a request and decode the response while it arrives.
+
+        Args:
+            method (str): HTTP method
+            endpoint (str): API endpoint
+            key (str): name of the array of the response to stream
+            fields (dict): dict where the other members of the response are stored
+            data (dict, optional): request parameters. Defaults to None.
+
+        Yields:
+            dict: entries of the streamed array
+        """
+
+        url = self.endpoint + endpoint
+        self.logger.debug('Request: %s %s %s (streamed)', method, url, data)
+        headers = {'Authorization': f'Bearer {self.key}', 'Content-Type': 'application/json'}
+        name = f'{method} {endpoint}'
+
+        # the call is timed until the headers are received, the body is read by the caller
+        with REGISTRY.time_call('todoist', name) as call:
+            if method == 'GET':
+                response = requests.request(method, url, headers=headers, params=data, stream=True)
+            else:
+                response = requests.request(method, url, headers=headers, json=data, stream=True)
+
+            call['status'] = response.status_code
+
+        with response:
+            if response.status_code < 200 or response.status_code > 299:
+                try:
+                    response_data = response.json()
+                except JSONDecodeError as e:
+                    self.logger.error(f'Error: {response.content}')
+                    raise TodoistError(response.status_code, response.text) from e
+
+                raise TodoistError(response.status_code, response_data["error"])
+
+            yield from iter_array(self.count_bytes(response.iter_content(chunk_size=65536), name), key, fields)
+
+
+    def count_bytes(self, chunks, name):
+        """Record the bytes of a streamed response in the metrics
+
+        Args:
+            chunks (iterator): chunks of the response
+            name (str): endpoint name
+
+        Yields:
+            bytes: chunks
+        """
+
+        for chunk in chunks:
+            REGISTRY.inc('api_received_bytes_total', {'service': 'todoist', 'endpoint': name}, len(chunk))
+            yield chunk
+
+
     def sync_read_items(self, sync_token=None):
         if sync_token == None:
             sync_token = '*'
 
-        resource_types = '["items"]'
-        data = self.request('GET', '/sync', data={'sync_token': sync_token, 'resource_types': resource_types})
-        self.sync_token = data['sync_token']
-
-        projects = self.update_projects()
-
-        for item in data['items']:
-            due_date = None
-            recurrence = None
-
-            if item['due'] is not None:
-                if not item['is_deleted']:
-                    due_date = datetime.datetime.strptime(item['due']['date'], '%Y-%m-%d').date()
-
-                if item['due']['is_recurring']:
-                    recurrence = item['due']['string']
-                
-            processed_item = {
-                'id': item['id'],
-                'content': item['content'],
-                'description': item['description'],
-                'priority': item['priority'],
-                'due': due_date,
-                'project': projects.get(item['project_id'], None),
-                'labels': item['labels'],
-                'checked': item['checked'],
-                'is_deleted': item['is_deleted'],
-                'recurrence': recurrence,
-                # 'section': next((section['name'] for section in sections if section['id'] == item['section_id']), None),
-            }
-
-            yield processed_item
+        # an incremental sync only returns the projects and labels changed since the token,
+        # so the full lists are downloaded once per process. This way the items streamed
+        # before the projects in the response can be converted too
+        if self.projects is None:
+            self.update_projects()
+
+        resource_types = '["items", "projects", "labels"]'
+        data = {'sync_token': sync_token, 'resource_types': resource_types}
+
+        # the response is decoded while it arrives, so a full sync doesn't need to hold
+        # the whole items list in memory
+        fields = {}
+        resources_applied = False
+        deferred = []
+
+        for item in self.request_stream('GET', '/sync', 'items', fields, data=data):
+            # projects and labels received before the first item are applied immediately
+            if not resources_applied and 'projects' in fields:
+                self.apply_resources(fields)
+                resources_applied = True
+
+            # the item can belong to a project that's in the rest of the response
+            if item['project_id'] not in self.projects:
+                deferred.append(item)
+                continue
+
+            yield self.process_item(item)
+
+        self.sync_token = fields['sync_token']
+
+        if not resources_applied:
+            self.apply_resources(fields)
+
+        for item in deferred:
+            yield self.process_item(item)
+
+
+    def process_item(self, item):
+        """Convert a Todoist item to a task
+
+        Args:
+            item (dict): Todoist item
+
+        Returns:
+            Task: task data
+        """
+
+        due_date = None
+        recurrence = None
+        last_modified = None
+
+        if item.get('updated_at') is not None:
+            last_modified = datetime.datetime.fromisoformat(item['updated_at'].replace('Z', '+00:00'))
+
+        if item['due'] is not None:
+            if not item['is_deleted']:
+                due_date = datetime.datetime.strptime(item['due']['date'], '%Y-%m-%d').date()
+
+            if item['due']['is_recurring']:
+                recurrence = item['due']['string']
+            
+        return Task(
+            id=item['id'],
+            content=item['content'],
+            description=item['description'],
+            priority=item['priority'],
+            due=due_date,
+            project=self.projects.get(item['project_id'], None),
+            labels=item['labels'],
+            checked=item['checked'],
+            is_deleted=item['is_deleted'],
+            recurrence=recurrence,
+            last_modified=last_modified,
+            # section=next((section['name'] for section in sections if section['id'] == item['section_id']), None),
+        )
     
 
     def update_projects(self):
-        projects = self.request('GET', '/sync', data={'resource_types': '["projects"]'})['projects']
-        self.projects = {p['id']: p['name'] for p in projects}
+        data = self.request('GET', '/sync', data={'sync_token': '*', 'resource_types': '["projects", "labels"]'})
+        return self.apply_resources(data)
+
+
+    def apply_resources(self, data):
+        """Apply the projects and labels of a sync response to the in-memory maps
+
+        Args:
+            data (dict): sync response
+
+        Returns:
+            dict: {project_id: project_name}
+        """
+
+        if data.get('full_sync') or self.projects is None:
+            self.projects = {}
+            self.labels = {}
+
+        for p in data.get('projects', []):
+            if p['is_deleted']:
+                self.projects.pop(p['id'], None)
+            else:
+                self.projects[p['id']] = p['name']
+
+        for l in data.get('labels', []):
+            if l['is_deleted']:
+                self.labels.pop(l['id'], None)
+            else:
+                self.labels[l['id']] = l['name']
 
         return self.projects
     
@@ -135,55 +301,155 @@ class Todoist:
         return task_id
     
 
-    def update_task(self, task):
-        data = {
-            'id': task['id'],
-            'content': task['content'],
-            'description': task['description'],
-            'priority': task['priority'],
-            'labels': task['labels'],
-            'checked': task['checked']
-        }
+    def update_task(self, task, fields=None):
+        """Update a task
 
-        if task['due'] is not None:
-            data['due'] = {
-                'date': task['due'].strftime('%Y-%m-%d')
-            }
-        else:
-            data['due'] = None
-            
-        if task['recurrence'] is not None:
-            data['due'] = {
-                'string': task['recurrence'],
-                'lang': 'en',
-                'is_recurring': True
-            }
-        else:
-            data['due'] = {
-                'is_recurring': False
-            }
-            
+        Args:
+            task (dict): task data
+            fields (list, optional): fields to write, None for all of them. Defaults to None.
+        """
+
+        command = self.update_command(task, fields)
+        error = command_error(self.run_commands([command])[command['uuid']])
+
+        if error is not None:
+            raise Exception(error)
+
+
+    def update_command(self, task, fields=None, command_id=None):
+        """Build the command updating a task
+
+        Args:
+            task (dict): task data
+            fields (list, optional): fields to write, None for all of them. Defaults to None.
+            command_id (str, optional): uuid of the command, a new one if None. A command sent
+                again with the same uuid is applied only once. Defaults to None.
+
+        Returns:
+            dict: item_update command
+        """
+
+        if fields is None:
+            fields = ('content', 'description', 'priority', 'labels', 'checked', 'due', 'project')
+
+        data = {'id': task['id']}
+
+        for field in ('content', 'description', 'priority', 'labels', 'checked'):
+            if field in fields:
+                data[field] = task[field]
+
+        if 'due' in fields or 'recurrence' in fields:
+            if task['recurrence'] is not None:
+                data['due'] = {
+                    'string': task['recurrence'],
+                    'lang': 'en',
+                    'is_recurring': True
+                }
+            elif task['due'] is not None:
+                data['due'] = {
+                    'date': task['due'].strftime('%Y-%m-%d'),
+                    'is_recurring': False
+                }
+            else:
+                data['due'] = None
 
+        if 'project' in fields:
             project = self.project_id_from_name(task['project'])
             if project is not None:
                 data['project_id'] = project
 
-        uuid_gen = str(uuid.uuid4())
-
-        commands = [{
+        return {
             'type': 'item_update',
-            'uuid': uuid_gen,
+            'uuid': command_id or str(uuid.uuid4()),
             'args': data
-        }]
+        }
+    
 
-        response = self.request('POST', '/sync', data={'sync_token': self.sync_token, 'resource_types': [], 'commands': commands})
-        status = response['sync_status'][uuid_gen]
+    def delete_task(self, task_id):
+        """Delete a task
+
+        Args:
+            task_id (str): task id
+
+        Returns:
+            bool: False if the task doesn't exist
+        """
+
+        command = self.delete_command(task_id)
+        error = command_error(self.run_commands([command])[command['uuid']])
+
+        if error == 'Item not found':
+            return False
+
+        if error is not None:
+            raise Exception(error)
+
+        return True
+
+
+    def delete_command(self, task_id, command_id=None):
+        """Build the command deleting a task
+
+        Args:
+            task_id (str): task id
+            command_id (str, optional): uuid of the command, see `update_command`. Defaults to None.
+
+        Returns:
+            dict: item_delete command
+        """
+
+        return {
+            'type': 'item_delete',
+            'uuid': command_id or str(uuid.uuid4()),
+            'args': {'id': task_id}
+        }
+
+
+    def run_commands(self, commands):
+        """Send commands to the sync API, up to COMMANDS_LIMIT per request
+
+        Args:
+            commands (list): commands
+
+        Returns:
+            dict: {command uuid: status}, see `command_error`
+        """
+
+        statuses = {}
+
+        for start in range(0, len(commands), COMMANDS_LIMIT):
+            batch = commands[start:start + COMMANDS_LIMIT]
+            response = self.request('POST', '/sync', data={'sync_token': self.sync_token, 'resource_types': [], 'commands': batch})
+            statuses.update(response['sync_status'])
+            self.sync_token = response['sync_token']
+
+        return statuses
+
+
+    def get_task(self, task_id):
+        """Get a task by id
+
+        Args:
+            task_id (str): task id
+
+        Returns:
+            Task: task data, None if the task doesn't exist or is deleted
+        """
+
+        if self.projects is None:
+            self.update_projects()
+
+        try:
+            data = self.request('GET', '/items/get', data={'item_id': task_id})
+
+        except Exception as e:
+            if e.args[0] == 'Item not found':
+                return None
+
+            raise e
+
+        return self.process_item(data['item'])
 
-        if str(status) != 'ok':
-            raise Exception(response["error"])
-        
-        self.sync_token = response['sync_token']
-    
 
     def check_task_exists(self, task_id):
         if task_id is None:
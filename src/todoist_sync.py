@@ -1,6 +1,18 @@
 import datetime
-from todoist import Todoist
-from notion import Notion
+from todoist import Todoist, command_error
+from notion import Notion, TASK_READ_PROPERTIES
+from notion_change_feed import NotionChangeFeed, parse_notion_time
+from fingerprint import TASK_FIELDS, fingerprint, properties_fingerprint, task_fields, task_fingerprint
+from merge import POLICIES, merge_task
+from records import Task
+from reconcile import IdBuckets, missing_from
+from write_queue import PendingWrite, WriteQueue
+from outbox import Outbox
+from collections import Counter
+from functools import partial
+from backfill import Backfill
+from tracing import TRACER
+from metrics import REGISTRY
 import logging
 
 # [ ] sincronizzare colore label/tags ?
@@ -13,6 +25,9 @@ import logging
 # [ ] eventi ricorrenti sono buggati, a volte sposta il giorno su todoist (capire perché)
 
 class TodoistSync:
+    # directions of the syncs of single tasks
+    ITEM_DIRECTIONS = ('todoist_to_notion', 'notion_to_todoist')
+
     def __init__(self, config):
         self.config = config
         self.config_data = self.config.config
@@ -21,10 +36,26 @@ class TodoistSync:
         self.logger = logging.getLogger(__name__)
         
         self.activity = 'todoist'
+        self.progress_callback = None
         self.last_sync, self.sync_token = self.config.load_last_sync(self.activity, sync_token=True)
 
         self.todoist = Todoist(self.config_data['todoist'])
         self.notion = Notion(self.config_data['notion'], self.config.timezone_str)
+        self.notion_feed = NotionChangeFeed(self.notion, self.config, 'notion_tasks_feed', since=self.last_sync)
+
+        # side kept when a field is changed on both Todoist and Notion
+        merge_config = self.config_data.get('merge', {})
+        self.merge_policy = merge_config.get('policy', 'todoist')
+        self.merge_fields = merge_config.get('fields', {})
+
+        for policy in [self.merge_policy, *self.merge_fields.values()]:
+            if policy not in POLICIES:
+                raise ValueError(f"Unknown merge policy: {policy}")
+
+        # writes of the cycle, coalesced, stored in the outbox and batched. Outside of the cycles they're applied right away
+        self.writers = {'notion': self.write_notion, 'todoist': self.write_todoist}
+        self.outbox = Outbox(self.config, self.activity, self.writers, self.config_data.get('outbox', {}).get('max_attempts', 5))
+        self.writes = None
 
         if self.last_sync is not None:
             self.logger.info(f"Last sync: {self.last_sync.strftime('%d/%m/%Y %H:%M:%S')}")
@@ -33,124 +64,774 @@ class TodoistSync:
 
     
     def sync(self):
-        created = 0
-        updated = 0
-        deleted = 0
+        # First sync of the account: sync everything in bulk
+        if self.sync_token is None and self.last_sync is None:
+            return self.backfill()
+
+        queue_config = self.config_data.get('write_queue', {})
+        self.writes = WriteQueue(self.outbox, queue_config.get('seconds', 5), queue_config.get('max_pending', 100))
+
+        try:
+            return self.sync_changes()
+        finally:
+            self.writes = None
+
+
+    def sync_changes(self):
+        """Sync the changes of both sides since the last sync
+
+        Returns:
+            datetime.datetime: last sync
+        """
 
         # Used for Notion to Todoist sync
         before_last_sync = datetime.datetime.now(tz=self.config.timezone)
 
         # Update projects list
-        self.notion.update_projects()
+        with TRACER.span('projects'):
+            self.notion.update_projects()
 
-        just_modified = []
+        # Items completed by an interrupted sync are skipped
+        done = self.config.begin_sync(self.activity)
+        if done:
+            self.logger.info(f"Resuming interrupted sync: {len(done)} items already synced")
 
-        # Sync Todoist to Notion
-        for task in self.todoist.sync_read_items(self.sync_token):
-            task_content = task['content']
+        # The writes left by the previous cycles are applied before reading the changes they may overwrite
+        with TRACER.span('replay') as phase:
+            replayed = self.outbox.replay(retry=True)
+            if phase is not None:
+                phase.set(writes=replayed)
 
-            # Check if event exists in notion
-            notion_task_id = self.notion.check_task_exists(task['id'])
+        # Read the changes of both sides: the tasks changed on both are merged
+        with TRACER.span('read_changes') as phase:
+            todoist_changes = {}
+            for task in TRACER.iterate(self.todoist.sync_read_items(self.sync_token), 'todoist_read'):
+                # changes written by us in the previous cycles
+                if not task['is_deleted'] and self.config.is_echo('todoist', task['id'], task_fingerprint(task)):
+                    REGISTRY.inc('sync_echoes_total', {'direction': 'todoist_to_notion'})
+                    continue
 
-            # Delete tasks
-            if task['is_deleted']:
-                self.logger.info(f"Deleting task: {task_content}")
-                if notion_task_id is not None:
-                    self.notion.delete_task(notion_task_id)
-                    deleted += 1
-                else:
-                    self.logger.info(f"Task does not exist in Notion, skipping")
-            else:
-                # Update task
-                if notion_task_id is not None:
-                    self.logger.info(f"Updating task: {task_content}")
-                    self.notion.update_task(notion_task_id, task)
-                    just_modified.append(task['id'])
-                    updated += 1
-
-                # Create task
+                todoist_changes[task['id']] = task
+
+            notion_changes = {}
+            new_tasks = []
+            for page in TRACER.iterate(self.notion_feed.changes(before_last_sync), 'notion_change_feed'):
+                task = self.notion.parse_task(page)
+
+                # Notion non restituisce task cancellati
+                if task['is_deleted']:
+                    continue
+
+                if task['id'] is None:
+                    new_tasks.append(task)
+                elif self.is_notion_echo(task):
+                    # pages written by the Todoist to Notion sync, in this cycle or in the previous ones
+                    REGISTRY.inc('sync_echoes_total', {'direction': 'notion_to_todoist'})
                 else:
-                    self.logger.info(f"Creating task: {task_content}")
-                    self.notion.add_task(task)
-                    just_modified.append(task['id'])
-                    created += 1
+                    notion_changes[task['id']] = task
+
+            if phase is not None:
+                phase.set(todoist=len(todoist_changes), notion=len(notion_changes) + len(new_tasks))
+
+        # The pages of the changed Todoist tasks are found with a few queries
+        with TRACER.span('resolve_ids'):
+            self.notion.resolve_ids(self.notion.tasks_db, todoist_changes)
+
+        counts = {direction: Counter() for direction in self.ITEM_DIRECTIONS}
+
+        with TRACER.span('merge') as phase:
+            task_ids = list(todoist_changes) + [task_id for task_id in notion_changes if task_id not in todoist_changes]
+
+            for task_id in task_ids:
+                todoist_task = todoist_changes.get(task_id)
+                notion_task = notion_changes.get(task_id)
+
+                item_key = f"task:{task_id}:{fingerprint([todoist_task, notion_task])}"
+                if item_key in done:
+                    continue
+
+                with TRACER.span('sync_task', id=task_id):
+                    actions = self.sync_task(task_id, todoist_task, notion_task, partial(self.config.mark_done, self.activity, item_key))
+                    for direction, action in actions.items():
+                        counts[direction][action] += 1
+
+                self.writes.tick()
+
+            # Pages without an id have been created in Notion
+            for task in new_tasks:
+                item_key = f"notion:{task['notion_id']}:{fingerprint(task)}"
+                if item_key in done:
+                    continue
+
+                with TRACER.span('todoist_write', id=task['notion_id']):
+                    self.logger.info(f"Creating task: {task['content']}")
+                    self.add_to_todoist(task)
+                    self.after_writes([task['id']], partial(self.record_created, task, item_key))
+
+                counts['notion_to_todoist']['created'] += 1
+                REGISTRY.observe_lag(self.activity, 'notion_to_todoist', parse_notion_time(task['last_edited_time']))
+                self.writes.tick()
+
+            # the pages created here must exist before the reconciliation scan
+            self.flush_writes()
+
+            if phase is not None:
+                phase.set(**{f'{direction}_{action}': n for direction, actions in counts.items() for action, n in actions.items()})
+
+        # The pages deleted in Notion aren't in the change feed: they're found by a periodic reconciliation
+        states = {}
+        if self.reconciliation_due():
+            counts['notion_to_todoist']['deleted'] += self.reconcile_deletions()
+            self.flush_writes()
+            states['todoist_reconcile'] = {'last_run': datetime.datetime.now(tz=self.config.timezone).isoformat()}
+
+        self.log_results("Notion tasks sync successful: ", counts['todoist_to_notion'])
+        self.log_results("Todoist tasks sync successful: ", counts['notion_to_todoist'])
+
+        # Save last sync
+        with TRACER.span('checkpoint'):
+            states.update(self.notion_feed.commit())
+            self.config.prune_writes(self.config_data.get('receipts', {}).get('keep_days', 30))
+            self.sync_token = self.todoist.sync_token
+            self.last_sync = self.config.update_last_sync(self.activity, self.sync_token, states)
+
+        # the writes are stored, the next cycles replay them
+        for destination, n in self.outbox.pending().items():
+            self.logger.warning(f"{n} writes to {destination} not applied yet, replayed by the next cycle")
+
+        return self.last_sync
+
+
+    def flush_writes(self):
+        """Store the pending writes of the cycle in the outbox and apply them"""
 
-        success_message = f"Notion tasks sync successful: "
-        if created == 0 and updated == 0 and deleted == 0:
-            self.logger.info(success_message + "nothing to sync")
+        with TRACER.span('flush') as span:
+            written = self.writes.flush()
+            if span is not None:
+                span.set(writes=written)
 
+
+    def write(self, destination, entity_id, action, data=None, fields=None, target=None):
+        """Write a task: queued during a cycle, applied right away otherwise.
+        See `WriteQueue.put` for the arguments, data is the task of the other side.
+        """
+
+        modified = None
+        if data is not None:
+            modified = self.modified_time(destination, data)
+            data = self.write_data(destination, data, fields)
+
+        if self.writes is not None:
+            self.writes.put(destination, entity_id, action, data, fields, target, modified)
         else:
-            if created > 0:
-                success_message += f"{created} created, "
-            if updated > 0:
-                success_message += f"{updated} updated, "
-            if deleted > 0:
-                success_message += f"{deleted} deleted, "
+            self.writers[destination]([PendingWrite(destination, entity_id, action, data, fields, target)])
 
-            self.logger.info(success_message[:-2])
 
-        
-        # Sync Notion to Todoist
-        created = 0
-        updated = 0
-        deleted = 0
-
-        for task in self.notion.get_tasks(self.last_sync, before_last_sync):
-            task_content = task['content']
-
-            # Check if event exists in notion
-            task_exists = self.todoist.check_task_exists(task['id'])
-
-            # Delete tasks
-            if task['is_deleted']:
-                pass    # Notion non restituisce task cancellati
-                # self.logger.info(f"Deleting task: {task_content}")
-                # if todoist_task_id is not None:
-                #     self.todoist.delete_task(todoist_task_id)
-                #     deleted += 1
-                # else:
-                #     self.logger.info(f"Task does not exist in Todoist, skipping")
+    def modified_time(self, destination, task):
+        """Get the modification time of a task on the side it's read from
+
+        Args:
+            destination (str): side written, "todoist" or "notion"
+            task (dict): task of the other side
+
+        Returns:
+            datetime.datetime: modification time, None if unknown
+        """
+
+        if destination == 'notion':
+            return task.get('last_modified')
+
+        edited = task.get('last_edited_time')
+        return parse_notion_time(edited) if edited is not None else None
+
+
+    def applied(self, write):
+        """Mark a write as applied, once confirmed by its destination, and record the
+        propagation lag of the change it carries
+
+        Args:
+            write (PendingWrite): write applied
+        """
+
+        write.done()
+        direction = 'todoist_to_notion' if write.destination == 'notion' else 'notion_to_todoist'
+        REGISTRY.observe_lag(self.activity, direction, write.modified)
+
+
+    def write_data(self, destination, task, fields=None):
+        """Get the values of a task written to a destination, JSON serializable to be stored
+        in the outbox: the id and the fields written, all of them for Notion, which converts
+        the whole task
+
+        Args:
+            destination (str): "todoist" or "notion"
+            task (dict): task data
+            fields (list, optional): fields written, None for all of them. Defaults to None.
+
+        Returns:
+            dict: {field: value}, the due date in ISO format
+        """
+
+        names = list(TASK_FIELDS) if fields is None or destination == 'notion' else [f for f in fields if f != 'id']
+
+        # the due date and the recurrence are written together
+        if 'due' in names or 'recurrence' in names:
+            names += [f for f in ('due', 'recurrence') if f not in names]
+        data = {'id': task['id'], **{field: task[field] for field in names}}
+
+        if data.get('due') is not None:
+            data['due'] = data['due'].isoformat()
+        if 'labels' in data:
+            data['labels'] = list(data['labels'])
+
+        return data
+
+
+    def load_task(self, data):
+        """Get the task data of a write, see `write_data`
+
+        Args:
+            data (Mapping): values written
+
+        Returns:
+            dict: task data
+        """
+
+        task = dict(data)
+
+        due = task.get('due')
+        if isinstance(due, str):
+            task['due'] = datetime.datetime.fromisoformat(due) if 'T' in due else datetime.date.fromisoformat(due)
+
+        return task
+
+
+    def after_writes(self, task_ids, callback):
+        """Call a function when the writes of some tasks are stored in the outbox, right away outside of a cycle
+
+        Args:
+            task_ids (list): task ids
+            callback (callable): function without arguments
+        """
+
+        if self.writes is not None:
+            self.writes.after(task_ids, callback)
+        else:
+            callback()
+
+
+    def is_notion_echo(self, task):
+        """Check if a task read from Notion is the echo of our writes to its page. The
+        properties are compared first, then the edit time of the page with the one returned
+        by the last write: the body, which takes another call, is only read when the page was
+        edited after it. Notion rounds the edit times to the minute, so a change of the body
+        alone in the minute of the write is taken for the echo.
+
+        Args:
+            task (NotionTask): task parsed from Notion, with an id
+
+        Returns:
+            bool: True if the task is the one we wrote
+        """
+
+        receipt = self.config.load_write('notion', task['id'])
+        if receipt is None:
+            return False
+
+        if receipt['properties_hash'] is not None:
+            if receipt['properties_hash'] != properties_fingerprint(task):
+                return False
+
+            if receipt['edited_at'] is not None and parse_notion_time(task['last_edited_time']) <= parse_notion_time(receipt['edited_at']):
+                return True
+
+        return receipt['hash'] == task_fingerprint(task)
+
+
+    def write_notion(self, writes):
+        """Apply writes of tasks to Notion, a call for each one. A replayed create may have
+        been applied: its page is looked up by the task id first.
+
+        Args:
+            writes (list): `PendingWrite`
+        """
+
+        for write in writes:
+            if write.action == 'delete':
+                self.notion.delete_task(write.target)
+                self.applied(write)
+                continue
+
+            task = self.load_task(write.data)
+            target = write.target
+
+            if write.action == 'create' and write.replayed:
+                target = self.notion.resolve_ids(self.notion.tasks_db, [task['id']])[task['id']]
+
+            if target is None:
+                page = self.notion.add_task(task)
+            else:
+                page = self.notion.update_task(target, task, list(TASK_FIELDS) if write.fields is None else write.fields)
+
+            self.applied(write)
+
+            # the page read back with this edit time is the echo of the write, see `is_notion_echo`
+            if page is not None:
+                self.config.record_edit_time('notion', write.entity_id, page['last_edited_time'])
+
+
+    def write_todoist(self, writes):
+        """Apply updates and deletes of tasks to Todoist, sent together as commands of the
+        sync API. The tasks are created with `add_to_todoist`: their new id is needed right away.
+
+        Args:
+            writes (list): `PendingWrite`
+        """
+
+        commands = []
+        for write in writes:
+            # the key of a stored write is the uuid of its command, so it's applied once
+            if write.action == 'update':
+                commands.append(self.todoist.update_command(self.load_task(write.data), write.fields, write.key))
+            elif write.action == 'delete':
+                commands.append(self.todoist.delete_command(write.entity_id, write.key))
             else:
-                if task['id'] in just_modified:
-                    self.logger.info(f"Skipping task: {task_content} (just modified)")
+                raise ValueError(f"Unsupported Todoist write: {write.action}")
+
+        statuses = self.todoist.run_commands(commands)
+
+        errors = []
+        for write, command in zip(writes, commands):
+            error = command_error(statuses[command['uuid']])
+
+            # a task already deleted
+            if error is None or (write.action == 'delete' and error == 'Item not found'):
+                self.applied(write)
+            else:
+                errors.append(f"{write.action} {write.entity_id}: {error}")
+
+        if errors:
+            raise Exception(f"Todoist writes failed: {'; '.join(errors)}")
+
+
+    def log_results(self, message, counts):
+        """Log the writes of a direction
+
+        Args:
+            message (str): start of the message
+            counts (collections.Counter): {action: count}
+        """
+
+        if not counts:
+            self.logger.info(message + "nothing to sync")
+            return
+
+        message += ', '.join(f"{counts[action]} {action}" for action in ('created', 'updated', 'deleted') if counts[action])
+        self.logger.info(message)
+
+
+    def reconciliation_due(self):
+        """Check if the deletions should be reconciled, every [reconcile] hours
+
+        Returns:
+            bool: True if the reconciliation is due
+        """
+
+        hours = self.config_data.get('reconcile', {}).get('hours', 24)
+        if not hours:
+            return False
+
+        state = self.config.load_state('todoist_reconcile')
+        if state is None:
+            return True
+
+        last_run = datetime.datetime.fromisoformat(state['last_run'])
+        return datetime.datetime.now(tz=self.config.timezone) - last_run >= datetime.timedelta(hours=hours)
+
+
+    def reconcile_deletions(self):
+        """Find the tasks deleted in Notion and delete them in Todoist
+
+        The ids of the tasks synced on both sides (the ones with a base) are compared with a
+        fresh scan of the Id property of the Notion pages, bucket by bucket: the digests of the
+        buckets of the synced ids are kept up to date with the bases, so only the synced ids of
+        the buckets whose digests differ are read, and every task missing from Notion is checked
+        again (in batches) before being deleted. The work after the scan grows with the number
+        of deletions rather than with the size of the database. The tasks without a base,
+        synced before the bases were recorded, are skipped.
+
+        Returns:
+            int: number of deleted tasks
+        """
+
+        reconcile_config = self.config_data.get('reconcile', {})
+        max_deletions = reconcile_config.get('max_deletions', 50)
+
+        with TRACER.span('reconcile') as phase:
+            pages = TRACER.iterate(self.notion.query_tasks(properties=['Id']), 'notion_scan')
+            scan = IdBuckets(task_id for task_id in map(self.notion.get_id_property, pages) if task_id is not None)
+
+            missing, buckets = missing_from(self.config.synced_digests(), scan, self.config.synced_entities)
+
+            # the tasks with writes not yet applied, e.g. pages not yet created, aren't deleted
+            pending = self.outbox.entities()
+            missing = [task_id for task_id in missing if task_id not in pending]
+            if phase is not None:
+                phase.set(buckets=buckets, missing=len(missing))
+
+            # a scan of the wrong database or a partial one would delete everything
+            if len(missing) > max_deletions:
+                self.logger.warning(f"Reconciliation found {len(missing)} tasks deleted in Notion, more than [reconcile] "
+                                    f"max_deletions ({max_deletions}): nothing deleted")
+                return 0
+
+            # restored or synced again after the scan
+            pages = self.notion.resolve_ids(self.notion.tasks_db, missing)
+
+            deleted = 0
+            for task_id in missing:
+                if pages[task_id] is not None:
                     continue
 
-                # Update task
-                if task_exists:
-                    self.logger.info(f"Updating task: {task_content}")
-                    self.todoist.update_task(task)
-                    updated += 1
+                self.logger.info(f"Deleting task {task_id}: deleted in Notion")
+                self.write('todoist', task_id, 'delete')
+                self.after_writes([task_id], partial(self.config.forget_writes, task_id))
+                deleted += 1
 
-                # Create task
-                else:
-                    self.logger.info(f"Creating task: {task_content}") 
-                    task_id = self.todoist.add_task(task)
-                    # update the id on notion
-                    self.notion.update_id_task(task['notion_id'], task_id)
-                    created += 1
-        
+            if phase is not None:
+                phase.set(deleted=deleted)
+
+        return deleted
+
+
+    def sync_task(self, task_id, todoist_task, notion_task, done=None):
+        """Merge the changes of a task on Todoist and Notion from its last synced state,
+        writing to each side only the fields it's missing
+
+        Args:
+            task_id (str): task id
+            todoist_task (dict): task read from Todoist, None if unchanged
+            notion_task (dict): task parsed from Notion, None if unchanged
+            done (callable, optional): called when the writes are applied and recorded. Defaults to None.
+
+        Returns:
+            dict: {direction: action} of the writes, action "created", "updated" or "deleted"
+        """
+
+        done = done or (lambda: None)
+
+        # a task deleted in Todoist is deleted in Notion, even if it was edited there
+        if todoist_task is not None and todoist_task['is_deleted']:
+            action = self.push_to_notion(todoist_task)
+            self.after_writes([task_id], done)
+            return {'todoist_to_notion': action} if action is not None else {}
+
+        result = merge_task(self.config.load_base(task_id), todoist_task, notion_task, self.merge_policy, self.merge_fields)
+
+        for field, side in result.conflicts.items():
+            self.logger.info(f"Conflict on the {field} of task {task_id}: keeping the {side} value")
+            REGISTRY.inc('sync_conflicts_total', {'field': field, 'kept': side})
+
+        fields = result.fields
+        actions = {}
+        written = []
+
+        if result.notion_fields:
+            actions['todoist_to_notion'] = self.push_to_notion(todoist_task, result.notion_fields)
+            written.append('notion')
 
-        success_message = f"Todoist tasks sync successful: "
-        if created == 0 and updated == 0 and deleted == 0:
-            self.logger.info(success_message + "nothing to sync")
+            # a new page has all the fields of the Todoist task
+            if actions['todoist_to_notion'] == 'created':
+                fields = task_fields(todoist_task)
 
+        if result.todoist_fields:
+            actions['notion_to_todoist'] = self.push_to_todoist(notion_task, result.todoist_fields)
+            written.append('todoist')
+
+            # a new Todoist task has all the fields of the page and a new id, saved on the page too
+            if actions['notion_to_todoist'] == 'created':
+                self.after_writes([task_id], partial(self.config.forget_writes, task_id))
+                task_id = notion_task['id']
+                fields = task_fields(notion_task)
+                written.append('notion')
+
+        def record():
+            self.record_sync(task_id, fields, written)
+            done()
+
+        self.after_writes([task_id], record)
+        return actions
+
+
+    def record_sync(self, task_id, fields, written):
+        """Save the synced fields of a task, the base of its next merge, and the receipts
+        of the writes
+
+        Args:
+            task_id (str): task id
+            fields (dict): synced fields, see `task_fields`
+            written (list): sides written, "todoist" and/or "notion"
+        """
+
+        self.config.save_base(task_id, fields)
+
+        content_hash = fingerprint(fields)
+        properties_hash = fingerprint({field: value for field, value in fields.items() if field != 'description'})
+        for destination in written:
+            self.config.record_write(destination, task_id, content_hash, properties_hash)
+
+
+    def record_created(self, task, item_key):
+        """Record a Notion task created in Todoist and mark its item done
+
+        Args:
+            task (dict): task data, with the new id
+            item_key (str): progress key of the item
+        """
+
+        self.record_sync(task['id'], task_fields(task), ('todoist', 'notion'))
+        self.config.mark_done(self.activity, item_key)
+
+
+    def push_to_notion(self, task, fields=None):
+        """Write a Todoist task to Notion: create, update or delete its page
+
+        Args:
+            task (dict): task data
+            fields (list, optional): fields to update, None for all of them. Defaults to None.
+
+        Returns:
+            str: "created", "updated" or "deleted", None if nothing was written
+        """
+
+        task_content = task['content']
+
+        # Check if event exists in notion
+        notion_task_id = self.notion.check_task_exists(task['id'])
+
+        # Delete tasks
+        if task['is_deleted']:
+            self.logger.info(f"Deleting task: {task_content}")
+            if notion_task_id is None:
+                self.logger.info(f"Task does not exist in Notion, skipping")
+                return None
+
+            self.write('notion', task['id'], 'delete', target=notion_task_id)
+            self.after_writes([task['id']], partial(self.config.forget_writes, task['id']))
+            return 'deleted'
+
+        if notion_task_id is not None:
+            self.logger.info(f"Updating task: {task_content}")
         else:
-            if created > 0:
-                success_message += f"{created} created, "
-            if updated > 0:
-                success_message += f"{updated} updated, "
-            if deleted > 0:
-                success_message += f"{deleted} deleted, "
+            self.logger.info(f"Creating task: {task_content}")
 
-            self.logger.info(success_message[:-2])
+        return self.write_to_notion(task, notion_task_id, fields)
 
 
-        # Save last sync
-        self.sync_token = self.todoist.sync_token
-        self.last_sync = self.config.update_last_sync(self.activity, self.sync_token)
+    def write_to_notion(self, task, notion_task_id=None, fields=None):
+        """Create or update the page of a Todoist task
+
+        Args:
+            task (dict): task data
+            notion_task_id (str, optional): id of the page to update, None to create it. Defaults to None.
+            fields (list, optional): fields to update, None for all of them. Defaults to None.
+
+        Returns:
+            str: "created" or "updated"
+        """
+
+        if notion_task_id is not None:
+            # the body of the page is replaced, a call per block, only if the description changed
+            base = self.config.load_base(task['id']) if fields is None else None
+            if base is not None and base['description'] == task_fields(task)['description']:
+                fields = [field for field in TASK_FIELDS if field != 'description']
+
+            self.write('notion', task['id'], 'update', task, fields, notion_task_id)
+            return 'updated'
+
+        self.write('notion', task['id'], 'create', task)
+        return 'created'
+
+
+    def copy_to_notion(self, task, notion_task_id=None):
+        """Write a whole Todoist task to Notion and record it as synced
+
+        Args:
+            task (dict): task data
+            notion_task_id (str, optional): id of the page to update, None to create it. Defaults to None.
+        """
+
+        self.write_to_notion(task, notion_task_id)
+        self.record_sync(task['id'], task_fields(task), ('notion',))
+
+
+    def push_to_todoist(self, task, fields=None):
+        """Write a Notion task to Todoist: create or update it
+
+        Args:
+            task (dict): task data
+            fields (list, optional): fields to update, None for all of them. Defaults to None.
+
+        Returns:
+            str: "created" or "updated"
+        """
+
+        task_content = task['content']
+
+        # Update task
+        if self.todoist.check_task_exists(task['id']):
+            self.logger.info(f"Updating task: {task_content}")
+            self.write('todoist', task['id'], 'update', task, fields)
+            return 'updated'
+
+        # Create task
+        self.logger.info(f"Creating task: {task_content}")
+        self.add_to_todoist(task)
+        return 'created'
+
+
+    def add_to_todoist(self, task):
+        """Create a Notion task in Todoist and save the new id on Notion and in the task
+
+        Args:
+            task (dict): task data
+
+        Returns:
+            str: id of the new Todoist task
+        """
+
+        task['id'] = self.todoist.add_task(task)
+        # update the id on notion
+        self.write('notion', task['id'], 'update', task, ['id'], task['notion_id'])
+        return task['id']
+
+
+    def sync_item(self, item_id, direction='todoist_to_notion'):
+        """Sync a single task now, without waiting for the next cycle
+
+        Args:
+            item_id (str): task id, the Todoist id stored in the Id property of the Notion page
+            direction (str, optional): "todoist_to_notion" or "notion_to_todoist". Defaults to "todoist_to_notion".
+
+        Returns:
+            str: "created", "updated" or "deleted", None if nothing was written
+        """
+
+        if direction not in self.ITEM_DIRECTIONS:
+            raise ValueError(f"Unknown direction: {direction}")
+
+        with TRACER.span('projects'):
+            self.notion.update_projects()
+
+        # the stored writes go first, the item may be among them
+        with TRACER.span('replay'):
+            self.outbox.replay(retry=True)
+
+        if direction == 'todoist_to_notion':
+            with TRACER.span('todoist_read', id=item_id):
+                task = self.todoist.get_task(item_id)
+
+            # the task was deleted in Todoist
+            if task is None:
+                task = Task(id=item_id, content=item_id, is_deleted=True)
+
+            # the page may have changed since it was looked up by a cycle
+            self.notion.resolve_ids(self.notion.tasks_db, [item_id])
+
+            with TRACER.span('notion_write', id=item_id):
+                action = self.push_to_notion(task)
+
+            if action in ('created', 'updated'):
+                self.record_sync(item_id, task_fields(task), ('notion',))
+
+            return action
+
+        with TRACER.span('notion_read', id=item_id):
+            page = self.notion.get_from_db(self.notion.tasks_db, item_id, TASK_READ_PROPERTIES)
+
+        if page is None:
+            raise ValueError(f"Task {item_id} not found in Notion")
+
+        task = self.notion.parse_task(page)
+
+        with TRACER.span('todoist_write', id=item_id):
+            action = self.push_to_todoist(task)
+
+        self.record_sync(task['id'], task_fields(task), ('todoist', 'notion') if action == 'created' else ('todoist',))
+        return action
+
+
+    def backfill(self):
+        """Sync all the tasks in bulk, used for the first sync.
+        Both sides are read upfront and the writes are run concurrently.
+
+        Returns:
+            datetime.datetime: last sync
+        """
+
+        self.notion.update_projects()
+
+        done = self.config.begin_sync(self.activity)
+        if done:
+            self.logger.info(f"Resuming interrupted backfill: {len(done)} items already synced")
+
+        # Prefetch both sides
+        self.logger.info("Backfill: reading Todoist items")
+        todoist_tasks = [t for t in self.todoist.sync_read_items() if not t['is_deleted']]
+        sync_token = self.todoist.sync_token
+
+        self.logger.info("Backfill: reading Notion tasks")
+        notion_tasks = {}
+        new_pages = []
+        for page in self.notion.query_tasks():
+            task_id = self.notion.get_id_property(page)
+            if task_id is None:
+                new_pages.append(page)
+            else:
+                notion_tasks[task_id] = page['id']
+
+        # Compute the writes
+        jobs = []
+        for task in todoist_tasks:
+            item_key = f"todoist:{task['id']}:{fingerprint(task)}"
+            if item_key in done:
+                continue
+
+            notion_task_id = notion_tasks.get(task['id'])
+            if notion_task_id is not None:
+                jobs.append((item_key, f"updating {task['content']}", partial(self.copy_to_notion, task, notion_task_id)))
+            else:
+                jobs.append((item_key, f"creating {task['content']}", partial(self.copy_to_notion, task)))
+
+        # Pages without an id have been created in Notion. Pages with an id missing from
+        # Todoist are completed or deleted tasks, which aren't in a full sync: they are left alone
+        for page in new_pages:
+            item_key = f"notion:{page['id']}:{page['last_edited_time']}"
+            if item_key not in done:
+                jobs.append((item_key, f"creating page {page['id']} in Todoist", partial(self.add_page_to_todoist, page)))
+
+        Backfill(self.config, self.activity, self.progress_callback).run(jobs)
+
+        # The pages written by the backfill don't need to be read back, the ones edited in
+        # the last minute are recognized by their receipts
+        states = self.notion_feed.reset()
+
+        self.sync_token = sync_token
+        self.last_sync = self.config.update_last_sync(self.activity, self.sync_token, states)
         return self.last_sync
 
 
+    def add_page_to_todoist(self, page):
+        """Create a Notion page in Todoist and save the new id on Notion
+
+        Args:
+            page (dict): Notion page
+        """
+
+        task = self.notion.parse_task(page)
+        self.add_to_todoist(task)
+        self.record_sync(task['id'], task_fields(task), ('todoist', 'notion'))
+
 
 if __name__ == '__main__':
     # set logging level to debug
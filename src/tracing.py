@@ -0,0 +1,257 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Span:
+    """Timed operation of a sync cycle, with attributes and nested spans
+
+    Attributes:
+        name (str): span name
+        attributes (dict): attributes, e.g. item counts and ids
+        start (float): start time, seconds from the start of the trace
+        duration (float): duration in seconds
+        children (list): nested spans
+    """
+
+    def __init__(self, name, start, attributes=None):
+        self.name = name
+        self.start = start
+        self.duration = 0
+        self.attributes = attributes or {}
+        self.children = []
+
+
+    def set(self, **attributes):
+        """Set attributes of the span"""
+
+        self.attributes.update(attributes)
+
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6),
+            'attributes': self.attributes,
+            'children': [c.to_dict() for c in self.children]
+        }
+
+
+    @classmethod
+    def from_dict(cls, data):
+        span = cls(data['name'], data['start'], data['attributes'])
+        span.duration = data['duration']
+        span.children = [cls.from_dict(c) for c in data['children']]
+        return span
+
+
+class Tracer:
+    """Tracer of the sync cycles
+
+    A trace is started for every cycle with `trace`, the phases of the cycle are nested in
+    it with `span`. The spans are tracked per thread: outside of a trace they do nothing,
+    so the syncers can always be instrumented. At the end of the cycle the trace is written
+    as JSON to the traces folder.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.logger = logging.getLogger(__name__)
+
+
+    def now(self):
+        return time.perf_counter() - self.local.origin
+
+
+    @contextmanager
+    def trace(self, name, folder=None, keep=50, **attributes):
+        """Trace a sync cycle
+
+        Args:
+            name (str): name of the cycle, e.g. the activity
+            folder (str, optional): logs folder, the trace is written to "<folder>/traces". Defaults to None.
+            keep (int, optional): number of traces kept per name. Defaults to 50.
+            **attributes: attributes of the root span
+
+        Yields:
+            Span: root span
+        """
+
+        self.local.origin = time.perf_counter()
+        root = Span(name, 0, dict(attributes, time=datetime.datetime.now().isoformat()))
+        self.local.stack = [root]
+
+        try:
+            yield root
+
+        except Exception as e:
+            root.set(error=repr(e))
+            raise
+
+        finally:
+            root.duration = self.now()
+            self.local.stack = []
+
+            if folder is not None:
+                path = export(root, os.path.join(folder, 'traces'), keep)
+                if self.logger.isEnabledFor(logging.DEBUG):
+                    self.logger.debug(f"Trace saved to {path}\n{render_summary(root)}")
+
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Trace a phase of the cycle, nested in the current span
+
+        Args:
+            name (str): span name
+            **attributes: attributes
+
+        Yields:
+            Span: span, None outside of a trace
+        """
+
+        stack = getattr(self.local, 'stack', None)
+
+        if not stack:
+            yield None
+            return
+
+        span = Span(name, self.now(), attributes)
+        stack[-1].children.append(span)
+        stack.append(span)
+
+        try:
+            yield span
+
+        except Exception as e:
+            span.set(error=repr(e))
+            raise
+
+        finally:
+            span.duration = self.now() - span.start
+            stack.pop()
+
+
+    def iterate(self, iterable, name, **attributes):
+        """Iterate through an iterable, tracing the time spent waiting for the items in a
+        single span, e.g. the reads of a generator interleaved with the writes
+
+        Args:
+            iterable (iterable): iterable
+            name (str): span name
+            **attributes: attributes
+
+        Yields:
+            object: items
+        """
+
+        stack = getattr(self.local, 'stack', None)
+
+        if not stack:
+            yield from iterable
+            return
+
+        span = Span(name, self.now(), attributes)
+        stack[-1].children.append(span)
+        iterator = iter(iterable)
+        count = 0
+
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                span.duration += time.perf_counter() - start
+
+            count += 1
+            yield item
+
+        span.set(count=count)
+
+
+def export(root, folder, keep):
+    """Write a trace to a JSON file, deleting the oldest traces with the same name
+
+    Args:
+        root (Span): root span
+        folder (str): traces folder
+        keep (int): number of traces kept
+
+    Returns:
+        str: path of the trace
+    """
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    filename = f"{root.name}-{datetime.datetime.now():%Y-%m-%d_%H-%M-%S-%f}.json"
+    path = os.path.join(folder, filename)
+
+    with open(path, 'w') as f:
+        json.dump(root.to_dict(), f)
+
+    traces = sorted(f for f in os.listdir(folder) if f.startswith(root.name + '-') and f.endswith('.json'))
+    for old in traces[:-keep]:
+        os.remove(os.path.join(folder, old))
+
+    return path
+
+
+def render_summary(root, width=30, slowest=3):
+    """Render a flame-style summary of a trace: one line per span, with the spans with the
+    same name and parent merged, and the slowest of them listed with their attributes
+
+    Args:
+        root (Span): root span
+        width (int, optional): width of the bars. Defaults to 30.
+        slowest (int, optional): number of slowest spans listed for merged spans. Defaults to 3.
+
+    Returns:
+        str: summary
+    """
+
+    total = root.duration or 1
+    lines = []
+
+    def render(spans, depth):
+        groups = {}
+        for span in spans:
+            groups.setdefault(span.name, []).append(span)
+
+        for name, group in groups.items():
+            duration = sum(s.duration for s in group)
+            bar = '█' * max(1, round(duration / total * width))
+            label = '  ' * depth + name + (f' x{len(group)}' if len(group) > 1 else '')
+            attributes = '' if len(group) > 1 else ' '.join(f'{k}={v}' for k, v in group[0].attributes.items())
+            lines.append(f'{label:<40} {duration:9.3f}s {duration / total * 100:5.1f}% {bar:<{width}} {attributes}')
+
+            if len(group) > 1:
+                for span in sorted(group, key=lambda s: s.duration, reverse=True)[:slowest]:
+                    attributes = ' '.join(f'{k}={v}' for k, v in span.attributes.items())
+                    lines.append(f"{'  ' * (depth + 1)}slowest: {span.duration:.3f}s {attributes}")
+
+            render([c for s in group for c in s.children], depth + 1)
+
+    render([root], 0)
+    return '\n'.join(lines)
+
+
+TRACER = Tracer()
+
+
+if __name__ == '__main__':
+    # print the summary of a trace
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', help='path to a trace file')
+    args = parser.parse_args()
+
+    with open(args.trace, 'r') as f:
+        print(render_summary(Span.from_dict(json.load(f))))
@@ -0,0 +1,211 @@
+import time
+from collections import ChainMap
+from metrics import REGISTRY
+
+
+class PendingWrite:
+    """Write of an entity waiting in a `WriteQueue`, with the later writes coalesced into it
+
+    Attributes:
+        destination (str): "todoist" or "notion"
+        entity_id (str): task id
+        action (str): "create", "update" or "delete", None if the writes cancel out
+        data (ChainMap): values of the fields, the ones of the last write first
+        fields (list): fields to update, None for all of them
+        target (str): id of the object written (e.g. the Notion page), None for a create
+        key (str): idempotency key, given by the outbox
+        seq (int): position in the outbox, None if not stored
+        attempts (int): failed attempts to apply the write
+        modified (datetime.datetime): time of the oldest change written on the source, None if unknown
+        replayed (bool): True if the write may have been applied before: stored by a previous run or tried already
+        callbacks (list): functions called when the write is stored in the outbox
+        applied (bool): True once the write is applied
+    """
+
+    def __init__(self, destination, entity_id, action, data, fields=None, target=None, key=None, seq=None, attempts=0, modified=None):
+        self.destination = destination
+        self.entity_id = entity_id
+        self.action = action
+        self.data = ChainMap({}, data) if data is not None else None
+        self.fields = list(fields) if fields is not None else None
+        self.target = target
+        self.key = key
+        self.seq = seq
+        self.attempts = attempts
+        self.modified = modified
+        self.replayed = False
+        self.callbacks = []
+        self.applied = False
+
+
+    def coalesce(self, action, data, fields=None, target=None, modified=None):
+        """Merge a later write of the same entity:
+        - create + update: a create with the updated values
+        - update + update: an update of both the fields
+        - create + delete: nothing to write
+        - update + delete: a delete
+        - delete + create: an update of all the fields of the object not yet deleted
+        - delete + update: a delete
+
+        Args:
+            action (str): "create", "update" or "delete"
+            data (Mapping): values of the fields, None for a delete
+            fields (list, optional): fields to update, None for all of them. Defaults to None.
+            target (str, optional): id of the object written. Defaults to None.
+            modified (datetime.datetime, optional): time of the change on the source. Defaults to None.
+        """
+
+        # the lag is measured from the first change written
+        if self.modified is None or (modified is not None and modified < self.modified):
+            self.modified = modified
+
+        if self.action is None:
+            self.action, self.target = action, target
+            self.data = ChainMap({}, data) if data is not None else None
+            self.fields = list(fields) if fields is not None else None
+            return
+
+        if action == 'delete':
+            self.action = None if self.action == 'create' else 'delete'
+            self.target = target or self.target
+            return
+
+        if self.action == 'delete':
+            if action == 'create':
+                self.action, self.fields, self.data = 'update', None, ChainMap({}, data)
+            return
+
+        # the values of the later write are the most recent ones
+        self.data.maps[0].update(data)
+
+        if self.action == 'update':
+            if action == 'create' or fields is None or self.fields is None:
+                self.fields = None
+            else:
+                self.fields += [field for field in fields if field not in self.fields]
+
+            self.target = self.target or target
+
+
+    def done(self):
+        """Mark the write as applied"""
+
+        self.applied = True
+
+
+    def commit(self):
+        """Call the callbacks of the write, once it's stored"""
+
+        for callback in self.callbacks:
+            callback()
+
+
+class WriteQueue:
+    """Write-behind queue in front of Todoist and Notion
+
+    The writes are held and coalesced per entity (see `PendingWrite.coalesce`), so the
+    bursts of changes of the same task become a single call, then stored in the outbox
+    and applied in the order of their first write by the writer of their destination,
+    which can batch them. `tick` flushes them when the oldest one is older than `seconds`
+    or when `max_pending` are waiting, `flush` flushes them all: it's called at the end of
+    every cycle, so no write is left only in memory when the checkpoint is saved.
+
+    Attributes:
+        outbox (Outbox): durable queue of the writes
+        seconds (float): age of the oldest pending write that triggers a flush
+        max_pending (int): pending writes that trigger a flush
+        pending (dict): {(destination, entity id): PendingWrite}
+    """
+
+    def __init__(self, outbox, seconds=5, max_pending=100):
+        self.outbox = outbox
+        self.seconds = seconds
+        self.max_pending = max_pending
+        self.pending = {}
+        self.oldest = None
+
+
+    def put(self, destination, entity_id, action, data=None, fields=None, target=None, modified=None):
+        """Queue a write, coalescing it with the pending write of the same entity
+
+        Args:
+            destination (str): "todoist" or "notion"
+            entity_id (str): task id
+            action (str): "create", "update" or "delete"
+            data (Mapping, optional): values of the fields, None for a delete. Defaults to None.
+            fields (list, optional): fields to update, None for all of them. Defaults to None.
+            target (str, optional): id of the object written, None for a create. Defaults to None.
+            modified (datetime.datetime, optional): time of the change on the source, for the propagation lag. Defaults to None.
+
+        Returns:
+            PendingWrite: pending write of the entity
+        """
+
+        key = (destination, entity_id)
+        write = self.pending.get(key)
+
+        if write is None:
+            write = self.pending[key] = PendingWrite(destination, entity_id, action, data, fields, target, modified=modified)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+        else:
+            write.coalesce(action, data, fields, target, modified)
+            REGISTRY.inc('write_queue_coalesced_total', {'destination': destination})
+
+        return write
+
+
+    def after(self, entity_ids, callback):
+        """Call a function when the pending writes of some entities are stored in the
+        outbox, now if there are none
+
+        Args:
+            entity_ids (list): entity ids
+            callback (callable): function without arguments
+        """
+
+        waiting = [write for (_, entity_id), write in self.pending.items() if entity_id in entity_ids]
+        if not waiting:
+            callback()
+            return
+
+        remaining = [len(waiting)]
+
+        def done():
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                callback()
+
+        for write in waiting:
+            write.callbacks.append(done)
+
+
+    def tick(self):
+        """Apply the pending writes if the oldest one waited `seconds` or `max_pending` are waiting"""
+
+        if self.oldest is None:
+            return
+
+        if len(self.pending) >= self.max_pending or time.monotonic() - self.oldest >= self.seconds:
+            self.flush()
+
+
+    def flush(self):
+        """Store all the pending writes in the outbox, then apply the writes of the outbox
+
+        Returns:
+            int: number of writes applied
+        """
+
+        writes = list(self.pending.values())
+        self.pending = {}
+        self.oldest = None
+
+        # the writes that cancelled out (e.g. a task created and deleted) aren't stored
+        self.outbox.append([write for write in writes if write.action is not None])
+
+        for write in writes:
+            write.commit()
+            REGISTRY.inc('write_queue_flushed_total', {'destination': write.destination})
+
+        return self.outbox.replay()
@@ -0,0 +1,30 @@
+import os
+import sys
+
+# the modules of the app are imported from src, as when it's run, the emulators from benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import pytest
+from emulators import NotionEmulator, TodoistEmulator
+from load_generator import seed, write_config
+
+
+@pytest.fixture
+def emulated(tmp_path):
+    """Notion and Todoist emulators seeded with 10 tasks, and a data folder with their config
+
+    Yields:
+        tuple: (NotionEmulator, TodoistEmulator, Notion database ids, data folder)
+    """
+
+    notion = NotionEmulator()
+    todoist = TodoistEmulator()
+    databases = seed(notion, todoist, 10)
+    write_config(str(tmp_path), notion.start(), todoist.start(), databases)
+
+    yield notion, todoist, databases, str(tmp_path)
+
+    notion.stop()
+    todoist.stop()
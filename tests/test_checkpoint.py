@@ -0,0 +1,51 @@
+import json
+import os
+from checkpoint import CheckpointStore
+from config import Config
+from todoist_sync import TodoistSync
+
+
+def test_states_are_saved_with_the_checkpoint(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    store.begin_run('todoist', '2024-01-01 10:00:00.000000')
+    store.mark_done('todoist', 'item')
+
+    store.save('todoist', '2024-01-01 10:01:00.000000', 'token', {'feed': json.dumps({'high_water': 'now'})})
+
+    assert store.load('todoist') == ('2024-01-01 10:01:00.000000', 'token')
+    assert json.loads(store.load_state('feed')) == {'high_water': 'now'}
+    assert store.begin_run('todoist', '2024-01-01 10:02:00.000000') == set()
+
+
+def test_state_is_saved_alone(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    assert store.load_state('times') is None
+
+    store.save_state('times', '{}')
+    store.save_state('times', '{"a": 1}')
+    assert store.load_state('times') == '{"a": 1}'
+
+
+def test_legacy_state_files_are_read_until_replaced(emulated):
+    notion, todoist, databases, folder = emulated
+    with open(os.path.join(folder, 'calendar_event_times.json'), 'w') as f:
+        json.dump({'event': ['start', 'end']}, f)
+
+    config = Config(data_folder=folder)
+    assert config.load_state('calendar_event_times') == {'event': ['start', 'end']}
+
+    config.save_state('calendar_event_times', {})
+    assert config.load_state('calendar_event_times') == {}
+
+
+def test_sync_state_is_in_the_checkpoints_store(emulated):
+    notion, todoist, databases, folder = emulated
+    syncer = TodoistSync(Config(data_folder=folder))
+    syncer.sync()
+    syncer.sync()
+
+    # the feed and the reconciliation are saved with the checkpoint, not beside it
+    assert not [name for name in os.listdir(folder) if name.endswith('.json')]
+    state = syncer.config.load_state('notion_tasks_feed')
+    assert state['high_water'] is not None
+    assert syncer.config.load_state('todoist_reconcile') is not None
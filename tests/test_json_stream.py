@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from json_stream import iter_array
+
+
+DOCUMENT = {
+    'sync_token': 'abc',
+    'full_sync': False,
+    'items': [{'id': '1', 'content': 'Tâche ✓', 'priority': 4, 'due': None}, {'id': '2', 'content': 'Task', 'priority': 12.5}],
+    'projects': [],
+    'user': {'tz_info': {'timezone': 'Europe/Paris'}},
+}
+
+
+def chunked(data, size):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def decode(chunks, key='items'):
+    fields = {}
+    entries = list(iter_array(chunks, key, fields))
+    return entries, fields
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 1000])
+def test_entries_and_fields_whatever_the_chunks(size):
+    entries, fields = decode(chunked(json.dumps(DOCUMENT, indent=1, ensure_ascii=False).encode('utf-8'), size))
+
+    assert entries == DOCUMENT['items']
+    assert fields == {k: v for k, v in DOCUMENT.items() if k != 'items'}
+
+
+def test_str_chunks():
+    entries, fields = decode(chunked(json.dumps(DOCUMENT, ensure_ascii=False), 5))
+
+    assert entries == DOCUMENT['items']
+    assert fields['sync_token'] == 'abc'
+
+
+def test_character_split_across_chunks():
+    data = json.dumps({'items': ['✓']}, ensure_ascii=False).encode('utf-8')
+    start = data.index('✓'.encode('utf-8'))
+
+    entries, _ = decode([data[:start + 1], data[start + 1:start + 2], data[start + 2:]])
+
+    assert entries == ['✓']
+
+
+def test_number_split_across_chunks():
+    entries, fields = decode([b'{"items": [12', b'34], "count": 5', b'6}'])
+
+    assert entries == [1234]
+    assert fields == {'count': 56}
+
+
+def test_empty_object_and_array():
+    assert decode([b' { } ']) == ([], {})
+    assert decode([b'{"items": [ ], "sync_token": "abc"}']) == ([], {'sync_token': 'abc'})
+
+
+def test_missing_array():
+    assert decode([b'{"sync_token": "abc"}']) == ([], {'sync_token': 'abc'})
+
+
+def test_array_that_is_not_streamed():
+    assert decode([b'{"items": null}']) == ([], {'items': None})
+
+
+def test_entries_yielded_as_they_arrive():
+    def chunks():
+        yield b'{"items": [1, '
+        assert entries == [1]
+        yield b'2]}'
+
+    entries = []
+    for entry in iter_array(chunks(), 'items', {}):
+        entries.append(entry)
+
+    assert entries == [1, 2]
+
+
+@pytest.mark.parametrize('data', [b'', b'{"items": [1, 2', b'{"items": [{"id": "1"', b'{"sync_token": "ab', b'{"items": [1] "a": 2}', b'[1, 2]'])
+def test_invalid_stream(data):
+    with pytest.raises(ValueError):
+        decode(chunked(data, 4))
@@ -0,0 +1,108 @@
+import datetime
+from fingerprint import task_fields
+from merge import merge_task
+
+
+def make_task(**values):
+    task = {'id': '1', 'content': 'Task', 'description': '', 'labels': [], 'checked': False, 'due': None,
+            'project': 'Inbox', 'priority': 1, 'recurrence': None}
+    task.update(values)
+    return task
+
+
+def test_change_on_one_side_is_written_to_the_other():
+    base = task_fields(make_task())
+    result = merge_task(base, make_task(content='Changed'), None)
+
+    assert result.fields['content'] == 'Changed'
+    assert result.notion_fields == ['content']
+    assert result.todoist_fields == []
+    assert result.conflicts == {}
+
+
+def test_changes_of_different_fields_are_merged():
+    base = task_fields(make_task())
+    result = merge_task(base, make_task(content='Changed'), make_task(priority=4))
+
+    assert result.fields['content'] == 'Changed'
+    assert result.fields['priority'] == 4
+    assert result.notion_fields == ['content']
+    assert result.todoist_fields == ['priority']
+    assert result.conflicts == {}
+
+
+def test_same_change_on_both_sides_is_not_a_conflict():
+    base = task_fields(make_task())
+    result = merge_task(base, make_task(content='Changed'), make_task(content='Changed'))
+
+    assert result.todoist_fields == result.notion_fields == []
+    assert result.conflicts == {}
+
+
+def test_conflict_resolved_by_the_policy():
+    base = task_fields(make_task())
+    result = merge_task(base, make_task(content='Todoist'), make_task(content='Notion'), policy='notion')
+
+    assert result.fields['content'] == 'Notion'
+    assert result.todoist_fields == ['content']
+    assert result.conflicts == {'content': 'notion'}
+
+
+def test_conflict_resolved_by_the_policy_of_the_field():
+    base = task_fields(make_task())
+    result = merge_task(base, make_task(content='Todoist', priority=2), make_task(content='Notion', priority=3),
+                        policy='todoist', field_policies={'priority': 'notion'})
+
+    assert result.fields['content'] == 'Todoist'
+    assert result.fields['priority'] == 3
+    assert result.conflicts == {'content': 'todoist', 'priority': 'notion'}
+
+
+def test_newest_policy_keeps_the_side_edited_last():
+    base = task_fields(make_task())
+    edited = datetime.datetime(2024, 1, 1, 10, 0, tzinfo=datetime.timezone.utc)
+    todoist_task = make_task(content='Todoist', last_modified=edited)
+
+    result = merge_task(base, todoist_task, make_task(content='Notion', last_edited_time='2024-01-01T10:05:00.000Z'), policy='newest')
+    assert result.conflicts == {'content': 'notion'}
+
+    result = merge_task(base, todoist_task, make_task(content='Notion', last_edited_time='2024-01-01T09:55:00.000Z'), policy='newest')
+    assert result.conflicts == {'content': 'todoist'}
+
+
+def test_newest_policy_keeps_todoist_without_its_edit_time():
+    base = task_fields(make_task())
+    result = merge_task(base, make_task(content='Todoist'), make_task(content='Notion', last_edited_time='2024-01-01T10:05:00.000Z'),
+                        policy='newest')
+
+    assert result.fields['content'] == 'Todoist'
+    assert result.conflicts == {'content': 'todoist'}
+
+
+def test_default_policy_keeps_todoist():
+    base = task_fields(make_task())
+    result = merge_task(base, make_task(content='Todoist'), make_task(content='Notion'))
+
+    assert result.conflicts == {'content': 'todoist'}
+
+
+def test_single_side_without_base_is_copied_whole():
+    result = merge_task(None, make_task(content='New'), None)
+
+    assert result.fields == task_fields(make_task(content='New'))
+    assert result.notion_fields == list(result.fields)
+    assert result.todoist_fields == []
+
+
+def test_both_sides_without_base_conflict_on_the_differences():
+    result = merge_task(None, make_task(content='Todoist'), make_task(content='Notion', priority=4), policy='todoist')
+
+    assert result.conflicts == {'content': 'todoist', 'priority': 'todoist'}
+    assert result.notion_fields == ['content', 'priority']
+
+
+def test_fields_are_compared_normalized():
+    base = task_fields(make_task(labels=['Home']))
+    result = merge_task(base, make_task(labels=['home'], description='  '), make_task(labels=['Home']))
+
+    assert result.todoist_fields == result.notion_fields == []
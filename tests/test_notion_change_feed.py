@@ -0,0 +1,110 @@
+import datetime
+from config import Config
+from notion_change_feed import NotionChangeFeed, parse_notion_time
+from todoist_sync import TodoistSync
+
+UTC = datetime.timezone.utc
+
+
+class FakeNotion:
+    def __init__(self):
+        self.pages = {}
+
+    def edit(self, page_id, edited):
+        self.pages[page_id] = {'id': page_id, 'last_edited_time': edited, 'properties': {}}
+
+    def query_tasks(self, from_date=None):
+        return [page for page in self.pages.values() if from_date is None or parse_notion_time(page['last_edited_time']) >= from_date]
+
+
+class FakeConfig:
+    def __init__(self):
+        self.states = {}
+
+    def load_state(self, name):
+        return self.states.get(name)
+
+    def save_state(self, name, state):
+        self.states[name] = state
+
+
+def sync(feed, until):
+    pages = [page['id'] for page in feed.changes(until)]
+
+    # saved with the checkpoint by the syncers
+    for name, state in feed.commit().items():
+        feed.config.save_state(name, state)
+
+    return pages
+
+
+def test_pages_processed_in_a_past_minute_are_skipped():
+    notion = FakeNotion()
+    feed = NotionChangeFeed(notion, FakeConfig(), 'feed')
+
+    notion.edit('a', '2024-01-01T10:00:00.000Z')
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 1, 30, tzinfo=UTC)) == ['a']
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 2, 30, tzinfo=UTC)) == []
+
+    notion.edit('a', '2024-01-01T10:02:00.000Z')
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 3, 30, tzinfo=UTC)) == ['a']
+
+
+def test_pages_edited_in_the_minute_of_the_mark_are_returned_again():
+    notion = FakeNotion()
+    feed = NotionChangeFeed(notion, FakeConfig(), 'feed')
+
+    # processed while its minute isn't over: a later edit in the same minute keeps the edit time
+    notion.edit('a', '2024-01-01T10:00:00.000Z')
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 0, 20, tzinfo=UTC)) == ['a']
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 0, 40, tzinfo=UTC)) == ['a']
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 1, 10, tzinfo=UTC)) == ['a']
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 2, 10, tzinfo=UTC)) == []
+
+
+def test_pages_found_late_in_the_overlap_window_are_returned():
+    notion = FakeNotion()
+    feed = NotionChangeFeed(notion, FakeConfig(), 'feed')
+
+    notion.edit('a', '2024-01-01T10:00:00.000Z')
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 1, 30, tzinfo=UTC)) == ['a']
+
+    # edited before the mark, but not yet returned by the query of the last cycle
+    notion.edit('b', '2024-01-01T10:00:00.000Z')
+    assert sync(feed, datetime.datetime(2024, 1, 1, 10, 2, 30, tzinfo=UTC)) == ['b']
+
+
+def test_state_is_saved_and_loaded():
+    notion = FakeNotion()
+    config = FakeConfig()
+    feed = NotionChangeFeed(notion, config, 'feed')
+
+    notion.edit('a', '2024-01-01T10:00:00.000Z')
+    sync(feed, datetime.datetime(2024, 1, 1, 10, 1, 30, tzinfo=UTC))
+
+    restarted = NotionChangeFeed(notion, config, 'feed')
+    assert restarted.high_water == datetime.datetime(2024, 1, 1, 10, 1, tzinfo=UTC)
+    assert sync(restarted, datetime.datetime(2024, 1, 1, 10, 2, 30, tzinfo=UTC)) == []
+
+
+def test_body_edited_in_the_minute_of_a_sync_reaches_todoist(emulated):
+    notion, todoist, databases, folder = emulated
+    syncer = TodoistSync(Config(data_folder=folder))
+    syncer.sync()
+
+    with notion.lock:
+        page = next(p for p in notion.pages.values() if p['parent']['database_id'] == databases['tasks_db'])
+        task_id = page['properties']['Id']['rich_text'][0]['plain_text']
+        notion.update_page(page['id'], {'Nome': {'title': [{'text': {'content': 'Renamed'}}]}})
+    syncer.sync()
+
+    # the body is edited after the sync, in the same minute as the rename
+    with notion.lock:
+        paragraph = {'object': 'block', 'type': 'paragraph', 'paragraph': {'rich_text': [{'type': 'text', 'text': {'content': 'new notes'}}]}}
+        notion.blocks[page['id']] = [notion.create_block(paragraph)]
+        page['last_edited_time'] = notion.edit_time()
+    syncer.sync()
+    syncer.sync()
+
+    assert todoist.items[task_id]['content'] == 'Renamed'
+    assert todoist.items[task_id]['description'].strip() == 'new notes'
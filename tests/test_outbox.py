@@ -0,0 +1,87 @@
+"""Outages and restarts of the Todoist sync, against the Notion and Todoist emulators"""
+
+import os
+import pytest
+import toml
+from config import Config
+from todoist_sync import TodoistSync
+
+
+def pages_of(notion, databases, task_id):
+    with notion.lock:
+        return [page for page in notion.pages.values() if page['parent']['database_id'] == databases['tasks_db'] and not page['archived']
+                and [t['plain_text'] for t in page['properties']['Id']['rich_text']] == [task_id]]
+
+
+def test_task_not_yet_created_in_notion_is_not_reconciled(emulated):
+    notion, todoist, databases, folder = emulated
+    syncer = TodoistSync(Config(data_folder=folder))
+    syncer.sync()
+
+    with todoist.lock:
+        item = todoist.add_item({'content': 'New task'})
+
+    # the page can't be created: the reconciliation of the cycle doesn't find it
+    notion.failures['POST /v1/pages'] = 503
+    syncer.sync()
+
+    assert syncer.config.load_state('todoist_reconcile') is not None
+    assert syncer.outbox.pending() == {'notion': 1}
+    assert not todoist.items[item['id']]['is_deleted']
+
+    del notion.failures['POST /v1/pages']
+    syncer.sync()
+
+    assert syncer.outbox.pending() == {}
+    assert len(pages_of(notion, databases, item['id'])) == 1
+    assert not todoist.items[item['id']]['is_deleted']
+
+
+def test_create_replayed_after_a_crash_is_applied_once(emulated):
+    notion, todoist, databases, folder = emulated
+    syncer = TodoistSync(Config(data_folder=folder))
+    syncer.sync()
+
+    with todoist.lock:
+        item = todoist.add_item({'content': 'New task'})
+
+    # the page is created, then the run stops before removing the write from the outbox
+    def crash(seqs):
+        raise RuntimeError('crash')
+
+    syncer.config.complete_writes = crash
+    with pytest.raises(RuntimeError):
+        syncer.sync()
+
+    assert len(pages_of(notion, databases, item['id'])) == 1
+
+    restarted = TodoistSync(Config(data_folder=folder))
+    restarted.sync()
+
+    assert restarted.outbox.pending() == {}
+    assert len(pages_of(notion, databases, item['id'])) == 1
+
+
+def test_dropped_write_forgets_the_synced_state(emulated):
+    notion, todoist, databases, folder = emulated
+
+    path = os.path.join(folder, 'config.toml')
+    config = toml.load(path)
+    config['outbox'] = {'max_attempts': 1}
+    with open(path, 'w') as f:
+        toml.dump(config, f)
+
+    syncer = TodoistSync(Config(data_folder=folder))
+    syncer.sync()
+
+    with todoist.lock:
+        item = next(i for i in todoist.items.values() if not i['is_deleted'])
+        todoist.update_item({'id': item['id'], 'content': 'Edited'})
+
+    # the update of the page is rejected
+    notion.failures['PATCH /v1/pages/{id}'] = 400
+    syncer.sync()
+
+    assert syncer.outbox.pending() == {}
+    assert syncer.config.load_base(item['id']) is None
+    assert syncer.config.load_write('notion', item['id']) is None
@@ -0,0 +1,80 @@
+from checkpoint import CheckpointStore
+from config import Config
+from reconcile import IdBuckets, id_hash, missing_from
+from todoist_sync import TodoistSync
+
+
+def test_ids_missing_from_the_scan():
+    stored = IdBuckets(str(i) for i in range(1000))
+    scan = IdBuckets(str(i) for i in range(1000) if i not in (3, 500))
+
+    loaded = []
+
+    def load_buckets(buckets):
+        loaded.extend(buckets)
+        return [item_id for bucket in buckets for item_id in stored.buckets.get(bucket, ())]
+
+    missing, buckets = missing_from(stored.digests, scan, load_buckets)
+
+    assert missing == ['3', '500']
+    # only the buckets of the missing ids are read
+    assert sorted(loaded) == sorted({id_hash('3')[0], id_hash('500')[0]})
+    assert buckets == len(loaded)
+
+
+def test_same_ids_read_nothing():
+    stored = IdBuckets(['a', 'b', 'c'])
+
+    def load_buckets(buckets):
+        raise AssertionError('no bucket differs')
+
+    assert missing_from(stored.digests, IdBuckets(['c', 'b', 'a']), load_buckets) == ([], 0)
+
+
+def test_ids_only_in_the_scan_are_not_missing():
+    stored = IdBuckets(['a'])
+    missing, buckets = missing_from(stored.digests, IdBuckets(['a', 'b']),
+                                    lambda buckets: [item_id for bucket in buckets for item_id in stored.buckets.get(bucket, ())])
+
+    assert missing == []
+    assert buckets == 1
+
+
+def test_stored_digests_follow_the_bases(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+
+    for i in range(100):
+        store.save_base(str(i), '{}', 'now')
+    store.save_base('5', '{"content": "edited"}', 'later')
+    store.delete_base('7')
+    store.delete_base('unknown')
+
+    expected = IdBuckets(str(i) for i in range(100) if i != 7)
+    assert store.base_digests() == expected.digests
+
+    bucket = id_hash('8')[0]
+    assert sorted(store.base_entities([bucket])) == sorted(expected.buckets[bucket])
+
+    # the digests of a database saved before them are computed when it's opened
+    with store.connection() as db:
+        db.execute('DELETE FROM base_buckets')
+        db.execute('UPDATE bases SET bucket = NULL')
+
+    assert CheckpointStore(str(tmp_path / 'checkpoints.db')).base_digests() == expected.digests
+
+
+def test_task_deleted_in_notion_is_deleted_in_todoist(emulated):
+    notion, todoist, databases, folder = emulated
+    syncer = TodoistSync(Config(data_folder=folder))
+    syncer.sync()
+
+    with notion.lock:
+        page = next(p for p in notion.pages.values() if p['parent']['database_id'] == databases['tasks_db'])
+        task_id = page['properties']['Id']['rich_text'][0]['plain_text']
+        page['archived'] = True
+
+    syncer.sync()
+
+    assert todoist.items[task_id]['is_deleted']
+    assert sum(not item['is_deleted'] for item in todoist.items.values()) == 9
+    assert syncer.config.load_base(task_id) is None
@@ -0,0 +1,129 @@
+from write_queue import PendingWrite, WriteQueue
+
+
+def test_create_then_update_is_a_create_with_the_updated_values():
+    write = PendingWrite('notion', '1', 'create', {'content': 'Task', 'priority': 1})
+    write.coalesce('update', {'content': 'Edited'}, ['content'], 'page')
+
+    assert write.action == 'create'
+    assert dict(write.data) == {'content': 'Edited', 'priority': 1}
+    assert write.fields is None
+    assert write.target is None
+
+
+def test_update_then_update_is_an_update_of_both_the_fields():
+    write = PendingWrite('todoist', '1', 'update', {'content': 'Task'}, ['content'], 'page')
+    write.coalesce('update', {'priority': 4, 'content': 'Edited'}, ['priority', 'content'])
+
+    assert write.action == 'update'
+    assert dict(write.data) == {'content': 'Edited', 'priority': 4}
+    assert write.fields == ['content', 'priority']
+    assert write.target == 'page'
+
+
+def test_update_then_update_of_all_the_fields():
+    write = PendingWrite('notion', '1', 'update', {'content': 'Task'}, ['content'], 'page')
+    write.coalesce('update', {'priority': 4})
+
+    assert write.fields is None
+
+
+def test_create_then_delete_is_nothing():
+    write = PendingWrite('notion', '1', 'create', {'content': 'Task'})
+    write.coalesce('delete', None, target='page')
+
+    assert write.action is None
+
+
+def test_update_then_delete_is_a_delete():
+    write = PendingWrite('notion', '1', 'update', {'content': 'Task'}, ['content'], 'page')
+    write.coalesce('delete', None)
+
+    assert write.action == 'delete'
+    assert write.target == 'page'
+
+
+def test_delete_then_create_is_an_update_of_all_the_fields():
+    write = PendingWrite('notion', '1', 'delete', None, target='page')
+    write.coalesce('create', {'content': 'Task'})
+
+    assert write.action == 'update'
+    assert dict(write.data) == {'content': 'Task'}
+    assert write.fields is None
+    assert write.target == 'page'
+
+
+def test_delete_then_update_is_a_delete():
+    write = PendingWrite('notion', '1', 'delete', None, target='page')
+    write.coalesce('update', {'content': 'Task'}, ['content'])
+
+    assert write.action == 'delete'
+    assert write.data is None
+
+
+def test_write_after_cancelled_ones_replaces_them():
+    write = PendingWrite('notion', '1', 'create', {'content': 'Task'})
+    write.coalesce('delete', None)
+    write.coalesce('update', {'content': 'Edited'}, ['content'], 'page')
+
+    assert write.action == 'update'
+    assert dict(write.data) == {'content': 'Edited'}
+    assert write.fields == ['content']
+    assert write.target == 'page'
+
+
+def test_coalesced_write_keeps_the_oldest_change():
+    write = PendingWrite('notion', '1', 'update', {'content': 'Task'}, ['content'], 'page', modified=2)
+    write.coalesce('update', {'content': 'Edited'}, ['content'], modified=1)
+    write.coalesce('update', {'content': 'Edited again'}, ['content'], modified=3)
+
+    assert write.modified == 1
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.stored = []
+
+    def append(self, writes):
+        self.stored += writes
+
+    def replay(self):
+        return len(self.stored)
+
+
+def test_queue_stores_the_coalesced_writes_and_calls_back():
+    outbox = FakeOutbox()
+    queue = WriteQueue(outbox, seconds=60, max_pending=10)
+    called = []
+
+    queue.put('notion', '1', 'create', {'content': 'Task'})
+    queue.put('notion', '1', 'update', {'content': 'Edited'}, ['content'])
+    queue.put('todoist', '2', 'update', {'priority': 4}, ['priority'])
+    queue.put('notion', '3', 'create', {'content': 'Other'})
+    queue.put('notion', '3', 'delete')
+    queue.after(['1', '2'], lambda: called.append('1 and 2'))
+    queue.after(['4'], lambda: called.append('4'))
+
+    # nothing pending for 4: called right away
+    assert called == ['4']
+
+    queue.tick()
+    assert outbox.stored == []
+
+    assert queue.flush() == 2
+    assert [(w.destination, w.entity_id, w.action) for w in outbox.stored] == [('notion', '1', 'create'), ('todoist', '2', 'update')]
+    assert called == ['4', '1 and 2']
+    assert queue.pending == {}
+
+
+def test_queue_flushes_when_full():
+    outbox = FakeOutbox()
+    queue = WriteQueue(outbox, seconds=60, max_pending=2)
+
+    queue.put('notion', '1', 'update', {'content': 'Task'}, ['content'], 'page')
+    queue.tick()
+    assert outbox.stored == []
+
+    queue.put('notion', '2', 'update', {'content': 'Task'}, ['content'], 'page')
+    queue.tick()
+    assert len(outbox.stored) == 2